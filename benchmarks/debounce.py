@@ -0,0 +1,92 @@
+"""
+Бенчмарк ожидания пауз в сообщениях: опрос `asyncio.sleep(0.3)` против `src.tools.debounce.Debouncer`.
+
+Каждый ключ получает пачку сообщений с небольшими интервалами и ждёт `DELAY` секунд тишины.
+Меряется задержка выдачи пачки после конца паузы и процессорное время цикла событий.
+
+Запуск из корня репозитория: `python -m benchmarks.debounce [число ключей]`
+"""
+import asyncio
+import random
+import statistics
+import sys
+import time
+from datetime import datetime, UTC, timedelta
+
+from src.tools.debounce import Debouncer
+
+DELAY = 1.0
+MESSAGES_PER_KEY = 3
+GAP = 0.2
+
+
+async def _feed(add, key: int, rng: random.Random) -> None:
+    for _ in range(MESSAGES_PER_KEY - 1):
+        await asyncio.sleep(rng.uniform(0, GAP))
+        add(key)
+
+
+async def run_polling(keys: int) -> tuple[list[float], float]:
+    """Прежняя реализация: каждая пачка проверяет время последнего сообщения раз в 0.3 секунды."""
+    queue: dict[int, list[datetime]] = {}
+    last: dict[int, float] = {}
+    lateness = []
+    rng = random.Random(0)
+
+    def add(key: int) -> None:
+        queue.setdefault(key, []).append(datetime.now(UTC))
+        last[key] = time.monotonic()
+
+    async def waiter(key: int) -> None:
+        add(key)
+        feeder = asyncio.create_task(_feed(add, key, rng))
+        while datetime.now(UTC) - queue[key][-1] < timedelta(seconds=DELAY):
+            await asyncio.sleep(0.3)
+        del queue[key]
+        lateness.append(time.monotonic() - last[key] - DELAY)
+        await feeder
+
+    cpu = time.process_time()
+    await asyncio.gather(*(waiter(key) for key in range(keys)))
+    return lateness, time.process_time() - cpu
+
+
+async def run_debouncer(keys: int) -> tuple[list[float], float]:
+    debouncer: Debouncer[float] = Debouncer(DELAY)
+    last: dict[int, float] = {}
+    lateness = []
+    rng = random.Random(0)
+
+    def add(key: int) -> bool:
+        last[key] = time.monotonic()
+        return debouncer.add(key, last[key])
+
+    async def waiter(key: int) -> None:
+        add(key)
+        feeder = asyncio.create_task(_feed(add, key, rng))
+        items = await debouncer.wait(key)
+        assert len(items) == MESSAGES_PER_KEY
+        lateness.append(time.monotonic() - last[key] - DELAY)
+        await feeder
+
+    cpu = time.process_time()
+    await asyncio.gather(*(waiter(key) for key in range(keys)))
+    assert len(debouncer) == 0
+    return lateness, time.process_time() - cpu
+
+
+def _report(title: str, lateness: list[float], cpu: float) -> None:
+    ms = sorted(x * 1000 for x in lateness)
+    p99 = ms[int(len(ms) * 0.99) - 1]
+    print(f"{title:10} keys={len(ms):6}  lateness ms: mean={statistics.mean(ms):7.1f} p99={p99:7.1f} "
+          f"max={ms[-1]:7.1f}  cpu={cpu:6.2f}s")
+
+
+def main() -> None:
+    keys = int(sys.argv[1]) if len(sys.argv) > 1 else 10_000
+    _report("polling", *asyncio.run(run_polling(keys)))
+    _report("debouncer", *asyncio.run(run_debouncer(keys)))
+
+
+if __name__ == "__main__":
+    main()
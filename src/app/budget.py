@@ -0,0 +1,157 @@
+import math
+from dataclasses import dataclass
+
+from pydantic_ai.usage import Usage
+
+from src.app.database import MongoManager
+from src.config import settings
+from src.models import AvailableModel
+from src.tools.log import get_logger
+from src.tools.metrics import metrics
+
+logger = get_logger(__name__)
+
+
+class BudgetExceeded(Exception):
+    """На балансе пользователя не хватает токенов на запрос."""
+
+    def __init__(self, user_id: int, balance: int, required: int):
+        super().__init__(f"budget exceeded for user {user_id}: balance {balance}, required {required}")
+        self.user_id = user_id
+        self.balance = balance
+        self.required = required
+
+
+@dataclass
+class UserBudget:
+    balance: int
+    is_admin: bool
+    pending: int = 0
+    """Списано в памяти, но ещё не записано в базу."""
+
+
+@dataclass
+class BudgetReservation:
+    """Предварительное списание под один запрос, см. `BudgetManager.reserve`."""
+    user_id: int
+    amount: int
+
+
+class BudgetManager:
+    """
+    Учёт и ограничение баланса токенов пользователей (`UserInfo.tokens_balance`).
+
+    Балансы загружаются из базы один раз и дальше ведутся в памяти, поэтому проверка перед запросом
+    не ходит в базу. Списания копятся и периодически записываются через `$inc` (`flush`).
+
+    Один токен баланса стоит `usd_per_token` долларов, расход по модели пересчитывается по её `pricing`.
+    Если цены модели нет, списываются токены как есть.
+
+    Без `enforce` баланс не списывается (только метрика расхода), иначе при нулевом начальном
+    балансе он уходил бы в минус у всех пользователей.
+    """
+
+    def __init__(
+        self,
+        db_provider: MongoManager,
+        enforce: bool = settings.budget_enforcement,
+        usd_per_token: float | None = settings.budget_usd_per_token,
+        output_estimate_tokens: int = settings.budget_output_estimate_tokens,
+    ):
+        self._db_provider = db_provider
+        self._enforce = enforce
+        self._usd_per_token = usd_per_token
+        self._output_estimate_tokens = output_estimate_tokens
+        self._accounts: dict[int, UserBudget] = {}
+
+    async def _get_account(self, user_id: int) -> UserBudget:
+        account = self._accounts.get(user_id)
+        if account is None:
+            user_info = await self._db_provider.get_user_info(user_id)
+            loaded = UserBudget(
+                balance=user_info.tokens_balance if user_info else 0,
+                is_admin=user_info.is_admin if user_info else False,
+            )
+            # пока шла загрузка, баланс мог загрузить и изменить параллельный запрос
+            account = self._accounts.setdefault(user_id, loaded)
+        return account
+
+    def get_cost(self, model: AvailableModel | None, request_tokens: int, response_tokens: int) -> int:
+        """
+        :param model: модель из каталога провайдера, None - цена неизвестна.
+        :return: стоимость запроса в токенах баланса.
+        """
+        pricing = model.pricing if model is not None else None
+        if pricing is None or not self._usd_per_token:
+            return request_tokens + response_tokens
+        usd = request_tokens * pricing.prompt + response_tokens * pricing.completion
+        return math.ceil(usd / self._usd_per_token)
+
+    async def reserve(self, user_id: int, model: AvailableModel | None, input_tokens: int) -> BudgetReservation:
+        """
+        Проверить баланс и списать оценку стоимости запроса.
+
+        Ответ оценивается в `output_estimate_tokens` токенов, разница с фактом учитывается в `settle`.
+
+        :raises BudgetExceeded: если включено ограничение и баланса не хватает (кроме администраторов).
+        """
+        if not self._enforce:
+            return BudgetReservation(user_id=user_id, amount=0)
+        account = await self._get_account(user_id)
+        amount = self.get_cost(model, input_tokens, self._output_estimate_tokens)
+        if self._enforce and not account.is_admin and account.balance < amount:
+            metrics.inc("budget_rejected_total")
+            raise BudgetExceeded(user_id, account.balance, amount)
+        account.balance -= amount
+        account.pending += amount
+        return BudgetReservation(user_id=user_id, amount=amount)
+
+    def settle(self, reservation: BudgetReservation, model: AvailableModel | None, usage: Usage | None) -> None:
+        """
+        Заменить оценку фактическим расходом.
+
+        :param usage: usage ответа, None - запрос не выполнен, оценка возвращается на баланс.
+        """
+        actual = 0
+        if usage is not None:
+            actual = self.get_cost(model, usage.request_tokens or 0, usage.response_tokens or 0)
+        metrics.inc("budget_spent_tokens_total", actual)
+        if not self._enforce:
+            return
+        diff = actual - reservation.amount
+        account = self._accounts[reservation.user_id]
+        account.balance -= diff
+        account.pending += diff
+
+    async def flush(self) -> None:
+        """Записать накопленные списания в базу."""
+        for user_id, account in list(self._accounts.items()):
+            if not account.pending:
+                continue
+            amount, account.pending = account.pending, 0
+            try:
+                await self._db_provider.inc_user_fields(user_id, {"tokens_balance": -amount})
+            except Exception as e:
+                account.pending += amount
+                logger.error(f"can't flush budget for user {user_id}: {e!r}")
+
+    async def grant(self, user_id: int, amount: int) -> int:
+        """
+        Начислить (или списать, если `amount` < 0) токены пользователю.
+
+        :return: новый баланс.
+        """
+        account = await self._get_account(user_id)
+        await self._db_provider.inc_user_fields(user_id, {"tokens_balance": amount})
+        account.balance += amount
+        logger.info(f"budget granted: user {user_id}, amount {amount}, balance {account.balance}")
+        return account.balance
+
+    async def get_balance(self, user_id: int) -> int:
+        account = await self._get_account(user_id)
+        return account.balance
+
+    def set_admin(self, user_id: int, is_admin: bool) -> None:
+        account = self._accounts.get(user_id)
+        if account is not None:
+            account.is_admin = is_admin
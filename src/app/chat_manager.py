@@ -37,15 +37,28 @@ class ChatManager:
         return False
 
     # CONTEXT
-    async def get_context(self, chat_id: int, topic_id: int, offset: int = 0) -> list[MessageModel]:
+    async def get_context_records(self, chat_id: int, topic_id: int, offset: int = 0) -> list[MessageRecord]:
         message_records: list[MessageRecord] = await self._db_provider.get_chat_message_records(
             chat_id=chat_id,
             topic_id=topic_id,
             offset=offset,
         )
+        return message_records
+
+    async def get_context(self, chat_id: int, topic_id: int, offset: int = 0) -> list[MessageModel]:
+        message_records = await self.get_context_records(chat_id, topic_id, offset)
         messages = [mes.message_param for mes in message_records]
         return messages
 
+    @staticmethod
+    def get_context_tokens(message_records: list[MessageRecord]) -> int:
+        """
+        Размер контекста в токенах - сумма сохранённых токенов каждого сообщения.
+
+        :param message_records: сообщения контекста.
+        """
+        return sum(mes.tokens_message for mes in message_records)
+
     async def clear_context(self, chat_id: int, topic_id: int) -> None:
         count = await self._db_provider.count_topic_messages(chat_id, topic_id)
         topic_info = await self.get_or_create_topic_info(chat_id, topic_id)
@@ -99,6 +112,9 @@ class ChatManager:
         else:
             raise Exception(f"no user_info found: {user_id}")
 
+    async def find_user_info(self, user_id: int) -> UserInfo | None:
+        return await self._db_provider.get_user_info(user_id)
+
     async def get_users(self) -> list[UserInfo]:
         users = await self._db_provider.get_users()
         return users
@@ -106,6 +122,11 @@ class ChatManager:
     async def update_user(self, user_info: UserInfo) -> None:
         await self._db_provider.update_user(user_info)
 
+    async def add_user_costs(self, user_id: int, total_cost: float, cache_discount: float) -> None:
+        await self._db_provider.inc_user_fields(
+            user_id, {"total_cost": total_cost, "cache_discount": cache_discount}
+        )
+
     # CHATS
     async def get_user_chat_infos(self, user_id: int) -> list[ChatInfo]:
         chat_infos = await self._db_provider.get_user_chat_infos(user_id)
@@ -211,6 +232,17 @@ class ChatManager:
     async def reset_temperature(self, chat_id: int, topic_id: int) -> None:
         await self.set_temperature(settings.default_temperature, chat_id, topic_id)
 
+    # RESPONSE CACHE
+    async def set_cache_responses(self, enabled: bool, chat_id: int, topic_id: int) -> None:
+        topic_info = await self.get_or_create_topic_info(chat_id, topic_id)
+        topic_info.settings.cache_responses = enabled
+        await self.update_topic_info(topic_info)
+
+    async def set_supersede(self, enabled: bool, chat_id: int, topic_id: int) -> None:
+        topic_info = await self.get_or_create_topic_info(chat_id, topic_id)
+        topic_info.settings.supersede = enabled
+        await self.update_topic_info(topic_info)
+
     # MODEL
     async def change_model(self, chat_id: int, topic_id: int, model: ModelParam) -> None:
         topic_info = await self.get_or_create_topic_info(chat_id, topic_id)
@@ -224,6 +256,7 @@ class ChatManager:
             user_id=user_id,
             username=username,
             full_name=full_name,
+            tokens_balance=settings.budget_initial_tokens,
         )
         return doc
 
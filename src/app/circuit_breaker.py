@@ -0,0 +1,149 @@
+import asyncio
+import enum
+import time
+from typing import Callable, Awaitable
+
+from pydantic_ai.exceptions import ModelHTTPError
+
+from src.config import settings
+from src.tools.log import get_logger
+from src.tools.metrics import metrics
+
+logger = get_logger(__name__)
+
+
+class CircuitState(enum.Enum):
+    CLOSED = "closed"
+    """Запросы проходят."""
+
+    OPEN = "open"
+    """Провайдер недоступен, запросы сразу отклоняются."""
+
+    HALF_OPEN = "half_open"
+    """Идёт пробный запрос, остальные запросы отклоняются."""
+
+
+_STATE_CODES = {CircuitState.CLOSED: 0, CircuitState.HALF_OPEN: 1, CircuitState.OPEN: 2}
+
+
+class CircuitOpenError(Exception):
+    """Запрос не отправлен: цепь для провайдера/модели разомкнута."""
+
+    def __init__(self, provider: str, model: str, retry_after_sec: float):
+        super().__init__(f"circuit is open for {provider} {model}, retry after {retry_after_sec:.0f}s")
+        self.provider = provider
+        self.model = model
+        self.retry_after_sec = retry_after_sec
+
+
+def is_breaker_failure(exc: BaseException) -> bool:
+    """
+    Считается ли ошибка признаком недоступности провайдера.
+
+    Ошибки запроса (4xx, кроме 408 и 429) - проблема запроса, а не провайдера.
+    """
+    if isinstance(exc, ModelHTTPError):
+        return not (400 <= exc.status_code < 500) or exc.status_code in (408, 429)
+    return True
+
+
+class CircuitBreaker:
+    """
+    Предохранитель для пары (провайдер, модель).
+
+    После `failure_threshold` ошибок подряд цепь размыкается, запросы сразу получают CircuitOpenError.
+    Через `recovery_sec` выполняется пробный запрос `probe` (ping провайдера),
+    при успехе цепь замыкается, при ошибке снова размыкается.
+    """
+
+    def __init__(
+        self,
+        provider: str,
+        model: str,
+        probe: Callable[[], Awaitable],
+        failure_threshold: int = settings.circuit_failure_threshold,
+        recovery_sec: float = settings.circuit_recovery_sec,
+    ):
+        self.provider = provider
+        self.model = model
+        self._probe = probe
+        self._failure_threshold = failure_threshold
+        self._recovery_sec = recovery_sec
+        self.state = CircuitState.CLOSED
+        self.failures = 0
+        self._opened_at = 0.0
+        self._probe_task: asyncio.Task | None = None
+        self._export_state()
+
+    def before_call(self) -> None:
+        """
+        Проверить, можно ли отправить запрос.
+
+        :raises CircuitOpenError: если цепь разомкнута или идёт пробный запрос.
+        """
+        if self.state == CircuitState.CLOSED:
+            return
+        elapsed = time.monotonic() - self._opened_at
+        if self.state == CircuitState.OPEN and elapsed >= self._recovery_sec:
+            self._start_probe()
+        metrics.inc("llm_circuit_rejected_total", provider=self.provider, model=self.model)
+        raise CircuitOpenError(self.provider, self.model, max(0.0, self._recovery_sec - elapsed))
+
+    def record_success(self) -> None:
+        self.failures = 0
+        if self.state != CircuitState.CLOSED:
+            logger.info(f"circuit closed: {self.provider} {self.model}")
+            self.state = CircuitState.CLOSED
+            self._export_state()
+
+    def record_failure(self, exc: BaseException) -> None:
+        if not is_breaker_failure(exc):
+            return
+        self.failures += 1
+        if self.state == CircuitState.CLOSED and self.failures >= self._failure_threshold:
+            self._open()
+
+    def _open(self) -> None:
+        logger.warning(f"circuit opened: {self.provider} {self.model}, failures={self.failures}")
+        self.state = CircuitState.OPEN
+        self._opened_at = time.monotonic()
+        self._export_state()
+
+    def _start_probe(self) -> None:
+        self.state = CircuitState.HALF_OPEN
+        self._export_state()
+        self._probe_task = asyncio.create_task(self._run_probe())
+
+    async def _run_probe(self) -> None:
+        try:
+            await self._probe()
+        except Exception as e:
+            logger.warning(f"circuit probe failed: {self.provider} {self.model}: {e!r}")
+            self._open()
+        else:
+            self.record_success()
+        finally:
+            self._probe_task = None
+
+    def _export_state(self) -> None:
+        metrics.set("llm_circuit_state", _STATE_CODES[self.state], provider=self.provider, model=self.model)
+
+
+class CircuitBreakerRegistry:
+    """Предохранители по (провайдер, модель)."""
+
+    def __init__(self):
+        self._breakers: dict[tuple[str, str], CircuitBreaker] = {}
+
+    def get(self, provider: str, model: str, probe: Callable[[], Awaitable]) -> CircuitBreaker:
+        key = (provider, model)
+        if key not in self._breakers:
+            self._breakers[key] = CircuitBreaker(provider, model, probe)
+        return self._breakers[key]
+
+    def get_states(self) -> dict[tuple[str, str], CircuitState]:
+        return {key: breaker.state for key, breaker in self._breakers.items()}
+
+
+circuit_breakers = CircuitBreakerRegistry()
+"""Предохранители вызовов ллм."""
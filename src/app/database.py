@@ -1,24 +1,32 @@
 import datetime
 
-from pymongo import MongoClient
+from bson import Binary
+from pymongo import MongoClient, UpdateOne
 
-from src.models import MessageRecord, UserInfo, ChatInfo, TopicInfo, PromptModel
+from src.config import settings
+from src.models import MessageRecord, UserInfo, ChatInfo, TopicInfo, PromptModel, CachedResponse
+from src.tools.deadline import with_mongo_deadline
 from src.tools.log import get_logger
 
 
 class MongoManager:
     def __init__(self, url: str):
         self.logger = get_logger(__name__)
-        self._client = MongoClient(url, connect=True, connectTimeoutMS=5000)
+        self._client = MongoClient(url, connect=True, connectTimeoutMS=5000, timeoutMS=settings.mongo_timeout_ms)
         self.users_db = self._client.get_database("users")
         self.topics_db = self._client.get_database("topics")
         self.messages_db = self._client.get_database("messages")
         self.prompts_db = self._client.get_database("prompt_history")
+        self.cache_db = self._client.get_database("response_cache")
+        self.response_cache_collection = self.cache_db.get_collection("responses")
+        self.catalog_db = self._client.get_database("model_catalog")
+        self.catalog_snapshot_collection = self.catalog_db.get_collection("snapshots")
         self.user_info_collection = self.users_db.get_collection("user_infos")
         self.chat_info_collection = self.users_db.get_collection("chat_infos")
         self.logger.info(f"users in db: {self.user_info_collection.count_documents({})}")
 
     # MESSAGES
+    @with_mongo_deadline
     async def get_chat_message_records(
         self,
         chat_id: int,
@@ -38,6 +46,7 @@ class MongoManager:
         messages = [MessageRecord.model_validate(doc) for doc in messages_res]
         return messages
 
+    @with_mongo_deadline
     async def add_chat_message_record(self, message_record: MessageRecord, chat_id: int, topic_id: int) -> None:
         assert isinstance(message_record, MessageRecord)
         assert isinstance(chat_id, int)
@@ -46,6 +55,25 @@ class MongoManager:
         col_mes = self.messages_db.get_collection(collection_name)
         col_mes.insert_one(document=message_record.model_dump())
 
+    @with_mongo_deadline
+    async def update_message_records(self, updates: dict[str, dict], chat_id: int, topic_id: int) -> None:
+        """
+        Обновить поля сообщений топика одной пачкой.
+
+        :param updates: {id генерации: поля для `$set`}
+        """
+        assert isinstance(chat_id, int)
+        assert isinstance(topic_id, int)
+        if not updates:
+            return
+        collection_name = self.__get_mes_col_name(chat_id, topic_id)
+        col_mes = self.messages_db.get_collection(collection_name)
+        col_mes.bulk_write(
+            [UpdateOne({"generation_id": gen_id}, {"$set": fields}) for gen_id, fields in updates.items()],
+            ordered=False,
+        )
+
+    @with_mongo_deadline
     async def count_topic_messages(self, chat_id: int, topic_id: int, offset: int = 0) -> int:
         assert isinstance(chat_id, int)
         assert isinstance(topic_id, int)
@@ -55,6 +83,7 @@ class MongoManager:
         count = col_mes.count_documents({})
         return count - offset
 
+    @with_mongo_deadline
     async def count_tokens_used(self, user_id: int) -> int:
         chat_infos = await self.get_user_chat_infos(user_id)
         col_names = set()
@@ -70,15 +99,15 @@ class MongoManager:
                     '$group': {
                         '_id': None,
                         'total_from_prov': {'$sum': '$tokens_from_prov'},
-                        'total_message': {'$sum': '$tokens_message'},
                     }
                 }
             ]).to_list()
             for col_result in col_results:
-                count += col_result["total_from_prov"] + col_result["total_message"]
+                count += col_result["total_from_prov"]
         return count
 
     # USERS
+    @with_mongo_deadline
     async def add_user(self, user_info: UserInfo) -> None:
         assert isinstance(user_info, UserInfo)
         user_info.dt_created = datetime.datetime.now(datetime.UTC)
@@ -86,6 +115,7 @@ class MongoManager:
         self.logger.info(f"user created: {user_info}")
         self.user_info_collection.insert_one(user_info.model_dump())
 
+    @with_mongo_deadline
     async def get_user_info(self, user_id: int) -> UserInfo | None:
         assert isinstance(user_id, int)
         user_info_list = self.user_info_collection.find({"user_id": user_id}).to_list()
@@ -93,15 +123,29 @@ class MongoManager:
             return UserInfo.model_validate(user_info_list[0])
         return None
 
+    @with_mongo_deadline
     async def get_users(self) -> list[UserInfo] | None:
         user_info_list = self.user_info_collection.find().to_list()
         if user_info_list:
             return [UserInfo.model_validate(user) for user in user_info_list]
         return None
 
+    @with_mongo_deadline
     async def update_user(self, user_info: UserInfo) -> None:
+        """
+        Обновить пользователя. Счётчики (баланс и расходы) меняются только через `inc_user_fields`,
+        чтобы не затереть параллельные списания устаревшим значением.
+        """
         assert isinstance(user_info, UserInfo)
-        self.user_info_collection.replace_one({"_id": user_info.id}, user_info.model_dump())
+        self.user_info_collection.update_one(
+            {"_id": user_info.id},
+            {"$set": user_info.model_dump(exclude={"tokens_balance", "total_cost", "cache_discount"})},
+        )
+
+    @with_mongo_deadline
+    async def inc_user_fields(self, user_id: int, fields: dict[str, int | float]) -> None:
+        assert isinstance(user_id, int)
+        self.user_info_collection.update_one({"user_id": user_id}, {"$inc": fields})
 
     # CHATS
     def sync_add_chat(self, chat_info: ChatInfo) -> None:
@@ -109,6 +153,7 @@ class MongoManager:
         self.logger.info(f"chat created: {chat_info}")
         self.chat_info_collection.insert_one(chat_info.model_dump())
 
+    @with_mongo_deadline
     async def add_chat(self, chat_info: ChatInfo) -> None:
         assert isinstance(chat_info, ChatInfo)
         self.logger.info(f"chat created: {chat_info}")
@@ -121,6 +166,7 @@ class MongoManager:
             return ChatInfo.model_validate(chat_info_list[0])
         return None
 
+    @with_mongo_deadline
     async def get_chat_info(self, chat_id: int) -> ChatInfo | None:
         assert isinstance(chat_id, int)
         chat_info_list = self.chat_info_collection.find({"chat_id": chat_id}).to_list()
@@ -128,6 +174,7 @@ class MongoManager:
             return ChatInfo.model_validate(chat_info_list[0])
         return None
 
+    @with_mongo_deadline
     async def get_user_chat_infos(self, user_id: int) -> list[ChatInfo] | None:
         assert isinstance(user_id, int)
         chat_info_list = self.chat_info_collection.find({"owner_user_id": user_id}).to_list()
@@ -135,11 +182,13 @@ class MongoManager:
             return [ChatInfo.model_validate(info) for info in chat_info_list]
         return None
 
+    @with_mongo_deadline
     async def update_chat_info(self, chat_info: ChatInfo) -> None:
         assert isinstance(chat_info, ChatInfo)
         self.chat_info_collection.replace_one({"_id": chat_info.id}, chat_info.model_dump())
 
     # TOPICS
+    @with_mongo_deadline
     async def add_topic(self, topic_info: TopicInfo, chat_id: int) -> None:
         assert isinstance(topic_info, TopicInfo)
         assert isinstance(chat_id, int)
@@ -147,6 +196,7 @@ class MongoManager:
         col = self.topics_db.get_collection(str(chat_id))
         col.insert_one(topic_info.model_dump())
 
+    @with_mongo_deadline
     async def get_topic_info(self, chat_id: int, topic_id: int) -> TopicInfo | None:
         assert isinstance(chat_id, int)
         assert isinstance(topic_id, int)
@@ -156,6 +206,7 @@ class MongoManager:
             return TopicInfo.model_validate(topic_info_list[0])
         return None
 
+    @with_mongo_deadline
     async def update_topic_info(self, topic_info: TopicInfo, chat_id: int) -> None:
         assert isinstance(topic_info, TopicInfo)
         assert isinstance(chat_id, int)
@@ -163,6 +214,7 @@ class MongoManager:
         col.replace_one({"_id": topic_info.id}, topic_info.model_dump())
 
     # PROMPTS
+    @with_mongo_deadline
     async def add_prompt(self, prompt: str, chat_id: int, topic_id: int) -> None:
         assert isinstance(prompt, str)
         assert isinstance(chat_id, int)
@@ -170,6 +222,48 @@ class MongoManager:
         col = self.prompts_db.get_collection(self.__get_prompt_col_name(chat_id, topic_id))
         col.insert_one(PromptModel(prompt=prompt).model_dump())
 
+    # RESPONSE CACHE
+    def create_response_cache_index(self, ttl_sec: int) -> None:
+        assert isinstance(ttl_sec, int)
+        self.response_cache_collection.create_index("key", unique=True)
+        self.response_cache_collection.create_index("created_at", expireAfterSeconds=ttl_sec)
+
+    @with_mongo_deadline
+    async def get_cached_response(self, key: str) -> CachedResponse | None:
+        assert isinstance(key, str)
+        doc = self.response_cache_collection.find_one({"key": key})
+        if doc:
+            return CachedResponse.model_validate(doc)
+        return None
+
+    @with_mongo_deadline
+    async def set_cached_response(self, cached_response: CachedResponse) -> None:
+        assert isinstance(cached_response, CachedResponse)
+        self.response_cache_collection.replace_one(
+            {"key": cached_response.key},
+            cached_response.model_dump(),
+            upsert=True,
+        )
+
+    # MODEL CATALOG
+    @with_mongo_deadline
+    async def get_model_catalog_snapshot(self, key: str) -> bytes | None:
+        assert isinstance(key, str)
+        doc = self.catalog_snapshot_collection.find_one({"key": key})
+        if doc:
+            return bytes(doc["data"])
+        return None
+
+    @with_mongo_deadline
+    async def set_model_catalog_snapshot(self, key: str, data: bytes) -> None:
+        assert isinstance(key, str)
+        assert isinstance(data, bytes)
+        self.catalog_snapshot_collection.replace_one(
+            {"key": key},
+            {"key": key, "data": Binary(data), "saved_at": datetime.datetime.now(datetime.UTC)},
+            upsert=True,
+        )
+
     @staticmethod
     def __get_prompt_col_name(chat_id: int, topic_id: int) -> str:
         return f"{chat_id}+{topic_id}"
@@ -0,0 +1,147 @@
+import asyncio
+import time
+from dataclasses import dataclass, field
+from typing import Callable, Awaitable
+
+import aiohttp
+
+from src.app.llm_router import llm_router
+from src.config import settings
+from src.models import GenerationInfo
+from src.tools.log import get_logger
+from src.tools.metrics import metrics
+
+logger = get_logger(__name__)
+
+RETRYABLE_STATUS_CODES = {404, 408, 429, 500, 502, 503, 504}
+"""404 - статистика генерации ещё не появилась в OpenRouter."""
+
+
+@dataclass
+class PendingGeneration:
+    """Генерация, статистику которой нужно получить из OpenRouter `/generation`."""
+    gen_id: str
+    model: str
+    latency_ms: float
+    fetch: Callable[[str], Awaitable[GenerationInfo]]
+    chat_id: int | None = None
+    topic_id: int | None = None
+    user_id: int | None = None
+    attempts: int = 0
+    next_try_at: float = field(default_factory=time.monotonic)
+
+
+class GenerationStatsCollector:
+    """
+    Фоновый сбор стоимости и задержек запросов из OpenRouter `/generation`.
+
+    Провайдер добавляет id генерации после ответа (`add`), сервис привязывает её к сообщению в базе (`bind`).
+    Периодическая задача забирает пачку готовых генераций (`run_batch`) и запрашивает их с ограниченной
+    параллельностью. Статистика появляется в OpenRouter с задержкой, поэтому 404 и временные ошибки
+    повторяются с экспоненциальной задержкой, не дольше `max_attempts` попыток.
+    """
+
+    def __init__(
+        self,
+        batch_size: int = settings.generation_stats_batch_size,
+        concurrency: int = settings.generation_stats_concurrency,
+        delay_sec: float = settings.generation_stats_delay_sec,
+        max_attempts: int = settings.generation_stats_max_attempts,
+        max_pending: int = settings.generation_stats_max_pending,
+    ):
+        self._batch_size = batch_size
+        self._concurrency = concurrency
+        self._delay_sec = delay_sec
+        self._max_attempts = max_attempts
+        self._max_pending = max_pending
+        self._pending: dict[str, PendingGeneration] = {}
+
+    def add(self, gen_id: str, model: str, latency_ms: float, fetch: Callable[[str], Awaitable[GenerationInfo]]) -> None:
+        """
+        Добавить генерацию в очередь на сбор статистики.
+
+        :param fetch: функция запроса `/generation` провайдера, выполнившего запрос.
+        """
+        if len(self._pending) >= self._max_pending:
+            metrics.inc("generation_stats_total", status="overflow")
+            logger.warning(f"generation stats queue is full, skip {gen_id}")
+            return
+        self._pending[gen_id] = PendingGeneration(
+            gen_id=gen_id,
+            model=model,
+            latency_ms=latency_ms,
+            fetch=fetch,
+            next_try_at=time.monotonic() + self._delay_sec,
+        )
+        metrics.set("generation_stats_pending", len(self._pending))
+
+    def bind(self, gen_id: str, chat_id: int, topic_id: int, user_id: int) -> None:
+        """Привязать генерацию к сообщению ллм в базе, куда запишется стоимость."""
+        pending = self._pending.get(gen_id)
+        if pending is not None:
+            pending.chat_id = chat_id
+            pending.topic_id = topic_id
+            pending.user_id = user_id
+
+    async def run_batch(self) -> list[tuple[PendingGeneration, GenerationInfo]]:
+        """
+        Запросить статистику пачки генераций, у которых подошло время попытки.
+
+        :return: полученная статистика привязанных к сообщениям генераций.
+        """
+        now = time.monotonic()
+        due = [pending for pending in self._pending.values() if pending.next_try_at <= now][:self._batch_size]
+        if not due:
+            return []
+        semaphore = asyncio.Semaphore(self._concurrency)
+
+        async def fetch(pending: PendingGeneration) -> GenerationInfo | None:
+            async with semaphore:
+                return await self._fetch(pending)
+
+        infos = await asyncio.gather(*(fetch(pending) for pending in due))
+        collected = []
+        for pending, info in zip(due, infos):
+            if info is None:
+                continue
+            if settings.llm_router_enabled:
+                llm_router.record_success(pending.model, info.provider_name, pending.latency_ms)
+                llm_router.record_generation(pending.model, info)
+            if pending.chat_id is not None:
+                collected.append((pending, info))
+        metrics.set("generation_stats_pending", len(self._pending))
+        return collected
+
+    async def _fetch(self, pending: PendingGeneration) -> GenerationInfo | None:
+        """:return: статистика или None, если генерация отложена или отброшена."""
+        try:
+            info = await pending.fetch(pending.gen_id)
+        except (aiohttp.ClientResponseError, aiohttp.ClientConnectionError, TimeoutError) as e:
+            status = getattr(e, "status", None)
+            if status is not None and status not in RETRYABLE_STATUS_CODES:
+                self._drop(pending, f"{e!r}")
+                return None
+            pending.attempts += 1
+            if pending.attempts >= self._max_attempts:
+                self._drop(pending, f"{e!r} after {pending.attempts} attempts")
+                return None
+            pending.next_try_at = time.monotonic() + self._delay_sec * 2 ** pending.attempts
+            metrics.inc("generation_stats_total", status="retry")
+            return None
+        except Exception as e:
+            self._drop(pending, f"{e!r}")
+            return None
+        self._pending.pop(pending.gen_id, None)
+        metrics.inc("generation_stats_total", status="ok")
+        return info
+
+    def _drop(self, pending: PendingGeneration, reason: str) -> None:
+        logger.warning(f"can't get generation {pending.gen_id}: {reason}")
+        self._pending.pop(pending.gen_id, None)
+        metrics.inc("generation_stats_total", status="dropped")
+        if settings.llm_router_enabled:
+            llm_router.record_success(pending.model, None, pending.latency_ms)
+
+
+generation_stats = GenerationStatsCollector()
+"""Очередь сбора статистики генераций OpenRouter."""
@@ -0,0 +1,91 @@
+import asyncio
+import enum
+from dataclasses import dataclass
+from typing import Awaitable, TypeVar
+
+from src.tools.log import get_logger
+from src.tools.metrics import metrics
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+InflightKey = tuple[int, int, int]
+"""(chat_id, topic_id, user_id)"""
+
+
+class CancelReason(enum.Enum):
+    STOPPED = "stopped"
+    """Пользователь нажал кнопку остановки."""
+
+    SUPERSEDED = "superseded"
+    """Пришло новое сообщение, генерация перезапущена с объединённым текстом."""
+
+
+class GenerationCancelled(Exception):
+    """Генерация ответа отменена до завершения, ход не сохраняется в контекст."""
+
+    def __init__(self, reason: CancelReason):
+        super().__init__(f"generation cancelled: {reason.value}")
+        self.reason = reason
+
+
+@dataclass
+class InflightGeneration:
+    task: asyncio.Task
+    text: str
+    """Текст сообщения пользователя, на который генерируется ответ."""
+    reason: CancelReason | None = None
+
+
+class InflightRegistry:
+    """
+    Генерации ответов ллм, выполняющиеся сейчас, по (чат, топик, пользователь).
+
+    Отмена генерации отменяет задачу запроса, вместе с ней закрывается HTTP запрос к провайдеру.
+    """
+
+    def __init__(self):
+        self._items: dict[InflightKey, InflightGeneration] = {}
+
+    async def run(self, key: InflightKey, text: str, coro: Awaitable[T]) -> T:
+        """
+        Выполнить запрос к ллм как отменяемую генерацию.
+
+        :param text: текст сообщения пользователя, нужен для объединения при перезапуске.
+        :raises GenerationCancelled: если генерацию отменили через `cancel`.
+        """
+        generation = InflightGeneration(task=asyncio.ensure_future(coro), text=text)
+        self._items[key] = generation
+        try:
+            return await generation.task
+        except asyncio.CancelledError:
+            if generation.reason is None:
+                raise
+            raise GenerationCancelled(generation.reason)
+        finally:
+            if self._items.get(key) is generation:
+                del self._items[key]
+
+    def cancel(self, key: InflightKey, reason: CancelReason) -> InflightGeneration | None:
+        """
+        Отменить генерацию.
+
+        :return: отменённая генерация или None, если генерации нет.
+        """
+        generation = self._items.pop(key, None)
+        if generation is None or generation.task.done():
+            return None
+        generation.reason = reason
+        generation.task.cancel()
+        metrics.inc("llm_generations_cancelled_total", reason=reason.value)
+        logger.info(f"generation cancelled: {key=}, reason={reason.value}")
+        return generation
+
+    def is_running(self, key: InflightKey) -> bool:
+        generation = self._items.get(key)
+        return generation is not None and not generation.task.done()
+
+
+inflight_generations = InflightRegistry()
+"""Выполняющиеся генерации ответов."""
@@ -0,0 +1,199 @@
+import asyncio
+import time
+from collections import deque
+from typing import Mapping, Sequence
+
+from pydantic_ai.models import Model
+
+from src.app.llm_provider import BaseLlmProvider
+from src.config import settings
+from src.app.model_catalog import ModelCatalog
+from src.models import MessageModel, LlmProviderSendResponse, AvailableModel
+from src.tools.log import get_logger
+from src.tools.metrics import metrics
+
+logger = get_logger(__name__)
+
+
+class LatencyWindow:
+    """
+    Скользящее окно задержек успешных запросов.
+
+    :var size: сколько последних значений хранить
+    :var min_samples: сколько значений нужно, чтобы считать перцентили
+    """
+
+    def __init__(self, size: int = 200, min_samples: int = settings.llm_hedge_min_samples):
+        self._values: deque[float] = deque(maxlen=size)
+        self._min_samples = min_samples
+
+    def add(self, value: float) -> None:
+        self._values.append(value)
+
+    def percentile(self, q: float) -> float | None:
+        """
+        :param q: перцентиль от 0 до 1
+        :return: значение или None, если данных ещё мало
+        """
+        if len(self._values) < self._min_samples:
+            return None
+        values = sorted(self._values)
+        return values[min(len(values) - 1, int(q * len(values)))]
+
+
+class FailoverLlmProvider(BaseLlmProvider):
+    """
+    Составной провайдер: отправляет запрос в первый провайдер из списка,
+    при ошибке или таймауте - в следующий.
+
+    Если включено хеджирование, и основной провайдер отвечает дольше своего p95,
+    параллельно отправляется такой же запрос в следующий провайдер.
+    Используется ответ, пришедший первым, второй запрос отменяется.
+
+    Список моделей, токены и хэши моделей берутся у первого провайдера,
+    поэтому резервные провайдеры должны принимать те же id моделей.
+    """
+
+    def __init__(
+        self,
+        providers: list[BaseLlmProvider],
+        timeout_sec: float = settings.llm_request_timeout_sec,
+        hedge: bool = settings.llm_hedge_enabled,
+    ):
+        assert providers, "at least one provider is required"
+        self._providers = providers
+        self._names = [f"{type(p).__name__}#{i}" for i, p in enumerate(providers)]
+        for name, provider in zip(self._names[1:], providers[1:]):
+            provider.breaker_name = name  # у резервных ключей свои предохранители, даже если тип тот же
+        self._latencies = [LatencyWindow() for _ in providers]
+        self._timeout_sec = timeout_sec
+        self._hedge = hedge
+
+    @property
+    def primary(self) -> BaseLlmProvider:
+        return self._providers[0]
+
+    @property
+    def catalog(self) -> ModelCatalog:
+        return self.primary.catalog
+
+    async def send_messages(
+        self,
+        model: str,
+        messages: list[MessageModel],
+        user_id: int,
+        system_prompt: str = None,
+        temp: float = settings.default_temperature,
+        max_tokens: int = settings.default_max_tokens,
+        cache: bool = False,
+        extra_headers: dict = settings.extra_headers,
+        input_tokens: int | None = None,
+    ) -> LlmProviderSendResponse:
+        kwargs = dict(
+            model=model,
+            messages=messages,
+            user_id=user_id,
+            system_prompt=system_prompt,
+            temp=temp,
+            max_tokens=max_tokens,
+            cache=cache,
+            extra_headers=extra_headers,
+            input_tokens=input_tokens,
+        )
+        tasks: dict[asyncio.Task, tuple[int, str]] = {}
+        next_idx = 0
+        last_error: BaseException | None = None
+
+        def launch(path: str) -> None:
+            nonlocal next_idx
+            task = asyncio.create_task(self._attempt(next_idx, kwargs))
+            tasks[task] = (next_idx, path)
+            next_idx += 1
+
+        launch("primary")
+        try:
+            while tasks:
+                hedge_delay = None
+                if self._hedge and len(tasks) == 1 and next_idx < len(self._providers):
+                    running_idx, _ = next(iter(tasks.values()))
+                    hedge_delay = self._latencies[running_idx].percentile(0.95)
+
+                done, _ = await asyncio.wait(tasks, timeout=hedge_delay, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    logger.info(f"llm hedge fired after {hedge_delay:.2f}s: {self._names[next_idx]}")
+                    launch("hedge")
+                    continue
+
+                for task in done:
+                    idx, path = tasks.pop(task)
+                    if task.exception() is None:
+                        metrics.inc("llm_failover_requests_total", path=path, provider=self._names[idx])
+                        if path != "primary":
+                            logger.info(f"llm request served by {path} provider {self._names[idx]}")
+                        return task.result()
+                    last_error = task.exception()
+                    metrics.inc("llm_failover_errors_total", provider=self._names[idx])
+                    logger.warning(f"llm provider {self._names[idx]} failed: {last_error!r}")
+
+                if not tasks and next_idx < len(self._providers):
+                    launch("failover")
+            raise last_error
+        finally:
+            for task in tasks:
+                task.cancel()
+            if tasks:
+                await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def ping(self, model: str | None = None) -> LlmProviderSendResponse:
+        return await self.primary.ping(model)
+
+    async def _attempt(self, idx: int, kwargs: dict) -> LlmProviderSendResponse:
+        provider = self._providers[idx]
+        ts = time.monotonic()
+        timeout = asyncio.timeout(self._timeout_sec)
+        try:
+            async with timeout:
+                response = await provider.send_messages(**kwargs)
+        except TimeoutError as e:
+            if timeout.expired():
+                # таймаут отменяет запрос внутри провайдера, и тот не видит ошибки - считаем её здесь
+                provider.get_circuit_breaker(kwargs["model"]).record_failure(e)
+            raise
+        self._latencies[idx].add(time.monotonic() - ts)
+        return response
+
+    def _get_ai_instance(self, model: str) -> Model:
+        return self.primary._get_ai_instance(model)
+
+    def _get_default_model_name(self) -> str:
+        return self.primary._get_default_model_name()
+
+    async def count_tokens(self, model: str, messages: list[MessageModel]) -> int:
+        return await self.primary.count_tokens(model, messages)
+
+    async def estimate_tokens(self, model: str, messages: list[MessageModel]) -> int:
+        return await self.primary.estimate_tokens(model, messages)
+
+    async def get_catalog(self) -> ModelCatalog:
+        return await self.primary.get_catalog()
+
+    async def refresh_catalog(self) -> ModelCatalog:
+        return await self.primary.refresh_catalog()
+
+    async def warm_up_catalog(self) -> None:
+        await self.primary.warm_up_catalog()
+
+    async def load_catalog_snapshot(self) -> None:
+        await self.primary.load_catalog_snapshot()
+
+    async def get_models(self) -> Sequence[AvailableModel]:
+        return await self.primary.get_models()
+
+    async def _update_models_cache(self) -> None:
+        await self.primary._update_models_cache()
+
+    async def get_model_id_by_hash(self, model_hash: str) -> str:
+        return await self.primary.get_model_id_by_hash(model_hash)
+
+    async def get_providers_models(self) -> Mapping[str, Sequence[AvailableModel]]:
+        return await self.primary.get_providers_models()
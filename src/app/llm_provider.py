@@ -1,23 +1,42 @@
+import asyncio
+import hashlib
+import random
+import time
+import uuid
 from abc import ABC, abstractmethod
-from collections import defaultdict
 from datetime import datetime, timedelta, UTC
 from itertools import groupby
-from typing import Type, List
+from typing import Type, List, AsyncIterator, Mapping, Sequence
 
 import aiohttp
-import tiktoken
-from anthropic import Anthropic, AsyncAnthropic
+import httpx
+from anthropic import AsyncAnthropic
 from anthropic.types import MessageParam
+from openai import AsyncOpenAI
+from pydantic_ai.exceptions import ModelHTTPError
 from pydantic_ai.messages import ModelRequest, SystemPromptPart, UserPromptPart, ModelResponse, TextPart, ModelMessage
-from pydantic_ai.models import ModelRequestParameters, Model
+from pydantic_ai.models import ModelRequestParameters, Model, cached_async_http_client
 from pydantic_ai.models.anthropic import AnthropicModel
+from pydantic_ai.models.function import FunctionModel, AgentInfo
 from pydantic_ai.models.openai import OpenAIModel
 from pydantic_ai.providers.anthropic import AnthropicProvider
 from pydantic_ai.providers.openai import OpenAIProvider
 from pydantic_ai.settings import ModelSettings
+from pydantic_ai.usage import Usage
 
-from src.config import settings, LlmProviderType
-from src.models import MessageModel, LlmProviderSendResponse, AvailableModel, ModelCache, GenerationInfo
+from src.app.circuit_breaker import circuit_breakers, CircuitBreaker
+from src.app.generation_stats import generation_stats
+from src.app.llm_router import llm_router
+from src.app.model_catalog import ModelCatalog, ModelCatalogStore
+from src.app.rate_limiter import LlmRateLimiter
+from src.app.retry import RetryPolicy
+from src.app.tokenizer import tokenizer_service
+from src.config import settings, LlmProviderType, RateLimitConfig, FakeLlmConfig
+from src.models import MessageModel, LlmProviderSendResponse, AvailableModel, GenerationInfo
+from src.tools.log import get_logger
+from src.tools.metrics import metrics
+
+logger = get_logger(__name__)
 
 
 class AbstractLlmProvider(ABC):
@@ -31,6 +50,7 @@ class AbstractLlmProvider(ABC):
         temp: float = settings.default_temperature,
         max_tokens: int = settings.default_max_tokens,
         cache: bool = False,
+        input_tokens: int | None = None,
     ) -> LlmProviderSendResponse:
         raise NotImplementedError()
 
@@ -39,11 +59,11 @@ class AbstractLlmProvider(ABC):
         raise NotImplementedError()
 
     @abstractmethod
-    async def get_providers_models(self) -> dict[str, list[AvailableModel]]:
+    async def get_providers_models(self) -> Mapping[str, Sequence[AvailableModel]]:
         raise NotImplementedError()
 
     @abstractmethod
-    async def get_models(self) -> list[AvailableModel]:
+    async def get_models(self) -> Sequence[AvailableModel]:
         raise NotImplementedError()
 
     @abstractmethod
@@ -52,11 +72,22 @@ class AbstractLlmProvider(ABC):
 
 
 class BaseLlmProvider(AbstractLlmProvider):
-    def __init__(self, api_key: str, base_url: str, model_class: Type[OpenAIModel] | Type[AnthropicModel]):
+    def __init__(self, api_key: str, base_url: str, model_class: Type[OpenAIModel] | Type[AnthropicModel] | Type[FunctionModel]):
         self._api_key = api_key
         self._base_url = base_url.rstrip("/") if base_url else None
         self._ai_model_class = model_class
-        self.models_cache: ModelCache = ModelCache()
+        self.catalog: ModelCatalog = ModelCatalog([])
+        self._catalog_refresh: asyncio.Task | None = None
+        self._catalog_failures: int = 0
+        self._catalog_retry_at: float = 0
+        """`time.monotonic()`, раньше которого не обновлять каталог после ошибки."""
+        self._catalog_error: Exception | None = None
+        self.catalog_store: ModelCatalogStore | None = None
+        """Хранилище снимков каталога между перезапусками, None - не сохранять."""
+        self.retry_policy: RetryPolicy = RetryPolicy()
+        self.rate_limiter: LlmRateLimiter = LlmRateLimiter()
+        self.breaker_name: str = type(self).__name__
+        """Имя провайдера в предохранителях и их метриках."""
 
     @abstractmethod
     def _get_ai_instance(self, model: str) -> Model:
@@ -76,6 +107,52 @@ class BaseLlmProvider(AbstractLlmProvider):
         max_tokens: int = settings.default_max_tokens,
         cache: bool = False,  # todo cache
         extra_headers: dict = settings.extra_headers,
+        input_tokens: int | None = None,
+    ) -> LlmProviderSendResponse:
+        """
+        Отправить сообщения в ллм через предохранитель провайдера/модели и лимиты RPM/TPM ключа.
+        Временные ошибки (429, 529, 5xx, сеть) повторяются по `self.retry_policy`.
+
+        :param input_tokens: оценка входных токенов для лимита TPM, если не задана - считается локально.
+        :raises CircuitOpenError: если провайдер/модель сейчас недоступны.
+        :raises RateLimitExceeded: если запрос не дождался лимита.
+        """
+        breaker = self.get_circuit_breaker(model)
+        breaker.before_call()
+        if input_tokens is None:
+            input_tokens = await self.estimate_tokens(model, messages)
+        reservation = await self.rate_limiter.acquire(model, input_tokens)
+        try:
+            response = await self.retry_policy.call(
+                lambda: self._send_messages(
+                    model, messages, user_id, system_prompt, temp, max_tokens, cache, extra_headers
+                ),
+                name=type(self).__name__,
+            )
+        except BaseException as e:
+            self.rate_limiter.reconcile(reservation, None)
+            if isinstance(e, Exception):
+                breaker.record_failure(e)
+            raise
+        usage = response.usage
+        self.rate_limiter.reconcile(reservation, (usage.request_tokens or 0) + (usage.response_tokens or 0))
+        breaker.record_success()
+        return response
+
+    def get_circuit_breaker(self, model: str) -> CircuitBreaker:
+        """Предохранитель провайдера для модели, пробный запрос - `ping` этой модели."""
+        return circuit_breakers.get(self.breaker_name, model, probe=lambda: self.ping(model))
+
+    async def _send_messages(
+        self,
+        model: str,
+        messages: list[MessageModel],
+        user_id: int,
+        system_prompt: str = None,
+        temp: float = settings.default_temperature,
+        max_tokens: int = settings.default_max_tokens,
+        cache: bool = False,
+        extra_headers: dict = settings.extra_headers,
     ) -> LlmProviderSendResponse:
         ai_model = self._get_ai_instance(model=model)
 
@@ -94,9 +171,7 @@ class BaseLlmProvider(AbstractLlmProvider):
             system_prompt_part = SystemPromptPart(content=system_prompt)
             messages_to_send[0].parts.insert(0, system_prompt_part)
 
-        model_settings = ModelSettings(max_tokens=max_tokens, temperature=temp)
-        if extra_headers:
-            model_settings["extra_headers"] = extra_headers
+        model_settings = self._get_model_settings(model, temp, max_tokens, extra_headers)
 
         response: ModelResponse = await ai_model.request(
             messages=messages_to_send,
@@ -105,31 +180,151 @@ class BaseLlmProvider(AbstractLlmProvider):
         )
         return LlmProviderSendResponse(model_response=response, usage=response.usage)
 
+    def _get_model_settings(self, model: str, temp: float, max_tokens: int, extra_headers: dict | None) -> ModelSettings:
+        model_settings = ModelSettings(max_tokens=max_tokens, temperature=temp)
+        if extra_headers:
+            model_settings["extra_headers"] = extra_headers
+        return model_settings
+
     @abstractmethod
     async def count_tokens(self, model: str, messages: list[MessageModel]) -> int:
         raise NotImplementedError()
 
-    async def get_models(self) -> list[AvailableModel]:
-        if not (
-            self.models_cache.models
-            and self.models_cache.updated_at > datetime.now(UTC) - timedelta(seconds=settings.model_cache_ttl_sec)
-        ):
+    async def estimate_tokens(self, model: str, messages: list[MessageModel]) -> int:
+        """
+        Локальная оценка числа токенов, без запросов к провайдеру.
+
+        Используется, когда провайдер не вернул usage.
+        """
+        return await tokenizer_service.count(
+            texts=[mes.content for mes in messages],
+            model=model,
+            tokenizer=self._get_model_tokenizer(model),
+        )
+
+    def _get_model_tokenizer(self, model: str) -> str | None:
+        """Токенизатор модели из уже загруженного каталога, без запросов к провайдеру."""
+        m = self.catalog.get_by_id(model)
+        if m is not None and m.architecture:
+            return m.architecture.tokenizer
+        return None
+
+    async def get_catalog(self) -> ModelCatalog:
+        """
+        Каталог моделей.
+
+        Устаревший каталог (старше `settings.model_cache_ttl_sec`) отдаётся сразу, а обновляется в фоне.
+        Ждать загрузки приходится только пока каталога ещё нет.
+        """
+        if not self.catalog:
+            if self._catalog_error is not None and self._in_catalog_backoff():
+                raise self._catalog_error
+            return await self.refresh_catalog()
+        if self._is_catalog_stale() and not self._in_catalog_backoff():
+            self._start_catalog_refresh()
+        return self.catalog
+
+    async def refresh_catalog(self) -> ModelCatalog:
+        """
+        Обновить каталог моделей. Одновременные вызовы ждут один и тот же запрос к провайдеру.
+
+        :raises Exception: ошибка загрузки, прошлый каталог при этом остаётся.
+        """
+        await asyncio.shield(self._start_catalog_refresh())
+        return self.catalog
+
+    async def warm_up_catalog(self) -> None:
+        """Обновить каталог заранее, если он устарел, с учётом паузы после ошибок. Ошибки только логируются."""
+        if not self._is_catalog_stale() or self._in_catalog_backoff():
+            return
+        try:
+            await self.refresh_catalog()
+        except Exception:
+            pass  # уже залогировано в _refresh_catalog
+
+    async def load_catalog_snapshot(self) -> None:
+        """Загрузить сохранённый снимок каталога, если каталог ещё не загружен. Снимок обновится в фоне."""
+        if self.catalog_store is None or self.catalog:
+            return
+        catalog = await self.catalog_store.load(self._get_catalog_key())
+        if catalog and not self.catalog:
+            self.catalog = catalog
+            logger.info(f"model catalog snapshot loaded: {len(catalog)} models, updated_at={catalog.updated_at}")
+
+    def _get_catalog_key(self) -> str:
+        """Ключ снимка каталога: у разных провайдеров и base_url разные каталоги."""
+        return f"{type(self).__name__}:{self._base_url or ''}"
+
+    def _is_catalog_stale(self) -> bool:
+        updated_at = self.catalog.updated_at
+        return (
+            not self.catalog
+            or updated_at is None
+            or updated_at <= datetime.now(UTC) - timedelta(seconds=settings.model_cache_ttl_sec)
+        )
+
+    def _in_catalog_backoff(self) -> bool:
+        return time.monotonic() < self._catalog_retry_at
+
+    def _start_catalog_refresh(self) -> asyncio.Task:
+        if self._catalog_refresh is None:
+            self._catalog_refresh = asyncio.create_task(self._refresh_catalog())
+            self._catalog_refresh.add_done_callback(self._on_catalog_refresh_done)
+        return self._catalog_refresh
+
+    def _on_catalog_refresh_done(self, task: asyncio.Task) -> None:
+        if self._catalog_refresh is task:
+            self._catalog_refresh = None
+        if not task.cancelled():
+            task.exception()  # ошибка фонового обновления уже залогирована
+
+    async def _refresh_catalog(self) -> None:
+        ts = time.monotonic()
+        try:
             await self._update_models_cache()
-        return self.models_cache.models
+        except Exception as e:
+            self._catalog_failures += 1
+            self._catalog_error = e
+            delay = min(
+                settings.model_cache_retry_base_sec * 2 ** (self._catalog_failures - 1),
+                settings.model_cache_retry_max_sec,
+            )
+            self._catalog_retry_at = time.monotonic() + delay
+            metrics.inc("llm_catalog_refresh_total", status="error")
+            logger.warning(
+                f"model catalog refresh failed ({self._catalog_failures} in a row), retry in {delay:.0f}s: {e!r}"
+            )
+            raise
+        self._catalog_failures = 0
+        self._catalog_error = None
+        self._catalog_retry_at = 0
+        metrics.inc("llm_catalog_refresh_total", status="ok")
+        metrics.observe("llm_catalog_refresh_seconds", time.monotonic() - ts)
+        logger.info(f"model catalog refreshed: {len(self.catalog)} models")
+        if self.catalog_store is not None:
+            await self.catalog_store.save(self._get_catalog_key(), self.catalog)
+
+    async def get_models(self) -> Sequence[AvailableModel]:
+        return (await self.get_catalog()).models
+
+    async def get_providers_models(self) -> Mapping[str, Sequence[AvailableModel]]:
+        return (await self.get_catalog()).providers
 
     @abstractmethod
     async def _update_models_cache(self) -> None:
+        """Загрузить каталог моделей и заменить `self.catalog` новым снимком."""
         raise NotImplementedError()
 
     async def get_model_id_by_hash(self, model_hash: str) -> str:
-        for m in await self.get_models():
-            if m.id_hash == model_hash:
-                return m.id
-        raise Exception("broken")
+        m = (await self.get_catalog()).get_by_hash(model_hash)
+        if m is None:
+            raise Exception("broken")
+        return m.id
 
     async def ping(self, model: str | None = None) -> LlmProviderSendResponse:
-        res = await self.send_messages(
-            model=self._get_default_model_name(),
+        """Проверка связи с ллм в обход предохранителя, используется и как пробный запрос."""
+        res = await self._send_messages(
+            model=model or self._get_default_model_name(),
             messages=[MessageModel(content="На связи?", role="user")],
             temp=1,
             max_tokens=10,
@@ -152,6 +347,8 @@ class AnthropicLlmProvider(BaseLlmProvider):
                 anthropic_client=AsyncAnthropic(
                     api_key=self._api_key,
                     base_url=self._base_url,
+                    max_retries=0,  # повторы делает self.retry_policy
+                    http_client=cached_async_http_client(provider="anthropic"),
                 )
             )
         )
@@ -171,19 +368,22 @@ class AnthropicLlmProvider(BaseLlmProvider):
         return res.input_tokens
 
     async def _update_models_cache(self) -> None:
-        ai = Anthropic(api_key=self._api_key, base_url=self._base_url)
-        models = ai.models.list()
-        self.models_cache.models = [
-            AvailableModel(
-                id=f"anthropic/{model.id}",
-                name=model.display_name,
-                created=model.created_at,
-            )
-            for model in models
-        ]
-
-    async def get_providers_models(self) -> dict[str, list[AvailableModel]]:
-        return {'anthropic': await self.get_models()}
+        ai = AsyncAnthropic(
+            api_key=self._api_key,
+            base_url=self._base_url,
+            http_client=cached_async_http_client(provider="anthropic"),
+        )
+        self.catalog = ModelCatalog(
+            [
+                AvailableModel(
+                    id=f"anthropic/{model.id}",
+                    name=model.display_name,
+                    created=model.created_at,
+                )
+                async for model in ai.models.list()
+            ],
+            updated_at=datetime.now(UTC),
+        )
 
 
 class OpenAiLlmProvider(BaseLlmProvider):
@@ -192,14 +392,66 @@ class OpenAiLlmProvider(BaseLlmProvider):
     def __init__(self, api_key: str, base_url: str = DEFAULT_BASE_URL):
         model_class = OpenAIModel
         super().__init__(api_key, base_url, model_class)
+        self._is_openrouter = "openrouter.ai" in self._base_url
+
+    async def _send_messages(
+        self,
+        model: str,
+        messages: list[MessageModel],
+        user_id: int,
+        system_prompt: str = None,
+        temp: float = settings.default_temperature,
+        max_tokens: int = settings.default_max_tokens,
+        cache: bool = False,
+        extra_headers: dict = settings.extra_headers,
+    ) -> LlmProviderSendResponse:
+        """
+        Для OpenRouter замеряет задержку запроса и ставит генерацию в очередь сбора статистики,
+        см. `generation_stats`. Стоимость и апстрим подтягиваются фоном, не задерживая ответ.
+        """
+        if not self._is_openrouter:
+            return await super()._send_messages(
+                model, messages, user_id, system_prompt, temp, max_tokens, cache, extra_headers
+            )
+
+        upstreams = llm_router.get_preferred_upstreams(model) if settings.llm_router_enabled else []
+        ts = time.monotonic()
+        try:
+            response = await super()._send_messages(
+                model, messages, user_id, system_prompt, temp, max_tokens, cache, extra_headers
+            )
+        except Exception:
+            if settings.llm_router_enabled:
+                llm_router.record_error(model, upstreams[0] if upstreams else None)
+            raise
+        latency_ms = (time.monotonic() - ts) * 1000
+        gen_id = response.model_response.vendor_id
+        if gen_id:
+            generation_stats.add(gen_id, model, latency_ms, fetch=self.get_generation)
+            response.generation_id = gen_id
+        elif settings.llm_router_enabled:
+            llm_router.record_success(model, None, latency_ms)
+        return response
+
+    def _get_model_settings(self, model: str, temp: float, max_tokens: int, extra_headers: dict | None) -> ModelSettings:
+        model_settings = super()._get_model_settings(model, temp, max_tokens, extra_headers)
+        if self._is_openrouter and settings.llm_router_enabled:
+            upstreams = llm_router.get_preferred_upstreams(model)
+            if upstreams:
+                model_settings["extra_body"] = {"provider": {"order": upstreams, "allow_fallbacks": True}}
+        return model_settings
 
     # noinspection PyTypeChecker
     def _get_ai_instance(self, model: str) -> OpenAIModel:
         return OpenAIModel(
             model_name=model,
             provider=OpenAIProvider(
-                base_url=self._base_url,
-                api_key=self._api_key,
+                openai_client=AsyncOpenAI(
+                    base_url=self._base_url,
+                    api_key=self._api_key,
+                    max_retries=0,  # повторы делает self.retry_policy
+                    http_client=cached_async_http_client(provider="openai"),
+                ),
             )
         )
 
@@ -207,15 +459,14 @@ class OpenAiLlmProvider(BaseLlmProvider):
         return "openai/gpt-4.1-nano"
 
     async def count_tokens(self, model: str, messages: list[MessageModel]) -> int:
-        enc = tiktoken.encoding_for_model("gpt-4.1")
-        enc_res = enc.encode_batch([mes.content for mes in messages])
-        return sum(map(len, enc_res))
+        return await self.estimate_tokens(model, messages)
 
-    async def get_generation(self, gen_id: int) -> GenerationInfo:
+    async def get_generation(self, gen_id: str) -> GenerationInfo:
         url = f'{self._base_url}/generation'
         params = {"id": gen_id}
+        headers = {"Authorization": f"Bearer {self._api_key}"}
 
-        async with aiohttp.ClientSession() as session:
+        async with aiohttp.ClientSession(headers=headers) as session:
             async with session.get(url, params=params) as response:
                 response.raise_for_status()
                 data = await response.json()
@@ -224,15 +475,7 @@ class OpenAiLlmProvider(BaseLlmProvider):
 
     async def _update_models_cache(self) -> None:
         resp = await self.__fetch_models()
-        models = resp["data"]
-        self.models_cache.models = [AvailableModel.model_validate(model) for model in models]
-
-    async def get_providers_models(self) -> dict[str, list[AvailableModel]]:
-        models = await self.get_models()
-        models_d = defaultdict(list)
-        for model in models:
-            models_d[model.id.split('/')[0]].append(model)
-        return models_d
+        self.catalog = ModelCatalog.from_raw(resp["data"], previous=self.catalog)
 
     async def __fetch_models(self) -> dict:
         url = f'{self._base_url}/models'
@@ -244,8 +487,153 @@ class OpenAiLlmProvider(BaseLlmProvider):
                 return data
 
 
-def get_llm_provider(provider_type: LlmProviderType, api_key: str):
+class FakeLlmProvider(BaseLlmProvider):
+    """
+    Локальный провайдер без сети для разработки и нагрузочных тестов.
+
+    Ответ детерминирован (зависит от модели и последнего сообщения), длина, задержка и доля ошибок
+    задаются в `settings.fake_llm` и профилем модели из `PROFILES`. Usage считается локальным токенизатором.
+    """
+
+    PROFILES: dict[str, dict[str, float]] = {
+        "fake/default": {"latency": 1, "tokens": 1, "errors": 1},
+        "fake/fast": {"latency": 0.25, "tokens": 0.5, "errors": 1},
+        "fake/slow": {"latency": 4, "tokens": 2, "errors": 1},
+        "fake/flaky": {"latency": 1, "tokens": 1, "errors": 10},
+    }
+    """Множители задержки, длины ответа и доли ошибок для моделей каталога."""
+
+    WORDS = (
+        "модель ответ запрос токен контекст сообщение данные пример текст результат система пользователь "
+        "время значение список функция параметр задача решение вариант"
+    ).split()
+
+    def __init__(self, api_key: str = "", base_url: str | None = None, config: FakeLlmConfig = settings.fake_llm):
+        super().__init__(api_key, base_url, FunctionModel)
+        self._config = config
+        self._rng = random.Random(config.seed)
+
+    def _get_ai_instance(self, model: str) -> FunctionModel:
+        async def generate(messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+            return await self._generate(model, messages, info)
+
+        async def stream(messages: list[ModelMessage], info: AgentInfo) -> AsyncIterator[str]:
+            async for chunk in self._stream(model, messages, info):
+                yield chunk
+
+        return FunctionModel(generate, stream_function=stream, model_name=model)
+
+    def _get_default_model_name(self) -> str:
+        return "fake/default"
+
+    def _get_profile(self, model: str) -> dict[str, float]:
+        return self.PROFILES.get(model, self.PROFILES["fake/default"])
+
+    def _get_text(self, model: str, messages: list[ModelMessage], info: AgentInfo) -> str:
+        """Детерминированный текст ответа: одинаковый для одной модели и одного последнего сообщения."""
+        last_part = messages[-1].parts[-1] if messages and messages[-1].parts else None
+        prompt = str(getattr(last_part, "content", ""))
+        rng = random.Random(hashlib.sha256(f"{model}\n{prompt}".encode()).digest())
+        n_tokens = int(self._config.response_tokens * self._get_profile(model)["tokens"])
+        max_tokens = (info.model_settings or {}).get("max_tokens")
+        if max_tokens:
+            n_tokens = min(n_tokens, max_tokens)
+        return " ".join(rng.choice(self.WORDS) for _ in range(max(1, n_tokens)))
+
+    async def _simulate_request(self, model: str) -> None:
+        """Задержка и инъекция ошибок."""
+        profile = self._get_profile(model)
+        latency_ms = self._config.latency_ms * profile["latency"] * self._rng.lognormvariate(0, self._config.latency_sigma)
+        await asyncio.sleep(latency_ms / 1000)
+        roll = self._rng.random()
+        if roll < self._config.rate_limit_rate * profile["errors"]:
+            response = httpx.Response(
+                429,
+                headers={"retry-after-ms": "1000"},
+                request=httpx.Request("POST", "http://fake-llm/chat/completions"),
+            )
+            raise ModelHTTPError(429, model, "fake rate limit") from httpx.HTTPStatusError(
+                "fake rate limit", request=response.request, response=response
+            )
+        if roll < (self._config.rate_limit_rate + self._config.error_rate) * profile["errors"]:
+            raise ModelHTTPError(500, model, "fake error")
+
+    async def _generate(self, model: str, messages: list[ModelMessage], info: AgentInfo) -> ModelResponse:
+        await self._simulate_request(model)
+        text = self._get_text(model, messages, info)
+        request_texts = [str(getattr(part, "content", "")) for message in messages for part in message.parts]
+        request_tokens = await tokenizer_service.count(request_texts, model=model, tokenizer=None)
+        response_tokens = len(text.split())
+        return ModelResponse(
+            parts=[TextPart(content=text)],
+            usage=Usage(
+                requests=1,
+                request_tokens=request_tokens,
+                response_tokens=response_tokens,
+                total_tokens=request_tokens + response_tokens,
+            ),
+            model_name=model,
+            vendor_id=f"fake-{uuid.uuid4().hex}",
+        )
+
+    async def _stream(self, model: str, messages: list[ModelMessage], info: AgentInfo) -> AsyncIterator[str]:
+        await self._simulate_request(model)
+        for word in self._get_text(model, messages, info).split(" "):
+            yield word + " "
+            await asyncio.sleep(self._config.chunk_delay_ms / 1000)
+
+    async def count_tokens(self, model: str, messages: list[MessageModel]) -> int:
+        return await self.estimate_tokens(model, messages)
+
+    async def _update_models_cache(self) -> None:
+        rng = random.Random(self._config.seed)
+        ids = list(self.PROFILES) + [
+            f"fake/model-{i}" for i in range(max(0, self._config.catalog_size - len(self.PROFILES)))
+        ]
+        models = [
+            AvailableModel.model_validate({
+                "id": model_id,
+                "name": f"Fake: {model_id.removeprefix('fake/')}",
+                "created": datetime(2025, 1, 1, tzinfo=UTC) - timedelta(days=i),
+                "context_length": 128_000,
+                "architecture": {
+                    "modality": "text->text",
+                    "input_modalities": ["text"],
+                    "output_modalities": ["text"],
+                    "tokenizer": "GPT",
+                    "instruct_type": None,
+                },
+                "pricing": {
+                    "prompt": round(rng.uniform(0.1, 5) / 1_000_000, 12),
+                    "completion": round(rng.uniform(0.4, 15) / 1_000_000, 12),
+                },
+            })
+            for i, model_id in enumerate(ids)
+        ]
+        self.catalog = ModelCatalog(models, updated_at=datetime.now(UTC))
+
+
+def get_llm_provider(
+    provider_type: LlmProviderType,
+    api_key: str,
+    base_url: str | None = None,
+    rate_limit: RateLimitConfig | None = None,
+    model_rate_limits: dict[str, RateLimitConfig] | None = None,
+):
+    """
+    Провайдер ллм по типу.
+
+    :param rate_limit: лимит RPM/TPM ключа `api_key`, None - без лимита.
+    :param model_rate_limits: лимиты RPM/TPM моделей на этом ключе.
+    """
     if provider_type == LlmProviderType.ANTHROPIC:
-        return AnthropicLlmProvider(api_key=api_key)
+        provider = AnthropicLlmProvider(api_key=api_key, base_url=base_url)
     elif provider_type == LlmProviderType.OPENAI:
-        return OpenAiLlmProvider(api_key=api_key)
+        provider = OpenAiLlmProvider(api_key=api_key, base_url=base_url or OpenAiLlmProvider.DEFAULT_BASE_URL)
+    elif provider_type == LlmProviderType.FAKE:
+        provider = FakeLlmProvider(api_key=api_key, base_url=base_url)
+    else:
+        raise ValueError(f"unknown llm provider type: {provider_type}")
+    if rate_limit is not None or model_rate_limits:
+        provider.rate_limiter = LlmRateLimiter(key_limit=rate_limit, model_limits=model_rate_limits)
+    return provider
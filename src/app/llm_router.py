@@ -0,0 +1,141 @@
+import time
+from dataclasses import dataclass
+
+from src.config import settings
+from src.models import GenerationInfo
+
+UNKNOWN_UPSTREAM = "*"
+"""Апстрим, если провайдер не известен (ошибка до ответа без предпочтений маршрутизации)."""
+
+
+@dataclass
+class UpstreamStats:
+    """
+    Скользящая статистика для пары (модель, апстрим провайдер).
+
+    :var latency_ms: EWMA полного времени запроса по нашим замерам
+    :var ttft_ms: EWMA времени до первого токена по данным OpenRouter `/generation`
+    :var generation_ms: EWMA времени генерации по данным OpenRouter `/generation`
+    :var error_rate: EWMA доли ошибок
+    :var samples: число наблюдений
+    :var updated_at: время последнего наблюдения, `time.monotonic()`
+    """
+    latency_ms: float | None = None
+    ttft_ms: float | None = None
+    generation_ms: float | None = None
+    error_rate: float = 0.0
+    samples: int = 0
+    updated_at: float = 0.0
+
+    @property
+    def score(self) -> float:
+        """Чем меньше, тем быстрее апстрим."""
+        if self.ttft_ms is not None:
+            return self.ttft_ms
+        if self.latency_ms is not None:
+            return self.latency_ms
+        return float("inf")
+
+
+class LatencyRouter:
+    """
+    Маршрутизация запросов к самому быстрому здоровому апстриму модели.
+
+    Статистика собирается из собственных замеров и `GenerationInfo` (provider_name, latency, generation_time).
+    Результат - порядок провайдеров для OpenRouter `provider.order`, с разрешённым fallback на остальных.
+    """
+
+    def __init__(
+        self,
+        alpha: float = settings.llm_router_alpha,
+        max_error_rate: float = settings.llm_router_max_error_rate,
+        min_samples: int = settings.llm_router_min_samples,
+        stats_ttl_sec: int = settings.llm_router_stats_ttl_sec,
+    ):
+        self._alpha = alpha
+        self._max_error_rate = max_error_rate
+        self._min_samples = min_samples
+        self._stats_ttl_sec = stats_ttl_sec
+        self._stats: dict[tuple[str, str], UpstreamStats] = {}
+
+    def _get_stats(self, model: str, upstream: str | None) -> UpstreamStats:
+        key = (model, upstream or UNKNOWN_UPSTREAM)
+        if key not in self._stats:
+            self._stats[key] = UpstreamStats()
+        return self._stats[key]
+
+    def _ewma(self, old: float | None, value: float) -> float:
+        if old is None:
+            return value
+        return self._alpha * value + (1 - self._alpha) * old
+
+    def record_success(self, model: str, upstream: str | None, latency_ms: float) -> None:
+        """Успешный запрос по нашим замерам."""
+        stats = self._get_stats(model, upstream)
+        stats.latency_ms = self._ewma(stats.latency_ms, latency_ms)
+        stats.error_rate = self._ewma(stats.error_rate, 0.0)
+        stats.samples += 1
+        stats.updated_at = time.monotonic()
+
+    def record_error(self, model: str, upstream: str | None) -> None:
+        """Неудачный запрос."""
+        stats = self._get_stats(model, upstream)
+        stats.error_rate = self._ewma(stats.error_rate, 1.0)
+        stats.samples += 1
+        stats.updated_at = time.monotonic()
+
+    def record_generation(self, model: str, info: GenerationInfo) -> None:
+        """
+        Данные OpenRouter `/generation` о запросе: апстрим и время до первого токена.
+
+        :param model: id модели из запроса, `info.model` может содержать версию модели.
+        """
+        if not info.provider_name or info.latency is None:
+            return
+        stats = self._get_stats(model, info.provider_name)
+        stats.ttft_ms = self._ewma(stats.ttft_ms, info.latency)
+        if info.generation_time is not None:
+            stats.generation_ms = self._ewma(stats.generation_ms, info.generation_time)
+        stats.updated_at = time.monotonic()
+
+    def is_healthy(self, stats: UpstreamStats) -> bool:
+        return (
+            stats.samples >= self._min_samples
+            and stats.error_rate <= self._max_error_rate
+            and time.monotonic() - stats.updated_at < self._stats_ttl_sec
+        )
+
+    def get_preferred_upstreams(self, model: str) -> list[str]:
+        """
+        Здоровые апстримы модели от быстрого к медленному.
+
+        :return: список имён провайдеров, может быть пустым, если статистики ещё нет.
+        """
+        candidates = [
+            (stats.score, upstream)
+            for (m, upstream), stats in self._stats.items()
+            if m == model and upstream != UNKNOWN_UPSTREAM and self.is_healthy(stats)
+        ]
+        return [upstream for _, upstream in sorted(candidates)]
+
+    def get_routing_table(self) -> list[tuple[str, str, UpstreamStats]]:
+        """:return: список (модель, апстрим, статистика), отсортированный по модели и скорости."""
+        rows = [(model, upstream, stats) for (model, upstream), stats in self._stats.items()]
+        return sorted(rows, key=lambda row: (row[0], row[2].score))
+
+    def format_routing_table(self) -> str:
+        rows = []
+        for model, upstream, stats in self.get_routing_table():
+            latency = f"{stats.latency_ms:.0f}" if stats.latency_ms is not None else "-"
+            ttft = f"{stats.ttft_ms:.0f}" if stats.ttft_ms is not None else "-"
+            generation = f"{stats.generation_ms:.0f}" if stats.generation_ms is not None else "-"
+            health = "ok" if self.is_healthy(stats) else "--"
+            rows.append(
+                f"{model} | {upstream} | {health} | ttft {ttft}ms | gen {generation}ms | total {latency}ms | "
+                f"err {stats.error_rate:.2f} | n={stats.samples}"
+            )
+        return "\n".join(rows)
+
+
+llm_router = LatencyRouter()
+"""Статистика маршрутизации по апстримам OpenRouter."""
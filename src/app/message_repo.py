@@ -1,6 +1,6 @@
 from datetime import datetime
 
-from src.models import MessageRecord, MessageModel
+from src.models import MessageRecord, MessageModel, GenerationInfo
 from src.app.database import MongoManager
 
 
@@ -19,6 +19,8 @@ class MessageRepository:
         tokens_message: int,
         tokens_from_prov: int,
         timestamp: datetime,
+        cached: bool = False,
+        generation_id: str | None = None,
     ) -> None:
         if topic_id is None:
             topic_id = 1
@@ -30,9 +32,28 @@ class MessageRepository:
             tokens_message=tokens_message,
             tokens_from_prov=tokens_from_prov,
             timestamp=timestamp,
+            cached=cached,
+            generation_id=generation_id,
         )
         await self.__db_provider.add_chat_message_record(message, chat_id, topic_id)
 
     async def get_messages_from_db(self, chat_id: int, topic_id: int = 0, offset: int = 0, sort=None) -> list[MessageRecord]:
         messages_res = await self.__db_provider.get_chat_message_records(chat_id, topic_id, offset, sort)
         return messages_res
+
+    async def set_generation_stats(self, chat_id: int, topic_id: int, stats: list[tuple[str, GenerationInfo]]) -> None:
+        """
+        Записать в сообщения ллм стоимость и задержки из статистики генераций.
+
+        :param stats: [(id генерации, статистика)]
+        """
+        updates = {
+            gen_id: {
+                "total_cost": info.total_cost,
+                "cache_discount": info.cache_discount,
+                "latency_ms": info.latency,
+                "generation_time_ms": info.generation_time,
+            }
+            for gen_id, info in stats
+        }
+        await self.__db_provider.update_message_records(updates, chat_id, topic_id)
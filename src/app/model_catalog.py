@@ -0,0 +1,150 @@
+import json
+import zlib
+from collections import defaultdict
+from datetime import datetime, UTC
+from types import MappingProxyType
+from typing import Mapping
+
+from src.app.database import MongoManager
+from src.app.model_search import ModelSearchIndex
+from src.models import AvailableModel
+from src.tools.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class ModelCatalog:
+    """
+    Неизменяемый снимок каталога моделей провайдера с индексами.
+
+    Строится один раз на обновление и заменяется целиком присваиванием, поэтому читатели
+    никогда не видят наполовину обновлённый каталог.
+
+    :var models: модели, от новых к старым.
+    :var updated_at: время получения каталога от провайдера.
+    """
+
+    __slots__ = ("models", "updated_at", "_by_hash", "_by_id", "_providers", "_raw_by_id", "_search_index")
+
+    def __init__(
+        self,
+        models: list[AvailableModel],
+        updated_at: datetime | None = None,
+        raw_by_id: dict[str, dict] | None = None,
+    ):
+        self.models: tuple[AvailableModel, ...] = tuple(sorted(models, key=lambda m: m.created, reverse=True))
+        self.updated_at: datetime | None = updated_at
+        self._by_hash: dict[str, AvailableModel] = {m.id_hash: m for m in self.models}
+        self._by_id: dict[str, AvailableModel] = {m.id: m for m in self.models}
+        providers: dict[str, list[AvailableModel]] = defaultdict(list)
+        for m in self.models:
+            providers[m.id.split("/")[0]].append(m)
+        self._providers: Mapping[str, tuple[AvailableModel, ...]] = MappingProxyType(
+            {provider: tuple(provider_models) for provider, provider_models in sorted(providers.items())}
+        )
+        self._raw_by_id: dict[str, dict] = raw_by_id or {}
+        self._search_index: ModelSearchIndex | None = None
+
+    @classmethod
+    def from_raw(cls, raw_models: list[dict], previous: "ModelCatalog | None" = None) -> "ModelCatalog":
+        """
+        Построить каталог из ответа провайдера (OpenRouter `/models`).
+
+        Модели, не изменившиеся с прошлого снимка, берутся из него без повторной валидации.
+
+        :param raw_models: список моделей в формате API.
+        :param previous: прошлый снимок.
+        """
+        models = []
+        raw_by_id = {}
+        for raw in raw_models:
+            model_id = raw.get("id")
+            model = None
+            if previous is not None and previous._raw_by_id.get(model_id) == raw:
+                model = previous._by_id.get(model_id)
+            if model is None:
+                model = AvailableModel.model_validate(raw)
+            models.append(model)
+            raw_by_id[model.id] = raw
+        return cls(models, updated_at=datetime.now(UTC), raw_by_id=raw_by_id)
+
+    def to_snapshot(self) -> bytes:
+        """
+        Сжатый снимок каталога для сохранения между перезапусками.
+
+        Хранятся исходные данные провайдера, если они есть, чтобы после загрузки снимка
+        `from_raw` мог переиспользовать неизменившиеся модели.
+        """
+        models = [
+            self._raw_by_id.get(m.id) or m.model_dump(mode="json", exclude={"id_hash"})
+            for m in self.models
+        ]
+        payload = {
+            "updated_at": self.updated_at.isoformat() if self.updated_at else None,
+            "models": models,
+        }
+        return zlib.compress(json.dumps(payload, ensure_ascii=False, separators=(",", ":")).encode())
+
+    @classmethod
+    def from_snapshot(cls, data: bytes) -> "ModelCatalog":
+        """
+        Каталог из снимка `to_snapshot`, время обновления сохраняется, поэтому старый снимок считается устаревшим.
+        """
+        payload = json.loads(zlib.decompress(data))
+        updated_at = datetime.fromisoformat(payload["updated_at"]) if payload["updated_at"] else None
+        models = [AvailableModel.model_validate(raw) for raw in payload["models"]]
+        return cls(models, updated_at=updated_at, raw_by_id={m.id: raw for m, raw in zip(models, payload["models"])})
+
+    def __len__(self) -> int:
+        return len(self.models)
+
+    def __bool__(self) -> bool:
+        return bool(self.models)
+
+    def get_by_hash(self, model_hash: str) -> AvailableModel | None:
+        return self._by_hash.get(model_hash)
+
+    def get_by_id(self, model_id: str) -> AvailableModel | None:
+        return self._by_id.get(model_id)
+
+    @property
+    def search_index(self) -> ModelSearchIndex:
+        """Поисковый индекс по моделям снимка, строится при первом обращении."""
+        if self._search_index is None:
+            self._search_index = ModelSearchIndex(self.models)
+        return self._search_index
+
+    @property
+    def providers(self) -> Mapping[str, tuple[AvailableModel, ...]]:
+        """Модели по провайдерам (часть id до `/`), провайдеры по алфавиту, модели от новых к старым."""
+        return self._providers
+
+
+class ModelCatalogStore:
+    """
+    Снимки каталогов моделей в MongoDB, чтобы после перезапуска каталог был доступен сразу,
+    даже если провайдер недоступен, а кнопки моделей, созданные до перезапуска, продолжали работать.
+    """
+
+    def __init__(self, db_provider: MongoManager):
+        self._db_provider = db_provider
+
+    async def load(self, key: str) -> ModelCatalog | None:
+        """
+        :param key: ключ провайдера, см `BaseLlmProvider._get_catalog_key`.
+        :return: каталог или None, если снимка нет или он не читается.
+        """
+        try:
+            data = await self._db_provider.get_model_catalog_snapshot(key)
+            if data is None:
+                return None
+            return ModelCatalog.from_snapshot(data)
+        except Exception as e:
+            logger.warning(f"model catalog snapshot load failed: {key=}, {e!r}")
+            return None
+
+    async def save(self, key: str, catalog: ModelCatalog) -> None:
+        try:
+            await self._db_provider.set_model_catalog_snapshot(key, catalog.to_snapshot())
+        except Exception as e:
+            logger.warning(f"model catalog snapshot save failed: {key=}, {e!r}")
@@ -0,0 +1,160 @@
+import re
+from collections import defaultdict
+from typing import Sequence
+
+from src.models import AvailableModel
+
+_SPLIT_RE = re.compile(r"[\s/:|(),]+")
+_SEPARATORS_RE = re.compile(r"[-._]")
+
+SCORE_EXACT = 100
+SCORE_ID_PREFIX = 80
+SCORE_TERM_PREFIX = 60
+SCORE_SUBSTRING = 40
+SCORE_FUZZY = 20
+FUZZY_MIN_SIMILARITY = 0.6
+
+
+def _normalize(text: str) -> str:
+    return text.lower().strip()
+
+
+def _compact(text: str) -> str:
+    """Без разделителей внутри слов: `gpt-4.1` и `gpt4.1` ищутся как `gpt41`."""
+    return _SEPARATORS_RE.sub("", text)
+
+
+def _trigrams(text: str) -> set[str]:
+    return {text[i:i + 3] for i in range(len(text) - 2)}
+
+
+class _TrieNode:
+    __slots__ = ("children", "ids")
+
+    def __init__(self):
+        self.children: dict[str, _TrieNode] = {}
+        self.ids: set[int] = set()
+        """Модели, у которых есть термин, начинающийся с пути до этого узла."""
+
+
+class ModelSearchIndex:
+    """
+    Поисковый индекс по id, названию и провайдеру моделей.
+
+    Префиксное дерево по терминам (полный id, id без провайдера, провайдер, слова названия)
+    и индекс триграмм по строке `"{id} {name}"` для поиска подстроки и нечёткого поиска.
+    Термины и строка индексируются ещё и без `-`, `.`, `_`, поэтому `gpt4` находит `gpt-4o`.
+    Строится один раз на снимок каталога, см `ModelCatalog.search_index`.
+    """
+
+    def __init__(self, models: Sequence[AvailableModel]):
+        self._models: tuple[AvailableModel, ...] = tuple(models)
+        self._exact: dict[str, set[int]] = defaultdict(set)
+        self._ids: list[tuple[str, ...]] = []  # (id, id без провайдера) и они же без разделителей
+        self._haystacks: list[str] = []
+        self._root = _TrieNode()
+        self._trigrams: dict[str, set[int]] = defaultdict(set)
+        for idx, model in enumerate(self._models):
+            model_id = _normalize(model.id)
+            short_id = model_id.split("/", 1)[-1]
+            name = _normalize(model.name)
+            self._ids.append((model_id, short_id, _compact(model_id), _compact(short_id)))
+            for key in (model_id, short_id, name):
+                self._exact[key].add(idx)
+                self._exact[_compact(key)].add(idx)
+            terms = {model_id, short_id, *_SPLIT_RE.split(model_id), *_SPLIT_RE.split(name)}
+            for term in terms | {_compact(term) for term in terms}:
+                if term:
+                    self._add_term(term, idx)
+            haystack = f"{model_id} {name}"
+            haystack = f"{haystack} {_compact(haystack)}"
+            self._haystacks.append(haystack)
+            for trigram in _trigrams(haystack):
+                self._trigrams[trigram].add(idx)
+
+    def _add_term(self, term: str, idx: int) -> None:
+        node = self._root
+        for char in term:
+            node = node.children.setdefault(char, _TrieNode())
+            node.ids.add(idx)
+
+    def _prefix_ids(self, prefix: str) -> set[int]:
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return set()
+        return node.ids
+
+    def _score_word(self, word: str) -> dict[int, float]:
+        """Оценка совпадения каждой подходящей модели с одним словом запроса, с разделителями и без."""
+        scores = self._score_form(word)
+        compact = _compact(word)
+        if compact and compact != word:
+            for idx, score in self._score_form(compact).items():
+                if score > scores.get(idx, 0):
+                    scores[idx] = score
+        return scores
+
+    def _score_form(self, word: str) -> dict[int, float]:
+        scores: dict[int, float] = {}
+
+        def put(idx: int, score: float) -> None:
+            if score > scores.get(idx, 0):
+                scores[idx] = score
+
+        for idx in self._exact.get(word, ()):
+            put(idx, SCORE_EXACT)
+        for idx in self._prefix_ids(word):
+            id_prefix = any(model_id.startswith(word) for model_id in self._ids[idx])
+            put(idx, SCORE_ID_PREFIX if id_prefix else SCORE_TERM_PREFIX)
+
+        query_trigrams = _trigrams(word)
+        if not query_trigrams:
+            return scores
+        counts: dict[int, int] = defaultdict(int)
+        for trigram in query_trigrams:
+            for idx in self._trigrams.get(trigram, ()):
+                counts[idx] += 1
+        for idx, count in counts.items():
+            if idx in scores:
+                continue
+            if count == len(query_trigrams) and word in self._haystacks[idx]:
+                put(idx, SCORE_SUBSTRING)
+                continue
+            similarity = count / len(query_trigrams)
+            if similarity >= FUZZY_MIN_SIMILARITY:
+                put(idx, SCORE_FUZZY * similarity)
+        return scores
+
+    def search(self, query: str, limit: int = 20) -> list[AvailableModel]:
+        """
+        Найти модели по запросу.
+
+        Слова запроса должны совпасть все. Порядок: точное совпадение, префикс id, префикс слова,
+        подстрока, нечёткое совпадение; при равной оценке новые модели выше.
+
+        :param query: например `gpt-4`, `claude sonnet`, `openai/o3`.
+        :param limit: максимум результатов.
+        :return: модели, от лучшего совпадения к худшему. Пустой запрос - новые модели.
+        """
+        query = _normalize(query)
+        words = [w for w in _SPLIT_RE.split(query) if w]
+        if not words:
+            return list(self._models[:limit])
+        total: dict[int, float] | None = None
+        for word in words:
+            scores = self._score_word(word)
+            if total is None:
+                total = scores
+            else:
+                total = {idx: total[idx] + score for idx, score in scores.items() if idx in total}
+            if not total:
+                return []
+        if len(words) > 1:
+            for idx in self._exact.get(query, ()):
+                if idx in total:
+                    total[idx] += SCORE_EXACT
+        # модели в каталоге уже отсортированы от новых к старым, индекс - вторичный ключ
+        ranked = sorted(total.items(), key=lambda item: (-item[1], item[0]))
+        return [self._models[idx] for idx, _ in ranked[:limit]]
@@ -0,0 +1,147 @@
+import asyncio
+import time
+from dataclasses import dataclass
+
+from src.config import settings, RateLimitConfig
+from src.tools.log import get_logger
+from src.tools.metrics import metrics
+
+logger = get_logger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """Запрос не дождался своей очереди в лимитах RPM/TPM."""
+
+    def __init__(self, model: str, wait_sec: float):
+        super().__init__(f"rate limit for {model}: need to wait {wait_sec:.1f}s")
+        self.model = model
+        self.wait_sec = wait_sec
+
+
+class TokenBucket:
+    """
+    Token bucket с равномерным пополнением `rate_per_min` единиц в минуту.
+
+    Баланс может уйти в минус после сверки с фактическим расходом, тогда следующие запросы подождут.
+    """
+
+    def __init__(self, rate_per_min: int):
+        self.capacity = float(rate_per_min)
+        self._rate_per_sec = rate_per_min / 60
+        self.tokens = self.capacity
+        self._updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated_at) * self._rate_per_sec)
+        self._updated_at = now
+
+    def get_wait(self, amount: float) -> float:
+        """:return: сколько секунд ждать, пока в корзине наберётся `amount` (но не больше ёмкости)."""
+        self._refill()
+        need = min(amount, self.capacity) - self.tokens
+        if need <= 0:
+            return 0.0
+        return need / self._rate_per_sec
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.tokens -= amount
+
+    def give_back(self, amount: float) -> None:
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens + amount)
+
+
+@dataclass
+class Reservation:
+    """Резерв лимита под один запрос, см. `LlmRateLimiter.acquire`."""
+    model: str
+    tokens: int
+
+
+class LlmRateLimiter:
+    """
+    Клиентский лимит запросов (RPM) и токенов (TPM) для одного ключа провайдера.
+
+    Лимиты задаются на весь ключ и отдельно на модели. Запросы сверх лимита ждут в очереди (FIFO)
+    не дольше `max_wait_sec`, иначе получают RateLimitExceeded, не отправляясь провайдеру.
+    Без лимитов запросы проходят сразу.
+    """
+
+    def __init__(
+        self,
+        key_limit: RateLimitConfig | None = None,
+        model_limits: dict[str, RateLimitConfig] | None = None,
+        max_wait_sec: float = settings.llm_rate_limit_max_wait_sec,
+    ):
+        self._model_limits = model_limits or {}
+        self._max_wait_sec = max_wait_sec
+        self._key_buckets = self._make_buckets(key_limit)
+        self._model_buckets: dict[str, list[tuple[TokenBucket, str]]] = {}
+        self._locks: dict[str, asyncio.Lock] = {}
+
+    @staticmethod
+    def _make_buckets(limit: RateLimitConfig | None) -> list[tuple[TokenBucket, str]]:
+        buckets = []
+        if limit is not None and limit.rpm:
+            buckets.append((TokenBucket(limit.rpm), "requests"))
+        if limit is not None and limit.tpm:
+            buckets.append((TokenBucket(limit.tpm), "tokens"))
+        return buckets
+
+    def _get_buckets(self, model: str) -> list[tuple[TokenBucket, str]]:
+        if model not in self._model_buckets:
+            self._model_buckets[model] = self._make_buckets(self._model_limits.get(model))
+        return self._key_buckets + self._model_buckets[model]
+
+    def _get_wait(self, buckets: list[tuple[TokenBucket, str]], tokens: int) -> float:
+        return max(
+            [bucket.get_wait(1 if kind == "requests" else tokens) for bucket, kind in buckets],
+            default=0.0,
+        )
+
+    async def acquire(self, model: str, tokens: int) -> Reservation:
+        """
+        Дождаться лимита под запрос.
+
+        :param model: id модели.
+        :param tokens: оценка входных токенов запроса.
+        :raises RateLimitExceeded: если ждать пришлось бы дольше `max_wait_sec`.
+        """
+        buckets = self._get_buckets(model)
+        if buckets:
+            lock = self._locks.setdefault(model, asyncio.Lock())
+            deadline = time.monotonic() + self._max_wait_sec
+            ts = time.monotonic()
+            try:
+                async with asyncio.timeout(self._max_wait_sec), lock:
+                    while (wait := self._get_wait(buckets, tokens)) > 0:
+                        if time.monotonic() + wait > deadline:
+                            raise RateLimitExceeded(model, wait)
+                        await asyncio.sleep(wait)
+                    for bucket, kind in buckets:
+                        bucket.take(1 if kind == "requests" else tokens)
+            except TimeoutError:
+                metrics.inc("llm_rate_limit_rejected_total", model=model)
+                raise RateLimitExceeded(model, self._max_wait_sec)
+            except RateLimitExceeded:
+                metrics.inc("llm_rate_limit_rejected_total", model=model)
+                raise
+            metrics.observe("llm_rate_limit_wait_seconds", time.monotonic() - ts, model=model)
+        return Reservation(model=model, tokens=tokens)
+
+    def reconcile(self, reservation: Reservation, actual_tokens: int | None) -> None:
+        """
+        Сверить резерв с фактическим расходом токенов после ответа.
+
+        :param actual_tokens: токены из usage, None - запрос не выполнен, резерв токенов возвращается.
+        """
+        for bucket, kind in self._get_buckets(reservation.model):
+            if kind != "tokens":
+                continue
+            diff = reservation.tokens if actual_tokens is None else reservation.tokens - actual_tokens
+            if diff >= 0:
+                bucket.give_back(diff)
+            else:
+                bucket.take(-diff)
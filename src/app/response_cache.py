@@ -0,0 +1,106 @@
+import hashlib
+import json
+from collections import OrderedDict
+from datetime import datetime, UTC, timedelta
+
+from pydantic_ai.messages import ModelResponse, TextPart
+from pydantic_ai.usage import Usage
+
+from src.app.database import MongoManager
+from src.config import settings
+from src.models import MessageModel, CachedResponse, LlmProviderSendResponse
+from src.tools.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class ResponseCache:
+    """
+    Кэш ответов ллм для детерминированных запросов.
+
+    Ключ - хэш от (модель, системный промпт, температура, нормализованный список сообщений).
+    Первый уровень - LRU в памяти с TTL, второй (опционально) - коллекция в MongoDB.
+    """
+
+    def __init__(
+        self,
+        db_provider: MongoManager | None = None,
+        ttl_sec: int = settings.response_cache_ttl_sec,
+        max_size: int = settings.response_cache_max_size,
+    ):
+        self._db_provider = db_provider
+        self._ttl = timedelta(seconds=ttl_sec)
+        self._max_size = max_size
+        self._items: OrderedDict[str, CachedResponse] = OrderedDict()
+        if self._db_provider is not None:
+            self._db_provider.create_response_cache_index(ttl_sec)
+
+    @staticmethod
+    def get_key(model: str, system_prompt: str | None, temperature: float, messages: list[MessageModel]) -> str:
+        """
+        Ключ кэша для запроса.
+
+        Тексты сообщений нормализуются: переводы строк приводятся к `\\n`, пробелы по краям обрезаются.
+
+        :return: sha256 hexdigest
+        """
+        payload = {
+            "model": model,
+            "system_prompt": (system_prompt or "").strip(),
+            "temperature": float(temperature),
+            "messages": [(m.role, m.content.replace("\r\n", "\n").strip()) for m in messages],
+        }
+        raw = json.dumps(payload, ensure_ascii=False, separators=(",", ":"))
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    async def get(self, key: str) -> LlmProviderSendResponse | None:
+        cached = self._items.get(key)
+        if cached is None and self._db_provider is not None:
+            cached = await self._db_provider.get_cached_response(key)
+            if cached is not None:
+                self._put(cached)
+        if cached is None:
+            return None
+        if self._is_expired(cached):
+            self._items.pop(key, None)
+            return None
+        self._items.move_to_end(key)
+        return self._to_send_response(cached)
+
+    async def set(self, key: str, response: LlmProviderSendResponse) -> None:
+        cached = CachedResponse(
+            key=key,
+            content=response.model_response.parts[0].content,
+            model_name=response.model_response.model_name,
+            request_tokens=response.usage.request_tokens,
+            response_tokens=response.usage.response_tokens,
+            created_at=datetime.now(UTC),
+        )
+        self._put(cached)
+        if self._db_provider is not None:
+            try:
+                await self._db_provider.set_cached_response(cached)
+            except Exception as e:
+                logger.warning(f"can't save response to persistent cache: {e}")
+
+    def _put(self, cached: CachedResponse) -> None:
+        self._items[cached.key] = cached
+        self._items.move_to_end(cached.key)
+        while len(self._items) > self._max_size:
+            self._items.popitem(last=False)
+
+    def _is_expired(self, cached: CachedResponse) -> bool:
+        created_at = cached.created_at
+        if created_at.tzinfo is None:
+            created_at = created_at.replace(tzinfo=UTC)
+        return created_at < datetime.now(UTC) - self._ttl
+
+    @staticmethod
+    def _to_send_response(cached: CachedResponse) -> LlmProviderSendResponse:
+        usage = Usage(request_tokens=cached.request_tokens, response_tokens=cached.response_tokens)
+        model_response = ModelResponse(
+            parts=[TextPart(content=cached.content)],
+            usage=usage,
+            model_name=cached.model_name,
+        )
+        return LlmProviderSendResponse(model_response=model_response, usage=usage, cached=True)
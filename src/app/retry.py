@@ -0,0 +1,155 @@
+import asyncio
+import random
+import time
+from datetime import datetime, UTC
+from email.utils import parsedate_to_datetime
+from typing import Callable, Awaitable, TypeVar
+
+import anthropic
+import httpx
+import openai
+from pydantic_ai.exceptions import ModelHTTPError
+
+from src.config import settings
+from src.tools.deadline import get_remaining
+from src.tools.log import get_logger
+from src.tools.metrics import metrics
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+RETRYABLE_STATUS_CODES = {408, 409, 425, 429, 500, 502, 503, 504, 529}
+"""HTTP статусы, после которых запрос можно повторить (529 - overloaded у Anthropic)."""
+
+RESET_HEADERS = (
+    "x-ratelimit-reset",
+    "anthropic-ratelimit-requests-reset",
+    "anthropic-ratelimit-tokens-reset",
+    "anthropic-ratelimit-input-tokens-reset",
+    "anthropic-ratelimit-output-tokens-reset",
+)
+
+
+def is_retryable(exc: BaseException) -> bool:
+    """
+    Можно ли повторить запрос после ошибки.
+
+    Повторяются перегрузка/лимиты (429, 529), ошибки сервера, таймауты и ошибки соединения.
+    Ошибки запроса (400, 401, 404 и т.д.) считаются фатальными.
+    """
+    if isinstance(exc, ModelHTTPError):
+        return exc.status_code in RETRYABLE_STATUS_CODES
+    return isinstance(
+        exc,
+        (TimeoutError, httpx.TransportError, openai.APIConnectionError, anthropic.APIConnectionError),
+    )
+
+
+def _parse_reset(value: str) -> float | None:
+    """
+    Время до сброса лимита из значения заголовка, в секундах.
+
+    Поддерживаются: секунды, unix время в секундах/миллисекундах (OpenRouter), RFC 3339 (Anthropic), HTTP дата.
+    """
+    now = datetime.now(UTC)
+    try:
+        number = float(value)
+    except ValueError:
+        pass
+    else:
+        if number > 1e12:
+            return number / 1000 - now.timestamp()
+        if number > 1e9:
+            return number - now.timestamp()
+        return number
+    for parse in (datetime.fromisoformat, parsedate_to_datetime):
+        try:
+            dt = parse(value)
+        except (ValueError, TypeError):
+            continue
+        if dt.tzinfo is None:
+            dt = dt.replace(tzinfo=UTC)
+        return (dt - now).total_seconds()
+    return None
+
+
+def get_retry_after(exc: BaseException) -> float | None:
+    """
+    Сколько ждать перед повтором по заголовкам ответа провайдера.
+
+    :return: секунды или None, если провайдер не прислал подсказку.
+    """
+    response = getattr(exc.__cause__, "response", None) or getattr(exc, "response", None)
+    headers = getattr(response, "headers", None)
+    if not headers:
+        return None
+    if "retry-after-ms" in headers:
+        with_ms = _parse_reset(headers["retry-after-ms"])
+        if with_ms is not None:
+            return max(0.0, with_ms / 1000)
+    for name in ("retry-after", *RESET_HEADERS):
+        if name in headers:
+            delay = _parse_reset(headers[name])
+            if delay is not None:
+                return max(0.0, delay)
+    return None
+
+
+class RetryPolicy:
+    """
+    Повтор запросов к ллм с экспоненциальной задержкой и jitter.
+
+    Задержка из `Retry-After`/`x-ratelimit-reset` имеет приоритет над экспоненциальной.
+    Все попытки укладываются в `deadline_sec`: если следующая попытка не успевает, ошибка пробрасывается сразу.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = settings.llm_retry_max_attempts,
+        base_delay_sec: float = settings.llm_retry_base_delay_sec,
+        max_delay_sec: float = settings.llm_retry_max_delay_sec,
+        deadline_sec: float = settings.llm_retry_deadline_sec,
+    ):
+        self._max_attempts = max_attempts
+        self._base_delay_sec = base_delay_sec
+        self._max_delay_sec = max_delay_sec
+        self._deadline_sec = deadline_sec
+
+    def get_delay(self, attempt: int, exc: BaseException) -> float:
+        """
+        :param attempt: номер неудачной попытки, с 0.
+        :param exc: ошибка попытки.
+        """
+        retry_after = get_retry_after(exc)
+        if retry_after is not None:
+            return retry_after + random.uniform(0, self._base_delay_sec)
+        return random.uniform(0, min(self._max_delay_sec, self._base_delay_sec * 2 ** attempt))
+
+    async def call(self, func: Callable[[], Awaitable[T]], name: str = "llm") -> T:
+        """
+        Выполнить `func` с повторами.
+
+        :param func: фабрика корутины, вызывается на каждую попытку.
+        :param name: имя для логов и метрик.
+        """
+        deadline = time.monotonic() + self._deadline_sec
+        remaining = get_remaining()
+        if remaining is not None:
+            deadline = min(deadline, time.monotonic() + remaining)
+        attempt = 0
+        while True:
+            try:
+                return await func()
+            except Exception as e:
+                attempt += 1
+                if not is_retryable(e) or attempt >= self._max_attempts:
+                    raise
+                delay = self.get_delay(attempt - 1, e)
+                if time.monotonic() + delay >= deadline:
+                    logger.warning(f"{name}: no time left for retry after {e!r}")
+                    raise
+                status = getattr(e, "status_code", type(e).__name__)
+                metrics.inc("llm_retries_total", source=name, status=status)
+                logger.warning(f"{name}: attempt {attempt} failed with {e!r}, retry in {delay:.1f}s")
+                await asyncio.sleep(delay)
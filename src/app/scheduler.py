@@ -0,0 +1,128 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+
+from src.config import settings
+from src.tools.log import get_logger
+from src.tools.metrics import metrics
+
+logger = get_logger(__name__)
+
+LANE = "llm"
+"""Метка очереди запросов к ллм в метриках `lane_queue_depth`/`lane_wait_seconds`."""
+
+
+class FairScheduler:
+    """
+    Очередь запросов к ллм со справедливым разделением между чатами и пользователями.
+
+    Одновременно выполняется не больше `max_concurrent` запросов. Остальные ждут в порядке
+    start-time fair queuing: у каждого чата и пользователя есть виртуальное время окончания
+    его прошлых запросов, новый запрос получает метку `max(V, чат, пользователь)` и выполняется
+    в порядке меток. Поэтому занятая группа не может занять всю очередь: запрос из тихого чата
+    встаёт в начало, а не за всеми запросами группы.
+
+    :param max_concurrent: сколько запросов к ллм выполняется одновременно.
+    :param chat_weights: вес чата, чат с весом 2 получает вдвое больше запросов при конкуренции.
+    """
+
+    PRUNE_SIZE = 10_000
+
+    def __init__(self, max_concurrent: int, chat_weights: dict[int, float] | None = None):
+        self._max_concurrent = max_concurrent
+        self._chat_weights = chat_weights or {}
+        self._running = 0
+        self._waiting = 0
+        self._heap: list[tuple[float, int, asyncio.Future]] = []
+        self._seq = itertools.count()
+        self._virtual_time = 0.0
+        self._finish: dict[tuple[str, int], float] = {}  # {("chat"|"user", id): виртуальное время окончания}
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def waiting(self) -> int:
+        return self._waiting
+
+    @asynccontextmanager
+    async def slot(self, chat_id: int, user_id: int, cost: float = 1) -> AsyncIterator[None]:
+        """
+        Занять место для запроса к ллм на время блока.
+
+        :param cost: стоимость запроса в условных единицах, по умолчанию один запрос.
+        """
+        await self._acquire(chat_id, user_id, cost)
+        try:
+            yield
+        finally:
+            self._release()
+
+    def _tag(self, chat_id: int, user_id: int, cost: float) -> float:
+        chat_key, user_key = ("chat", chat_id), ("user", user_id)
+        start = max(self._virtual_time, self._finish.get(chat_key, 0), self._finish.get(user_key, 0))
+        self._finish[chat_key] = start + cost / self._chat_weights.get(chat_id, 1)
+        self._finish[user_key] = start + cost
+        if len(self._finish) > self.PRUNE_SIZE:
+            self._finish = {k: v for k, v in self._finish.items() if v > self._virtual_time}
+        return start
+
+    async def _acquire(self, chat_id: int, user_id: int, cost: float) -> None:
+        start = self._tag(chat_id, user_id, cost)
+        # Пока есть живые ожидающие, все места заняты: освободившееся место `_release` сразу отдаёт
+        # следующему. Поэтому свободное место можно занять, даже если `_waiting` ещё учитывает
+        # отменённое ожидание, чья задача не успела выйти из `await future`.
+        if self._running < self._max_concurrent:
+            if self._heap:
+                self._heap = [entry for entry in self._heap if not entry[2].done()]
+                heapq.heapify(self._heap)
+            self._running += 1
+            self._virtual_time = max(self._virtual_time, start)
+            metrics.observe("lane_wait_seconds", 0, lane=LANE)
+            self._export()
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._heap, (start, next(self._seq), future))
+        self._waiting += 1
+        self._export()
+        ts = time.monotonic()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                self._release()  # место уже отдано этому запросу
+            else:
+                future.cancel()
+            raise
+        finally:
+            self._waiting -= 1
+            self._export()
+        metrics.observe("lane_wait_seconds", time.monotonic() - ts, lane=LANE)
+
+    def _release(self) -> None:
+        while self._heap:
+            start, _, future = heapq.heappop(self._heap)
+            if future.done():
+                continue  # ожидание отменено
+            self._virtual_time = max(self._virtual_time, start)
+            future.set_result(None)
+            self._export()
+            return
+        self._running -= 1
+        if self._running == 0:
+            self._virtual_time = 0.0
+            self._finish.clear()
+        self._export()
+
+    def _export(self) -> None:
+        metrics.set("lane_queue_depth", self.waiting, lane=LANE)
+        metrics.set("lane_running", self._running, lane=LANE)
+
+
+llm_scheduler = FairScheduler(settings.llm_max_concurrent, settings.llm_scheduler_chat_weights)
+"""Очередь запросов к ллм."""
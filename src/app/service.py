@@ -1,23 +1,54 @@
 import asyncio
+import time
 import traceback
+from collections import defaultdict
+from contextlib import suppress
 from datetime import datetime, UTC, timedelta
 
-from telegram import Bot, InlineKeyboardMarkup, Update
+from telegram import (
+    Bot,
+    InlineKeyboardMarkup,
+    InlineKeyboardButton,
+    InlineQueryResultArticle,
+    InputTextMessageContent,
+    MessageEntity,
+    Update,
+)
+from telegram.constants import ParseMode
 
+from src.app.budget import BudgetManager, BudgetExceeded
 from src.app.chat_manager import ChatManager
+from src.app.circuit_breaker import CircuitOpenError
 from src.app.database import MongoManager
+from src.app.generation_stats import generation_stats
+from src.app.inflight import inflight_generations, GenerationCancelled, CancelReason
+from src.app.llm_failover import FailoverLlmProvider
 from src.app.llm_provider import get_llm_provider, BaseLlmProvider
 from src.app.message_repo import MessageRepository
+from src.app.model_catalog import ModelCatalogStore
+from src.app.rate_limiter import RateLimitExceeded
+from src.app.scheduler import llm_scheduler
+from src.app.response_cache import ResponseCache
 from src.config import settings
-from src.models import MessageModel, LlmProviderSendResponse
+from src.models import MessageModel, LlmProviderSendResponse, AvailableModel, Settings, Comparison, CompareAnswer
 from src.tools.chat_state import get_state_key, state, ChatState
+from src.tools.deadline import deadline_scope, DeadlineExceeded
 from src.tools.log import get_logger
-from src.tools.message_queue import messages_queue, get_queue_key
-from src.tools.pagination import build_list_keyboard, PageItem
+from src.tools.message_queue import messages_queue, get_queue_key, send_reply_as_md
+from src.tools.pagination import build_list_keyboard, PageItem, KeyboardCache, clamp_page
 from src.tools.update_getters import UpdateInfo
+from src.tools.update_processor import release_topic_turn, topic_turn_paused
 
 logger = get_logger(__name__)
 
+COMPARE_MIN_MODELS = 2
+COMPARE_MAX_MODELS = 5
+KEYBOARD_PER_PAGE = 8
+INLINE_RESULTS_LIMIT = 20
+COMPARE_TTL_SEC = 30 * 60
+"""Сколько секунд можно выбрать лучший ответ сравнения."""
+COMPARE_MAX_PENDING = 1000
+
 
 class MessageProcessingFacade:
     def __init__(
@@ -25,10 +56,17 @@ class MessageProcessingFacade:
         llm_provider: BaseLlmProvider,
         chat_manager: ChatManager,
         message_repo: MessageRepository,
+        response_cache: ResponseCache,
+        budget: BudgetManager,
     ):
         self.llm_provider: BaseLlmProvider = llm_provider
         self.chat_manager: ChatManager = chat_manager
         self.message_repo: MessageRepository = message_repo
+        self.response_cache: ResponseCache = response_cache
+        self.budget: BudgetManager = budget
+        self._compare_models: dict[str, list[str]] = {}  # {state_key: [model_id, ...]}
+        self._comparisons: dict[str, Comparison] = {}  # {state_key: сравнение, ждущее выбора}
+        self._keyboards: KeyboardCache = KeyboardCache()  # страницы клавиатур текущего каталога моделей
 
     async def new_text_message(self, update_info: UpdateInfo, update: Update) -> str | None:
         state_key = get_state_key(update_info.chat_id, update_info.topic_id)
@@ -38,15 +76,31 @@ class MessageProcessingFacade:
             reply_text = await self.temperature_command(update_info)
             return reply_text
 
-        messages_queue[queue_key].append((update_info.msg_text, datetime.now(UTC)))
-        if len(messages_queue[queue_key]) == 1:
+        if messages_queue.add(queue_key, update_info.user_id, update_info.msg_text):
             if state.get(state_key) == ChatState.PROMPT:
                 reply_text = await self.delay_prompt(update_info)
                 return reply_text
+            elif state.get(state_key) == ChatState.COMPARE:
+                await self.delay_compare(update_info, update)
+                return None
             else:
-                msg = await update.message.reply_text("Пишет...")
-                reply_text = await self.delay_send(update_info)
-                await msg.delete()
+                stop_button = InlineKeyboardButton(
+                    "⏹ Остановить", callback_data=f"stop_generation+{update_info.user_id}"
+                )
+                try:
+                    async with deadline_scope("telegram"):
+                        msg = await update.message.reply_text(
+                            "Пишет...", reply_markup=InlineKeyboardMarkup([[stop_button]])
+                        )
+                except BaseException:
+                    # пачку больше никто не заберёт, без этого следующие сообщения топика попали бы в неё
+                    messages_queue.discard(queue_key)
+                    raise
+                try:
+                    reply_text = await self.delay_send(update_info)
+                finally:
+                    with suppress(Exception):
+                        await msg.delete()
                 return reply_text
         return None
 
@@ -57,8 +111,31 @@ class MessageProcessingFacade:
         chat_id: int,
         topic_id: int,
         cache: bool = None,
-    ) -> str:
-        llm_resp = await self._send_message(message_text, user_id, chat_id, topic_id, cache)
+    ) -> str | None:
+        """
+        :return: текст ответа ллм или сообщение об ошибке, None - генерация перезапущена новым сообщением.
+        """
+        try:
+            llm_resp = await self._send_message(message_text, user_id, chat_id, topic_id, cache)
+        except GenerationCancelled as e:
+            if e.reason == CancelReason.SUPERSEDED:
+                return None
+            return "Генерация остановлена."
+        except CircuitOpenError as e:
+            logger.warning(f"llm request rejected: {e}")
+            return (
+                "Модель сейчас недоступна, попробуйте через пару минут "
+                "или выберите другую модель: /models"
+            )
+        except RateLimitExceeded as e:
+            logger.warning(f"llm request rejected: {e}")
+            return "Слишком много запросов к модели, попробуйте через минуту."
+        except BudgetExceeded as e:
+            logger.warning(f"llm request rejected: {e}")
+            return (
+                f"Недостаточно токенов: на балансе {e.balance}, для запроса нужно около {e.required}. "
+                f"Обратитесь к администратору."
+            )
         llm_resp_text = self._get_llm_resp_str(llm_resp)
         return llm_resp_text
 
@@ -74,7 +151,9 @@ class MessageProcessingFacade:
             topic_id = 1
         topic_info = await self.chat_manager.get_or_create_topic_info(chat_id, topic_id)
         topic_settings = topic_info.settings
-        context = await self.chat_manager.get_context(chat_id, topic_id, topic_settings.offset)
+        context_records = await self.chat_manager.get_context_records(chat_id, topic_id, topic_settings.offset)
+        context = [mes.message_param for mes in context_records]
+        context_tokens = self.chat_manager.get_context_tokens(context_records)
         user_message = MessageModel(
             content=message_text,
             role="user",
@@ -82,21 +161,106 @@ class MessageProcessingFacade:
         messages = context + [user_message]
 
         u_dt = datetime.now(UTC)
-        response = await self.llm_provider.send_messages(
-            model=topic_settings.model,
-            messages=messages,
+        cache_key = None
+        response = None
+        if topic_settings.temperature == 0 or topic_settings.cache_responses:
+            cache_key = self.response_cache.get_key(
+                model=topic_settings.model,
+                system_prompt=topic_settings.system_prompt,
+                temperature=topic_settings.temperature,
+                messages=messages,
+            )
+            response = await self.response_cache.get(cache_key)
+        if response is None:
+            input_tokens = context_tokens + await self.llm_provider.estimate_tokens(topic_settings.model, [user_message])
+            response = await inflight_generations.run(
+                (chat_id, topic_id, user_id),
+                message_text,
+                self._request_llm(topic_settings.model, messages, chat_id, user_id, topic_settings, input_tokens, cache),
+            )
+            if cache_key is not None:
+                await self.response_cache.set(cache_key, response)
+
+        a_dt = datetime.now(UTC)
+        await self._save_turn(
+            chat_id=chat_id,
+            topic_id=topic_id,
             user_id=user_id,
-            system_prompt=topic_settings.system_prompt,
-            temp=topic_settings.temperature,
-            cache=cache,
+            model=topic_settings.model,
+            user_message=user_message,
+            response=response,
+            context_n=len(context),
+            context_tokens=context_tokens,
+            u_dt=u_dt,
+            a_dt=a_dt,
         )
+        return response
 
-        a_dt = datetime.now(UTC)
-        input_sing_tokens_count = await self.llm_provider.count_tokens(topic_settings.model, messages)
+    async def _request_llm(
+        self,
+        model: str,
+        messages: list[MessageModel],
+        chat_id: int,
+        user_id: int,
+        topic_settings: Settings,
+        input_tokens: int,
+        cache: bool = None,
+    ) -> LlmProviderSendResponse:
+        """
+        Запрос к ллм с учётом баланса пользователя, очереди `llm_scheduler` и дедлайна апдейта.
+
+        :param input_tokens: оценка входных токенов (контекст + новое сообщение).
+        :raises BudgetExceeded: если баланса не хватает.
+        """
+        release_topic_turn()  # генерация долгая, следующие апдейты топика её не ждут
+        available_model = self._get_available_model(model)
+        reservation = await self.budget.reserve(user_id, available_model, input_tokens)
+        try:
+            async with deadline_scope("llm"), llm_scheduler.slot(chat_id, user_id):
+                response = await self.llm_provider.send_messages(
+                    model=model,
+                    messages=messages,
+                    user_id=user_id,
+                    system_prompt=topic_settings.system_prompt,
+                    temp=topic_settings.temperature,
+                    cache=cache,
+                    input_tokens=input_tokens,
+                )
+        except BaseException:
+            self.budget.settle(reservation, available_model, None)
+            raise
+        self.budget.settle(reservation, available_model, response.usage)
+        return response
+
+    async def _save_turn(
+        self,
+        chat_id: int,
+        topic_id: int,
+        user_id: int,
+        model: str,
+        user_message: MessageModel,
+        response: LlmProviderSendResponse,
+        context_n: int,
+        context_tokens: int,
+        u_dt: datetime,
+        a_dt: datetime,
+    ) -> None:
+        """
+        Сохранить сообщение пользователя и ответ ллм в контекст топика.
+        Незавершённое сравнение топика после этого устаревает: его ответ оказался бы не на своём месте.
+        """
+        self._comparisons.pop(get_state_key(chat_id, topic_id), None)
         llm_message = MessageModel(
             content=response.model_response.parts[0].content,
             role="assistant",
         )
+        user_tokens, llm_tokens = await self._get_messages_tokens(
+            model=model,
+            response=response,
+            context_tokens=context_tokens,
+            user_message=user_message,
+            llm_message=llm_message,
+        )
 
         await self.message_repo.add_message_to_db(  # llm
             chat_id=chat_id,
@@ -105,22 +269,76 @@ class MessageProcessingFacade:
             message=llm_message,
             context_n=0,
             model=response.model_response.model_name,
-            tokens_message=0,
-            tokens_from_prov=response.usage.response_tokens,
+            tokens_message=llm_tokens,
+            tokens_from_prov=0 if response.cached else response.usage.response_tokens or 0,
             timestamp=a_dt,
+            cached=response.cached,
+            generation_id=response.generation_id,
         )
+        if response.generation_id:
+            generation_stats.bind(response.generation_id, chat_id, topic_id, user_id)
         await self.message_repo.add_message_to_db(  # user
             chat_id=chat_id,
             topic_id=topic_id,
             user_id=user_id,
             message=user_message,
-            context_n=len(context),
+            context_n=context_n,
             model=response.model_response.model_name,
-            tokens_message=input_sing_tokens_count,
-            tokens_from_prov=response.usage.request_tokens,
+            tokens_message=user_tokens,
+            tokens_from_prov=0 if response.cached else response.usage.request_tokens or 0,
             timestamp=u_dt,
+            cached=response.cached,
         )
-        return response
+
+    async def _get_messages_tokens(
+        self,
+        model: str,
+        response: LlmProviderSendResponse,
+        context_tokens: int,
+        user_message: MessageModel,
+        llm_message: MessageModel,
+    ) -> tuple[int, int]:
+        """
+        Считает токены нового сообщения пользователя и ответа ллм по usage от провайдера.
+
+        Токены сообщения пользователя - разница между `request_tokens` и суммой токенов контекста,
+        поэтому в первое сообщение контекста попадает и системный промпт.
+        Сумма токенов контекста после ответа равна `request_tokens + response_tokens` последнего запроса.
+        Если usage нет или разница не положительная, используется локальная оценка.
+
+        :return: (токены сообщения пользователя, токены ответа ллм)
+        """
+        request_tokens = response.usage.request_tokens
+        response_tokens = response.usage.response_tokens
+        if request_tokens and request_tokens > context_tokens:
+            user_tokens = request_tokens - context_tokens
+        else:
+            user_tokens = await self.llm_provider.estimate_tokens(model, [user_message])
+        if response_tokens:
+            llm_tokens = response_tokens
+        else:
+            llm_tokens = await self.llm_provider.estimate_tokens(model, [llm_message])
+        return user_tokens, llm_tokens
+
+    async def collect_generation_stats(self) -> None:
+        """
+        Получить пачку статистики генераций OpenRouter и записать стоимость в сообщения и пользователей.
+        """
+        collected = await generation_stats.run_batch()
+        by_topic = defaultdict(list)
+        by_user = defaultdict(lambda: [0.0, 0.0])
+        for pending, info in collected:
+            by_topic[(pending.chat_id, pending.topic_id)].append((pending.gen_id, info))
+            by_user[pending.user_id][0] += info.total_cost
+            by_user[pending.user_id][1] += info.cache_discount or 0
+        for (chat_id, topic_id), stats in by_topic.items():
+            await self.message_repo.set_generation_stats(chat_id, topic_id, stats)
+        for user_id, (total_cost, cache_discount) in by_user.items():
+            await self.chat_manager.add_user_costs(user_id, total_cost, cache_discount)
+
+    def _get_available_model(self, model_id: str) -> AvailableModel | None:
+        """Модель из уже загруженного каталога провайдера, без запроса к провайдеру."""
+        return self.llm_provider.catalog.get_by_id(model_id)
 
     @staticmethod
     def _get_llm_resp_str(llm_resp: LlmProviderSendResponse) -> str:
@@ -135,28 +353,25 @@ class MessageProcessingFacade:
     ) -> str:
         topic_settings = await self.chat_manager.get_topic_settings(chat_id, topic_id)
 
-        messages_records = await self.message_repo.get_messages_from_db(chat_id, topic_id, offset=topic_settings.offset)
-        messages = await self.chat_manager.get_context(chat_id, topic_id, topic_settings.offset)
+        messages_records = await self.chat_manager.get_context_records(chat_id, topic_id, topic_settings.offset)
         model = topic_settings.model
         prompt = self.chat_manager.format_system_prompt(topic_settings.system_prompt, short=True)
         temperature = topic_settings.temperature
-        context_len = len(messages)
-        try:
-            context_tokens = await self.llm_provider.count_tokens(topic_settings.model, messages)
-        except Exception:
-            context_tokens = "<error>"
-            logger.error(f"context was broken. {user_id=} {chat_id=} {topic_id=} {topic_settings.offset=}")
+        context_len = len(messages_records)
+        context_tokens = self.chat_manager.get_context_tokens(messages_records)
         allowed_topics = await self.chat_manager.get_allowed_topics(chat_id, user_id)
+        cache_responses = "Да" if topic_settings.cache_responses else "Нет"
+        supersede = "Да" if topic_settings.supersede else "Нет"
         tokens_total_input = sum(
             [
-                mes.tokens_message + mes.tokens_from_prov
+                mes.tokens_from_prov
                 for mes in messages_records
                 if mes.message_param.role == "user"
             ]
         )
         tokens_total_output = sum(
             [
-                mes.tokens_message + mes.tokens_from_prov
+                mes.tokens_from_prov
                 for mes in messages_records
                 if mes.message_param.role == "assistant"
             ]
@@ -171,6 +386,8 @@ class MessageProcessingFacade:
             f"Модель: `{model}`\n"
             f'Промпт: {prompt}\n'
             f"Температура (от 0 до 1): {temperature}\n"
+            f"Кэш ответов: {cache_responses}\n"
+            f"Перезапуск генерации: {supersede}\n"
             f"Контекст:\n"
             f"    сообщений: {context_len}\n"
             f"    токенов: {context_tokens}\n"
@@ -190,6 +407,7 @@ class MessageProcessingFacade:
             "Дата рег: {reg_date}\n"
             "Токены: {tokens}\n"
             "Токенов всего: {tokens_used}\n"
+            "Расходы: ${total_cost:.4f}\n"
             "Чаты: {chats}\n"
         )
         infos = [
@@ -197,8 +415,9 @@ class MessageProcessingFacade:
                 username=user.username,
                 user_id=user.user_id,
                 reg_date=user.dt_created,
-                tokens=user.tokens_balance,
+                tokens=await self.budget.get_balance(user.user_id),
                 tokens_used=await self.chat_manager.get_tokens_used(user.user_id),
+                total_cost=user.total_cost,
                 chats=await self.chat_manager.get_user_chat_titles(user.user_id, bot),
             ) for user in users
         ]
@@ -209,7 +428,7 @@ class MessageProcessingFacade:
         user_info = await self.chat_manager.get_user_info(user_id)
         chats_names = await self.chat_manager.get_user_chat_titles(user_id, bot)
         chats = ", ".join(map(str, chats_names))
-        tokens = user_info.tokens_balance
+        tokens = await self.budget.get_balance(user_id)
         username = user_info.username
         reg_date = user_info.dt_created
         message = (
@@ -219,10 +438,46 @@ class MessageProcessingFacade:
             f"ID пользователя: {user_id}\n"
             f"Дата рег: {reg_date}\n"
             f"Токены: {tokens}\n"
+            f"Расходы: ${user_info.total_cost:.4f} (скидка кэша: ${user_info.cache_discount:.4f})\n"
             f"Чаты: {chats}\n"
         )
         return message
 
+    async def grant_tokens(self, args: list[str]) -> str:
+        """
+        Начислить токены пользователю. Для администраторов.
+
+        :param args: аргументы команды: id пользователя и количество токенов (может быть отрицательным).
+        """
+        try:
+            user_id, amount = int(args[0]), int(args[1])
+        except (IndexError, ValueError):
+            return "Использование: /admin_grant <id пользователя> <токены>"
+        if await self.chat_manager.find_user_info(user_id) is None:
+            return f"Пользователь {user_id} не найден."
+        balance = await self.budget.grant(user_id, amount)
+        return f"Пользователю {user_id} начислено {amount} токенов. Баланс: {balance}"
+
+    async def get_budget_message(self, args: list[str]) -> str:
+        """
+        Баланс пользователя. Для администраторов.
+
+        :param args: аргументы команды: id пользователя.
+        """
+        try:
+            user_id = int(args[0])
+        except (IndexError, ValueError):
+            return "Использование: /admin_budget <id пользователя>"
+        user_info = await self.chat_manager.find_user_info(user_id)
+        if user_info is None:
+            return f"Пользователь {user_id} не найден."
+        balance = await self.budget.get_balance(user_id)
+        return (
+            f"Пользователь: {user_info.username or user_info.full_name} ({user_id})\n"
+            f"Баланс: {balance} токенов\n"
+            f"Расходы: ${user_info.total_cost:.4f}\n"
+        )
+
     async def new_private_chat(self, user_id: int, username: str | None, full_name: str) -> None:
         await self.chat_manager.get_or_create_user(user_id, username, full_name)
 
@@ -262,17 +517,21 @@ class MessageProcessingFacade:
         :param page: страница пагинации.
         :return: клавиатура InlineKeyboardMarkup.
         """
-        providers = await self.llm_provider.get_providers_models()
-        providers_page_items = [PageItem(cb_data=p, display_name=f"{p}"[:63]) for p in providers.keys()]
-        reply_markup = build_list_keyboard(
-            items=providers_page_items,
-            page=page,
-            # per_page=98,
-            per_page=8,
-            item_cb_prefix="provider",
-            page_cb_prefix="providers",
+        catalog = await self.llm_provider.get_catalog()
+        providers = tuple(catalog.providers.keys())
+        page = clamp_page(page, len(providers), KEYBOARD_PER_PAGE)
+        return self._keyboards.get_or_build(
+            catalog,
+            ("providers", None, page),
+            lambda: build_list_keyboard(
+                items=providers,
+                page=page,
+                per_page=KEYBOARD_PER_PAGE,
+                item_cb_prefix="provider",
+                page_cb_prefix="providers",
+                to_page_item=lambda p: PageItem(cb_data=p, display_name=f"{p}"[:63]),
+            ),
         )
-        return reply_markup
 
     async def get_provider_models_keyboard(self, provider: str, page: int = 0) -> InlineKeyboardMarkup:
         """
@@ -282,21 +541,24 @@ class MessageProcessingFacade:
         :param page: страница пагинации.
         :return: клавиатура InlineKeyboardMarkup.
         """
-        providers = await self.llm_provider.get_providers_models()
-        providers_page_items = [
-            PageItem(cb_data=p.id_hash, display_name=f"{p.name} | {p.id}"[:63])
-            for p in providers[provider]
-        ]
-        reply_markup = build_list_keyboard(
-            items=providers_page_items,
-            page=page,
-            # per_page=98,
-            per_page=8,
-            item_cb_prefix="change_model",
-            page_cb_prefix=f"provider+{provider}",
-            back_button_cb="providers+0"
-        )
-        return reply_markup
+        catalog = await self.llm_provider.get_catalog()
+        models = catalog.providers.get(provider, ())
+        page = clamp_page(page, len(models), KEYBOARD_PER_PAGE)
+
+        def build() -> InlineKeyboardMarkup:
+            return build_list_keyboard(
+                items=models,
+                page=page,
+                per_page=KEYBOARD_PER_PAGE,
+                item_cb_prefix="change_model",
+                page_cb_prefix=f"provider+{provider}",
+                back_button_cb="providers+0",
+                to_page_item=lambda m: PageItem(cb_data=m.id_hash, display_name=f"{m.name} | {m.id}"[:63]),
+            )
+
+        if not models:
+            return build()  # неизвестный провайдер из старой кнопки, не кэшируем
+        return self._keyboards.get_or_build(catalog, ("provider", provider, page), build)
 
     async def get_models_keyboard(self, page: int = 0) -> InlineKeyboardMarkup:
         """
@@ -305,25 +567,284 @@ class MessageProcessingFacade:
         :param page: страница пагинации.
         :return: клавиатура InlineKeyboardMarkup.
         """
-        models = await self.llm_provider.get_models()
-        models_page_items = [PageItem(cb_data=m.id_hash, display_name=f"{m.name} | {m.id}"[:62]) for m in models]
-        models.sort(key=lambda x: x.created, reverse=True)
-
-        reply_markup = build_list_keyboard(
-            items=models_page_items,
-            page=page,
-            # per_page=98,
-            per_page=8,
-            item_cb_prefix="change_model",
-            page_cb_prefix="models",
+        catalog = await self.llm_provider.get_catalog()
+        page = clamp_page(page, len(catalog), KEYBOARD_PER_PAGE)
+        return self._keyboards.get_or_build(
+            catalog,
+            ("models", None, page),
+            lambda: build_list_keyboard(
+                items=catalog.models,
+                page=page,
+                per_page=KEYBOARD_PER_PAGE,
+                item_cb_prefix="change_model",
+                page_cb_prefix="models",
+                to_page_item=lambda m: PageItem(cb_data=m.id_hash, display_name=f"{m.name} | {m.id}"[:62]),
+            ),
         )
-        return reply_markup
 
     async def change_model(self, update_info: UpdateInfo, model_hash: str) -> str:
         model_name = await self.llm_provider.get_model_id_by_hash(model_hash)
         await self.chat_manager.change_model(update_info.chat_id, update_info.topic_id, model_name)
         return model_name
 
+    async def get_inline_model_results(self, query: str) -> list[InlineQueryResultArticle]:
+        """
+        Результаты инлайн поиска модели (`@bot gpt-4`).
+
+        Выбор результата отправляет в чат `/model <id>`, который меняет модель чата/топика.
+
+        :param query: текст инлайн запроса.
+        """
+        catalog = await self.llm_provider.get_catalog()
+        models = catalog.search_index.search(query, limit=INLINE_RESULTS_LIMIT)
+        return [
+            InlineQueryResultArticle(
+                id=m.id_hash,
+                title=m.name,
+                description=m.id,
+                input_message_content=InputTextMessageContent(
+                    f"/model {m.id}",
+                    entities=[MessageEntity(MessageEntity.BOT_COMMAND, offset=0, length=len("/model"))],
+                ),
+            )
+            for m in models
+        ]
+
+    async def set_model_command(self, update_info: UpdateInfo, args: list[str]) -> str:
+        """
+        Команда смены модели по id: `/model <id>`.
+
+        :param args: id модели.
+        """
+        if not args:
+            return "Укажите id модели, например `/model openai/gpt-4.1-mini`, или найдите её через `@бот <название>`."
+        catalog = await self.llm_provider.get_catalog()
+        model = catalog.get_by_id(args[0])
+        if model is None:
+            similar = catalog.search_index.search(args[0], limit=3)
+            reply_text = f"Неизвестная модель: `{args[0]}`"
+            if similar:
+                reply_text += f"\nВозможно, вы имели в виду: {', '.join(f'`{m.id}`' for m in similar)}"
+            return reply_text
+        await self.chat_manager.change_model(update_info.chat_id, update_info.topic_id, model.id)
+        return f"Выбрана модель: `{model.id}`"
+
+    async def cache_command(self, update_info: UpdateInfo) -> str:
+        topic_settings = await self.chat_manager.get_topic_settings(update_info.chat_id, update_info.topic_id)
+        enabled = not topic_settings.cache_responses
+        await self.chat_manager.set_cache_responses(enabled, update_info.chat_id, update_info.topic_id)
+        if enabled:
+            return "Кэш ответов включён. Одинаковые запросы будут получать сохранённый ответ."
+        return "Кэш ответов выключен. Кэш используется только при температуре 0."
+
+    async def compare_command(self, update_info: UpdateInfo, args: list[str]) -> str:
+        """
+        Команда сравнения моделей: следующее сообщение будет отправлено во все заданные модели одновременно.
+
+        :param args: id моделей, от `COMPARE_MIN_MODELS` до `COMPARE_MAX_MODELS`.
+        """
+        models = list(dict.fromkeys(args))
+        if not COMPARE_MIN_MODELS <= len(models) <= COMPARE_MAX_MODELS:
+            return (
+                f"Укажите от {COMPARE_MIN_MODELS} до {COMPARE_MAX_MODELS} разных моделей через пробел, например:\n"
+                f"`/compare openai/gpt-4.1-mini anthropic/claude-3.5-haiku`"
+            )
+        catalog = await self.llm_provider.get_catalog()
+        unknown_models = [model for model in models if catalog.get_by_id(model) is None]
+        if unknown_models:
+            return f"Неизвестные модели: {', '.join(f'`{m}`' for m in unknown_models)}"
+
+        state_key = get_state_key(update_info.chat_id, update_info.topic_id)
+        self._compare_models[state_key] = models
+        state[state_key] = ChatState.COMPARE
+        return (
+            f"Отправьте сообщение, оно будет отправлено в модели: {', '.join(f'`{m}`' for m in models)}.\n"
+            f"/cancel для отмены."
+        )
+
+    async def compare(
+        self,
+        models: list[str],
+        message_text: str,
+        user_id: int,
+        chat_id: int,
+        topic_id: int,
+    ) -> Comparison:
+        """
+        Отправить контекст и сообщение во все модели одновременно.
+        Время ответа - время самой медленной модели. Ошибка одной модели не прерывает остальные.
+        """
+        topic_settings = await self.chat_manager.get_topic_settings(chat_id, topic_id)
+        context_records = await self.chat_manager.get_context_records(chat_id, topic_id, topic_settings.offset)
+        context = [mes.message_param for mes in context_records]
+        context_tokens = self.chat_manager.get_context_tokens(context_records)
+        user_message = MessageModel(content=message_text, role="user")
+        u_dt = datetime.now(UTC)
+
+        answers = await asyncio.gather(*(
+            self._compare_one(
+                model, context + [user_message], chat_id, user_id, topic_settings, context_tokens, user_message
+            )
+            for model in models
+        ))
+        return Comparison(
+            user_message=user_message,
+            context_n=len(context),
+            context_tokens=context_tokens,
+            timestamp=u_dt,
+            answered_at=datetime.now(UTC),
+            answers=list(answers),
+        )
+
+    async def _compare_one(
+        self,
+        model: str,
+        messages: list[MessageModel],
+        chat_id: int,
+        user_id: int,
+        topic_settings: Settings,
+        context_tokens: int,
+        user_message: MessageModel,
+    ) -> CompareAnswer:
+        ts = time.monotonic()
+        try:
+            input_tokens = context_tokens + await self.llm_provider.estimate_tokens(model, [user_message])
+            response = await self._request_llm(model, messages, chat_id, user_id, topic_settings, input_tokens)
+        except DeadlineExceeded:
+            raise
+        except Exception as e:
+            logger.warning(f"compare: {model} failed: {e!r}")
+            return CompareAnswer(model=model, latency_sec=time.monotonic() - ts, error=str(e) or type(e).__name__)
+        available_model = self._get_available_model(model)
+        cost = None
+        if available_model is not None and available_model.pricing is not None:
+            cost = (
+                (response.usage.request_tokens or 0) * available_model.pricing.prompt
+                + (response.usage.response_tokens or 0) * available_model.pricing.completion
+            )
+        return CompareAnswer(model=model, latency_sec=time.monotonic() - ts, response=response, cost=cost)
+
+    async def delay_compare(self, update_info: UpdateInfo, update: Update) -> None:
+        """
+        Отложенное сравнение моделей, см. `delay_send`. Отправляет ответы всех моделей
+        и клавиатуру выбора лучшего ответа.
+        """
+        queue_key = get_queue_key(update_info.user_id, update_info.topic_id)
+        state_key = get_state_key(update_info.chat_id, update_info.topic_id)
+
+        messages = await self.wait_messages(queue_key)
+        message = "\n".join(messages)
+        models = self._compare_models.pop(state_key, [])
+        state.pop(state_key, None)
+
+        comparison = await self.compare(models, message, update_info.user_id, update_info.chat_id, update_info.topic_id)
+        self._add_comparison(state_key, comparison)
+        for i, answer in enumerate(comparison.answers, start=1):
+            await send_reply_as_md(update, self._format_compare_answer(i, answer), parse_mode=ParseMode.MARKDOWN_V2)
+
+        buttons = [
+            [InlineKeyboardButton(f"{i}. {answer.model}"[:62], callback_data=f"compare_pick+{i - 1}")]
+            for i, answer in enumerate(comparison.answers, start=1)
+            if answer.response is not None
+        ]
+        slowest = max(answer.latency_sec for answer in comparison.answers)
+        async with deadline_scope("telegram"):
+            if buttons:
+                await update.message.reply_text(
+                    f"Готово за {slowest:.1f} с. Выберите лучший ответ: модель станет моделью чата, "
+                    f"а ответ попадёт в контекст.",
+                    reply_markup=InlineKeyboardMarkup(buttons),
+                )
+            else:
+                await update.message.reply_text("Ни одна модель не ответила.")
+
+    @staticmethod
+    def _format_compare_answer(i: int, answer: CompareAnswer) -> str:
+        header = f"**{i}. {answer.model}** · {answer.latency_sec:.1f} с"
+        if answer.response is None:
+            return f"{header}\n\nОшибка: {answer.error}"
+        usage = answer.response.usage
+        header += f" · токены: {usage.request_tokens or 0} → {usage.response_tokens or 0}"
+        if answer.cost is not None:
+            header += f" · ~${answer.cost:.6f}"
+        return f"{header}\n\n{answer.response.model_response.parts[0].content}"
+
+    @staticmethod
+    def _is_comparison_expired(comparison: Comparison) -> bool:
+        return datetime.now(UTC) - comparison.answered_at > timedelta(seconds=COMPARE_TTL_SEC)
+
+    def _add_comparison(self, state_key: str, comparison: Comparison) -> None:
+        self._comparisons.pop(state_key, None)
+        if len(self._comparisons) >= COMPARE_MAX_PENDING:
+            self._comparisons = {
+                key: pending for key, pending in self._comparisons.items() if not self._is_comparison_expired(pending)
+            }
+            while len(self._comparisons) >= COMPARE_MAX_PENDING:
+                del self._comparisons[next(iter(self._comparisons))]  # самое старое
+        self._comparisons[state_key] = comparison
+
+    def discard_compare(self, chat_id: int, topic_id: int) -> None:
+        """
+        Забыть ожидаемое и завершённое сравнение топика (/cancel, /clear, новое сообщение в контексте).
+        После этого выбор ответа старого сравнения отклоняется.
+        """
+        state_key = get_state_key(chat_id, topic_id)
+        self._compare_models.pop(state_key, None)
+        self._comparisons.pop(state_key, None)
+
+    async def pick_compare_winner(self, update_info: UpdateInfo, answer_idx: int) -> str:
+        """
+        Выбрать лучший ответ сравнения: модель становится моделью чата, ответ сохраняется в контекст.
+
+        :param answer_idx: номер ответа в `Comparison.answers`.
+        """
+        state_key = get_state_key(update_info.chat_id, update_info.topic_id)
+        comparison = self._comparisons.get(state_key)
+        if comparison is not None and self._is_comparison_expired(comparison):
+            del self._comparisons[state_key]
+            comparison = None
+        if comparison is None or not 0 <= answer_idx < len(comparison.answers):
+            return "Сравнение устарело, запустите /compare заново."
+        answer = comparison.answers[answer_idx]
+        if answer.response is None:
+            return "У этой модели нет ответа."
+        del self._comparisons[state_key]
+
+        await self.chat_manager.change_model(update_info.chat_id, update_info.topic_id, answer.model)
+        await self._save_turn(
+            chat_id=update_info.chat_id,
+            topic_id=update_info.topic_id,
+            user_id=update_info.user_id,
+            model=answer.model,
+            user_message=comparison.user_message,
+            response=answer.response,
+            context_n=comparison.context_n,
+            context_tokens=comparison.context_tokens,
+            u_dt=comparison.timestamp,
+            a_dt=comparison.answered_at,
+        )
+        return f"Выбрана модель: `{answer.model}`. Её ответ добавлен в контекст."
+
+    async def supersede_command(self, update_info: UpdateInfo) -> str:
+        topic_settings = await self.chat_manager.get_topic_settings(update_info.chat_id, update_info.topic_id)
+        enabled = not topic_settings.supersede
+        await self.chat_manager.set_supersede(enabled, update_info.chat_id, update_info.topic_id)
+        if enabled:
+            return (
+                "Перезапуск генерации включён. Новое сообщение, пока пишется ответ, "
+                "остановит генерацию и отправится вместе с предыдущим."
+            )
+        return "Перезапуск генерации выключен."
+
+    @staticmethod
+    def stop_generation(chat_id: int, topic_id: int, user_id: int) -> bool:
+        """
+        Остановить генерацию ответа пользователю. Ход не сохраняется в контекст.
+
+        :return: была ли генерация остановлена.
+        """
+        return inflight_generations.cancel((chat_id, topic_id, user_id), CancelReason.STOPPED) is not None
+
     async def prompt_command(self, update_info: UpdateInfo) -> str:
         state[get_state_key(update_info.chat_id, update_info.topic_id)] = ChatState.PROMPT
         topic_settings = await self.chat_manager.get_topic_settings(update_info.chat_id, update_info.topic_id)
@@ -369,6 +890,14 @@ class MessageProcessingFacade:
         messages = await self.wait_messages(queue_key)
         message = "\n".join(messages)
 
+        topic_settings = await self.chat_manager.get_topic_settings(update_info.chat_id, update_info.topic_id)
+        if topic_settings.supersede:
+            previous = inflight_generations.cancel(
+                (update_info.chat_id, update_info.topic_id, update_info.user_id), CancelReason.SUPERSEDED
+            )
+            if previous is not None:
+                message = f"{previous.text}\n{message}"
+
         llm_resp_text = await self.send_message(message, update_info.user_id, update_info.chat_id, update_info.topic_id)
         return llm_resp_text
 
@@ -394,28 +923,44 @@ class MessageProcessingFacade:
         return "Промпт установлен."
 
     @staticmethod
-    async def wait_messages(queue_key: str, delay_seconds: int = settings.wait_new_message_sec) -> list[str]:
+    async def wait_messages(queue_key: str) -> list[str]:
         """
-        Ожидание новых сообщений в очереди `delay_seconds` секунд.
+        Ожидание остальных частей сообщения, см `MessageCoalescer`. Не дольше `settings.wait_new_message_sec` секунд.
+        На время ожидания очередь топика отпускается, чтобы части могли в неё попасть.
 
         :param queue_key: Ключ для очереди сообщений топика, src.tools.message_queue.get_queue_key(user_id, topic_id)
-        :param delay_seconds: Сколько секунд ждать после последнего сообщения
         :return: Список текстов сообщений
         """
-        while datetime.now(UTC) - messages_queue[queue_key][-1][1] < timedelta(seconds=delay_seconds):
-            await asyncio.sleep(0.3)
-        messages = messages_queue[queue_key]
-        del messages_queue[queue_key]
-        return [mes[0] for mes in messages]
+        async with topic_turn_paused():
+            return await messages_queue.wait(queue_key)
 
 
 db_provider_instance = MongoManager(settings.mongo_url)
 chat_manager_instance = ChatManager(db_provider_instance)
 message_repo_instance = MessageRepository(db_provider_instance)
-llm_provider_instance = get_llm_provider(settings.llm_provider_type, settings.llm_api_key)
+llm_provider_instance = get_llm_provider(
+    settings.llm_provider_type,
+    settings.llm_api_key,
+    rate_limit=settings.llm_rate_limit,
+    model_rate_limits=settings.llm_model_rate_limits,
+)
+if settings.model_cache_persistent:
+    llm_provider_instance.catalog_store = ModelCatalogStore(db_provider_instance)
+if settings.llm_fallback_providers:
+    llm_provider_instance = FailoverLlmProvider(
+        [llm_provider_instance]
+        + [
+            get_llm_provider(conf.type, conf.api_key, conf.base_url, conf.rate_limit)
+            for conf in settings.llm_fallback_providers
+        ]
+    )
+response_cache_instance = ResponseCache(db_provider_instance if settings.response_cache_persistent else None)
+budget_instance = BudgetManager(db_provider_instance)
 
 message_processing_facade = MessageProcessingFacade(
     llm_provider=llm_provider_instance,
     message_repo=message_repo_instance,
     chat_manager=chat_manager_instance,
+    response_cache=response_cache_instance,
+    budget=budget_instance,
 )
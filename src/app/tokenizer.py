@@ -0,0 +1,96 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from math import ceil
+
+import tiktoken
+from tiktoken.model import encoding_name_for_model
+
+from src.config import settings
+from src.tools.log import get_logger
+
+logger = get_logger(__name__)
+
+
+class TokenizerService:
+    """
+    Подсчёт токенов локально через tiktoken.
+
+    Энкодеры загружаются один раз и кэшируются. Файлы словарей берутся из `TIKTOKEN_CACHE_DIR`,
+    в docker образе они скачиваются на этапе сборки, поэтому сеть в рантайме не нужна.
+    Большие пачки текстов кодируются в пуле потоков, чтобы не блокировать event loop.
+    """
+
+    DEFAULT_ENCODING = "cl100k_base"
+    TOKENIZER_ENCODINGS = {
+        "GPT": "o200k_base",
+    }
+    """Соответствие `AvailableModel.architecture.tokenizer` -> кодировка tiktoken.
+    Для моделей без открытого BPE (Claude, Gemini и т.д.) используется приближение `DEFAULT_ENCODING`."""
+
+    def __init__(
+        self,
+        encodings: list[str] = settings.tokenizer_encodings,
+        offload_min_chars: int = settings.tokenizer_offload_min_chars,
+        max_workers: int = settings.tokenizer_max_workers,
+    ):
+        self._preload_encodings = encodings
+        self._offload_min_chars = offload_min_chars
+        self._encoders: dict[str, tiktoken.Encoding | None] = {}
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="tokenizer")
+
+    def preload(self) -> None:
+        """Загрузить энкодеры при старте, чтобы первый запрос не ждал чтения словарей."""
+        for name in self._preload_encodings:
+            self.get_encoding(name)
+
+    def get_encoding(self, name: str) -> tiktoken.Encoding | None:
+        """
+        Энкодер по имени кодировки из кэша.
+
+        :return: Энкодер или None, если словарь недоступен (например, нет сети и нет локальной копии).
+        """
+        if name not in self._encoders:
+            try:
+                self._encoders[name] = tiktoken.get_encoding(name)
+            except Exception as e:
+                logger.warning(f"can't load tiktoken encoding {name}: {e}")
+                self._encoders[name] = None
+        return self._encoders[name]
+
+    def get_encoding_name(self, model: str, tokenizer: str | None = None) -> str:
+        """
+        Выбрать кодировку для модели.
+
+        :param model: id модели, например `openai/gpt-4.1-mini`.
+        :param tokenizer: `AvailableModel.architecture.tokenizer`, если известен.
+        """
+        if tokenizer == "GPT" or model.startswith("openai/"):
+            try:
+                return encoding_name_for_model(model.removeprefix("openai/"))
+            except KeyError:
+                pass
+        return self.TOKENIZER_ENCODINGS.get(tokenizer, self.DEFAULT_ENCODING)
+
+    async def count(self, texts: list[str], model: str, tokenizer: str | None = None) -> int:
+        """
+        Посчитать суммарное число токенов в текстах.
+
+        :param texts: список текстов.
+        :param model: id модели.
+        :param tokenizer: `AvailableModel.architecture.tokenizer`, если известен.
+        """
+        enc = self.get_encoding(self.get_encoding_name(model, tokenizer))
+        if enc is None:
+            return sum(ceil(len(text) / 4) for text in texts)
+        if sum(map(len, texts)) < self._offload_min_chars:
+            return self._count_sync(enc, texts)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, self._count_sync, enc, texts)
+
+    @staticmethod
+    def _count_sync(enc: tiktoken.Encoding, texts: list[str]) -> int:
+        # encode_ordinary: спец-токены вида <|endoftext|> в тексте пользователя не должны вызывать ошибку
+        return sum(len(enc.encode_ordinary(text)) for text in texts)
+
+
+tokenizer_service = TokenizerService()
@@ -1,3 +1,4 @@
+import asyncio
 from contextlib import suppress
 import random
 
@@ -10,19 +11,24 @@ from telegram.ext import (
     filters,
     CallbackQueryHandler,
     ChatMemberHandler,
+    InlineQueryHandler,
     Application,
 )
 
+from src.app.llm_router import llm_router
 from src.app.service import message_processing_facade as service
-from src.config import settings
+from src.config import settings, BotMode
 from src.filters import TopicFilter
 from src.models import PTBContext
 from src.tools.chat_state import get_state_key, state, ChatState
+from src.tools.deadline import DeadlineExceeded
 from src.tools.exceptions import error_handler
 from src.tools.log import get_logger, log_decorator
 from src.tools.message_queue import send_reply_as_md
+from src.tools.metrics import metrics
 from src.tools.tracekit import install_tracekit, TraceKitConfig
 from src.tools.update_getters import get_update_info, extract_status_change
+from src.tools.update_processor import TopicOrderedUpdateProcessor
 
 logger = get_logger(__name__)
 
@@ -138,6 +144,29 @@ async def button_change_model(update: Update, _context: PTBContext) -> None:
     await query.edit_message_text(text=f"Выбрана модель: `{model_name}`", parse_mode=ParseMode.MARKDOWN)
 
 
+@log_decorator
+async def set_model_command(update: Update, _context: PTBContext) -> None:
+    """
+    Команда смены модели для чата/топика по id: `/model <id>`.
+
+    Её же отправляет в чат выбор результата инлайн поиска моделей.
+    """
+    update_info = await get_update_info(update)
+    reply_text = await service.set_model_command(update_info, _context.args)
+    await update.message.reply_text(reply_text, parse_mode=ParseMode.MARKDOWN)
+
+
+async def inline_model_search(update: Update, _context: PTBContext) -> None:
+    """
+    Хэндлер инлайн запроса `@bot <запрос>`: поиск модели по id, названию и провайдеру.
+
+    Без log_decorator: у инлайн запроса нет чата.
+    """
+    query = update.inline_query
+    results = await service.get_inline_model_results(query.query)
+    await query.answer(results, cache_time=settings.inline_search_cache_time_sec)
+
+
 @log_decorator
 async def system_prompt_change_command(update: Update, _context: PTBContext) -> None:
     """
@@ -162,6 +191,55 @@ async def temperature_change_command(update: Update, _context: PTBContext) -> No
     await update.message.reply_text(reply_text, parse_mode=ParseMode.MARKDOWN)
 
 
+@log_decorator
+async def supersede_command(update: Update, _context: PTBContext) -> None:
+    """
+    Команда включения/выключения перезапуска генерации для чата/топика.
+
+    Если включено, новое сообщение во время генерации отменяет её и отправляется вместе с предыдущим.
+    """
+    update_info = await get_update_info(update)
+    reply_text = await service.supersede_command(update_info)
+    await update.message.reply_text(reply_text, parse_mode=ParseMode.MARKDOWN)
+
+
+@log_decorator
+async def compare_command(update: Update, _context: PTBContext) -> None:
+    """
+    Команда сравнения моделей: `/compare <модель> <модель> ...`.
+
+    Устанавливает ChatState для чата/топика равным ChatState.COMPARE.
+    """
+    update_info = await get_update_info(update)
+    reply_text = await service.compare_command(update_info, _context.args)
+    await update.message.reply_text(reply_text, parse_mode=ParseMode.MARKDOWN)
+
+
+@log_decorator
+async def button_compare_pick(update: Update, _context: PTBContext) -> None:
+    """
+    Хэндлер нажатия inline кнопки выбора лучшего ответа в /compare.
+    """
+    update_info = await get_update_info(update)
+    query = update.callback_query
+    await query.answer()
+    answer_idx = int(query.data.split("+")[1])
+    reply_text = await service.pick_compare_winner(update_info, answer_idx)
+    await query.edit_message_text(text=reply_text, parse_mode=ParseMode.MARKDOWN)
+
+
+@log_decorator
+async def cache_command(update: Update, _context: PTBContext) -> None:
+    """
+    Команда включения/выключения кэша ответов для чата/топика.
+
+    При температуре 0 кэш используется всегда.
+    """
+    update_info = await get_update_info(update)
+    reply_text = await service.cache_command(update_info)
+    await update.message.reply_text(reply_text, parse_mode=ParseMode.MARKDOWN)
+
+
 @log_decorator
 async def clear_context_command(update: Update, _context: PTBContext) -> None:
     """
@@ -180,6 +258,7 @@ async def clear_context_command(update: Update, _context: PTBContext) -> None:
     )
     reply_text += "\nКонтекст очищен."
     await service.chat_manager.clear_context(update_info.chat_id, update_info.topic_id)
+    service.discard_compare(update_info.chat_id, update_info.topic_id)
     await update.message.reply_text(reply_text, parse_mode=ParseMode.MARKDOWN)
 
 
@@ -187,9 +266,10 @@ async def clear_context_command(update: Update, _context: PTBContext) -> None:
 @log_decorator
 async def cancel_command(update: Update, _context: PTBContext) -> None:
     """
-    Команда отмены. Сбрасывает ChatState для чата/топика.
+    Команда отмены. Сбрасывает ChatState и сравнение моделей для чата/топика.
     """
     update_info = await get_update_info(update)
+    service.discard_compare(update_info.chat_id, update_info.topic_id)
 
     with suppress(KeyError):
         del state[get_state_key(update_info.chat_id, update_info.topic_id)]
@@ -226,6 +306,23 @@ async def button_cancel(update: Update, _context: PTBContext) -> None:
     await query.edit_message_text(text="Отменено.", parse_mode=ParseMode.MARKDOWN)
 
 
+@log_decorator
+async def button_stop_generation(update: Update, _context: PTBContext) -> None:
+    """
+    Хэндлер нажатия inline кнопки остановки генерации ответа.
+    """
+    update_info = await get_update_info(update)
+    query = update.callback_query
+    user_id = int(query.data.split("+")[1])
+    if user_id != update_info.user_id:
+        await query.answer("Остановить может только автор сообщения.")
+        return
+    if service.stop_generation(update_info.chat_id, update_info.topic_id, user_id):
+        await query.answer("Останавливаю...")
+    else:
+        await query.answer("Ответ ещё не начал генерироваться.")
+
+
 # INFO
 @log_decorator
 async def user_info_command(update: Update, _context: PTBContext) -> None:
@@ -295,6 +392,7 @@ async def i_am_admin_command(update: Update, _context: PTBContext) -> None:
             user = await service.chat_manager.get_user_info(user_id)
             user.is_admin = True
             await service.chat_manager.update_user(user)
+            service.budget.set_admin(user_id, True)
             await update.effective_message.reply_text("Token accepted.")
             return
         else:
@@ -315,6 +413,54 @@ async def admin_users_command(update: Update, _context: PTBContext) -> None:
         await update.message.reply_text(reply_text, parse_mode=ParseMode.MARKDOWN)
 
 
+@log_decorator
+async def admin_metrics_command(update: Update, _context: PTBContext) -> None:
+    """
+    Метрики процесса. Для администраторов.
+    """
+    user_id = update.effective_user.id
+    user_info = await service.chat_manager.get_user_info(user_id)
+    if user_info.is_admin:
+        reply_text = f"```\n{metrics.render() or '<нет данных>'}\n```"
+        await send_reply_as_md(update, reply_text, parse_mode=ParseMode.MARKDOWN)
+
+
+@log_decorator
+async def admin_routing_command(update: Update, _context: PTBContext) -> None:
+    """
+    Таблица маршрутизации по апстрим провайдерам моделей. Для администраторов.
+    """
+    user_id = update.effective_user.id
+    user_info = await service.chat_manager.get_user_info(user_id)
+    if user_info.is_admin:
+        reply_text = f"```\n{llm_router.format_routing_table() or '<нет данных>'}\n```"
+        await send_reply_as_md(update, reply_text, parse_mode=ParseMode.MARKDOWN)
+
+
+@log_decorator
+async def admin_grant_command(update: Update, _context: PTBContext) -> None:
+    """
+    Начислить токены пользователю: `/admin_grant <id пользователя> <токены>`. Для администраторов.
+    """
+    user_id = update.effective_user.id
+    user_info = await service.chat_manager.get_user_info(user_id)
+    if user_info.is_admin:
+        reply_text = await service.grant_tokens(_context.args)
+        await update.message.reply_text(reply_text)
+
+
+@log_decorator
+async def admin_budget_command(update: Update, _context: PTBContext) -> None:
+    """
+    Баланс токенов пользователя: `/admin_budget <id пользователя>`. Для администраторов.
+    """
+    user_id = update.effective_user.id
+    user_info = await service.chat_manager.get_user_info(user_id)
+    if user_info.is_admin:
+        reply_text = await service.get_budget_message(_context.args)
+        await update.message.reply_text(reply_text)
+
+
 # TEXT
 @log_decorator
 async def text_message_handler(update: Update, _context: PTBContext) -> None:
@@ -322,9 +468,16 @@ async def text_message_handler(update: Update, _context: PTBContext) -> None:
     Хэндлер для всех текстовых сообщений.
     """
     update_info = await get_update_info(update)
-    reply_text = await service.new_text_message(update_info, update)
-    if reply_text is not None:
-        await send_reply_as_md(update, reply_text, parse_mode=ParseMode.MARKDOWN_V2)
+    try:
+        reply_text = await service.new_text_message(update_info, update)
+        if reply_text is not None:
+            await send_reply_as_md(update, reply_text, parse_mode=ParseMode.MARKDOWN_V2)
+    except DeadlineExceeded as e:
+        metrics.inc("updates_expired_total", stage=e.stage)
+        logger.warning(f"update expired at {e.stage}: {update_info.chat_id=} {update_info.topic_id=}")
+        with suppress(Exception):
+            async with asyncio.timeout(settings.telegram_timeout_sec):
+                await update.message.reply_text("Не удалось ответить вовремя, попробуйте ещё раз.")
 
 
 # CHAT MEMBER HANDLER
@@ -400,6 +553,39 @@ async def noop_handler(update: Update, _context: PTBContext) -> None:
     await service.chat_manager.update_user(user_info)
 
 
+# JOBS
+async def collect_generation_stats_job(_context: PTBContext) -> None:
+    """
+    Периодическая задача: собирает стоимость запросов из OpenRouter, см. `generation_stats`.
+    """
+    try:
+        await service.collect_generation_stats()
+    except Exception as e:
+        logger.error(f"generation stats job failed: {e!r}")
+
+
+async def flush_budgets_job(_context: PTBContext) -> None:
+    """
+    Периодическая задача: записывает списания токенов пользователей в базу.
+    """
+    await service.budget.flush()
+
+
+async def refresh_model_catalog_job(_context: PTBContext) -> None:
+    """
+    Периодическая задача: обновляет каталог моделей заранее, чтобы пользователи не ждали загрузки.
+    """
+    await service.llm_provider.warm_up_catalog()
+
+
+async def on_startup(_app: Application) -> None:
+    await service.llm_provider.load_catalog_snapshot()
+
+
+async def on_shutdown(_app: Application) -> None:
+    await service.budget.flush()
+
+
 def build_app(bot_token: str) -> Application:
     """
     Регистрирует хэндлеры и возвращает инстанс бота.
@@ -409,7 +595,26 @@ def build_app(bot_token: str) -> Application:
     """
     topic_filter = TopicFilter()
 
-    app = ApplicationBuilder().concurrent_updates(True).token(bot_token).build()
+    builder = (
+        ApplicationBuilder()
+        .concurrent_updates(
+            TopicOrderedUpdateProcessor(
+                settings.update_max_concurrent,
+                settings.update_max_queue_per_topic,
+                settings.update_command_lane_concurrent,
+            )
+        )
+        .token(bot_token)
+        .connect_timeout(settings.telegram_timeout_sec)
+        .read_timeout(settings.telegram_timeout_sec)
+        .write_timeout(settings.telegram_timeout_sec)
+        .pool_timeout(settings.telegram_timeout_sec)
+        .post_init(on_startup)
+        .post_shutdown(on_shutdown)
+    )
+    if settings.bot_mode == BotMode.WEBHOOK:
+        builder = builder.updater(None)  # апдейты кладёт в очередь src.tools.webhook
+    app = builder.build()
 
     install_tracekit(
         app,
@@ -419,6 +624,7 @@ def build_app(bot_token: str) -> Application:
             enable_telegram_notify=True,
             enable_json_logs=True,
             include_stack_text = True,
+            update_deadline_sec=settings.update_deadline_sec,
         )
     )
 
@@ -432,20 +638,47 @@ def build_app(bot_token: str) -> Application:
     app.add_handler(CommandHandler("info", topic_info_command))
     app.add_handler(CommandHandler("models", show_models))
     app.add_handler(CommandHandler("providers", show_providers))
+    app.add_handler(CommandHandler("model", set_model_command))
     app.add_handler(CommandHandler("prompt", system_prompt_change_command))
     app.add_handler(CommandHandler("temperature", temperature_change_command))
+    app.add_handler(CommandHandler("cache", cache_command))
+    app.add_handler(CommandHandler("compare", compare_command))
+    app.add_handler(CommandHandler("supersede", supersede_command))
     app.add_handler(CommandHandler("cancel", cancel_command))
     app.add_handler(CommandHandler("empty", empty_command))
     app.add_handler(CommandHandler("stop", stop_command))
     app.add_handler(CommandHandler("admin_users", admin_users_command))
+    app.add_handler(CommandHandler("admin_metrics", admin_metrics_command))
+    app.add_handler(CommandHandler("admin_routing", admin_routing_command))
+    app.add_handler(CommandHandler("admin_grant", admin_grant_command))
+    app.add_handler(CommandHandler("admin_budget", admin_budget_command))
     app.add_handler(CommandHandler("i_am_admin", i_am_admin_command))
     app.add_handler(CallbackQueryHandler(button_change_model, pattern="change_model"))
+    app.add_handler(CallbackQueryHandler(button_compare_pick, pattern="compare_pick"))
     app.add_handler(CallbackQueryHandler(show_models, pattern="models"))
     app.add_handler(CallbackQueryHandler(show_providers, pattern="providers"))
     app.add_handler(CallbackQueryHandler(show_provider_models, pattern="provider"))
     app.add_handler(CallbackQueryHandler(button_cancel, pattern="cancel"))
+    app.add_handler(CallbackQueryHandler(button_stop_generation, pattern="stop_generation"))
     app.add_handler(CallbackQueryHandler(noop_handler, pattern="noop"))
-    app.add_handler(MessageHandler(filters=filters.TEXT & ~filters.COMMAND & topic_filter, callback=text_message_handler, block=False))
+    app.add_handler(InlineQueryHandler(inline_model_search))
+    app.add_handler(MessageHandler(filters=filters.TEXT & ~filters.COMMAND & topic_filter, callback=text_message_handler))
+
+    app.job_queue.run_repeating(
+        collect_generation_stats_job,
+        interval=settings.generation_stats_interval_sec,
+        first=settings.generation_stats_interval_sec,
+    )
+    app.job_queue.run_repeating(
+        refresh_model_catalog_job,
+        interval=settings.model_cache_refresh_interval_sec,
+        first=0,
+    )
+    app.job_queue.run_repeating(
+        flush_budgets_job,
+        interval=settings.budget_flush_interval_sec,
+        first=settings.budget_flush_interval_sec,
+    )
 
     app.add_error_handler(error_handler)
     return app
@@ -1,12 +1,42 @@
 from enum import Enum
 
-from pydantic import Field
+from pydantic import Field, BaseModel
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class LlmProviderType(Enum):
     ANTHROPIC = "anthropic"
     OPENAI = "openai"
+    FAKE = "fake"
+
+
+class BotMode(Enum):
+    POLLING = "polling"
+    WEBHOOK = "webhook"
+
+
+class RateLimitConfig(BaseModel):
+    rpm: int | None = None
+    tpm: int | None = None
+
+
+class FakeLlmConfig(BaseModel):
+    """Настройки локального фейкового провайдера ллм, см. `FakeLlmProvider`."""
+    latency_ms: float = Field(800, description="Медиана задержки ответа.")
+    latency_sigma: float = Field(0.5, description="Разброс задержки (sigma логнормального распределения).")
+    chunk_delay_ms: float = Field(20, description="Задержка между чанками при стриминге.")
+    response_tokens: int = Field(200, description="Длина ответа в токенах.")
+    error_rate: float = Field(0, description="Доля запросов, завершающихся ошибкой 500.")
+    rate_limit_rate: float = Field(0, description="Доля запросов, завершающихся ошибкой 429.")
+    catalog_size: int = Field(50, description="Сколько моделей в синтетическом каталоге.")
+    seed: int = Field(0)
+
+
+class LlmProviderConfig(BaseModel):
+    type: LlmProviderType
+    api_key: str
+    base_url: str | None = None
+    rate_limit: RateLimitConfig | None = None
 
 
 class Settings(BaseSettings):
@@ -17,14 +47,77 @@ class Settings(BaseSettings):
     default_model: str = Field("openai/gpt-4.1-mini")
 
     bot_token: str = Field()
+    bot_mode: BotMode = Field(BotMode.POLLING, description="Получение апдейтов: long polling или webhook.")
+    webhook_url: str | None = Field(None, description="Публичный URL webhook, регистрируется в Telegram. None - только слушать порт.")
+    webhook_secret_token: str | None = Field(None, description="Секрет заголовка X-Telegram-Bot-Api-Secret-Token, обязателен для webhook.")
+    webhook_listen: str = Field("0.0.0.0")
+    webhook_port: int = Field(8080)
+    webhook_path: str = Field("/telegram")
+    webhook_max_connections: int = Field(40, description="Сколько соединений Telegram может открыть к webhook одновременно.")
     llm_api_key: str = Field()
     mongo_url: str = Field()
     admin_token: str = Field("secret-token")
     llm_provider_type: LlmProviderType = Field(LlmProviderType.OPENAI)
+    fake_llm: FakeLlmConfig = Field(FakeLlmConfig(), description="Профиль фейкового провайдера (LLM_PROVIDER_TYPE=fake).")
+    llm_fallback_providers: list[LlmProviderConfig] = Field([], description="Резервные провайдеры ллм, по порядку. JSON список.")
+    llm_request_timeout_sec: float = Field(120, description="Таймаут одной попытки запроса к провайдеру ллм.")
+    llm_hedge_enabled: bool = Field(False, description="Дублировать запрос в резервный провайдер, если основной отвечает дольше своего p95.")
+    llm_hedge_min_samples: int = Field(20, description="Сколько замеров задержки нужно до включения хеджирования.")
+    llm_router_enabled: bool = Field(True, description="Выбирать самый быстрый апстрим OpenRouter по статистике.")
+    llm_router_alpha: float = Field(0.2, description="Вес нового замера в EWMA статистики апстримов.")
+    llm_router_max_error_rate: float = Field(0.3)
+    llm_router_min_samples: int = Field(3)
+    llm_router_stats_ttl_sec: int = Field(30 * 60, description="Через сколько секунд без замеров статистика апстрима не учитывается.")
+    generation_stats_concurrency: int = Field(4, description="Сколько запросов к OpenRouter /generation выполнять одновременно.")
+    generation_stats_interval_sec: float = Field(10, description="Как часто запускать сбор статистики генераций.")
+    generation_stats_batch_size: int = Field(50, description="Сколько генераций запрашивать за один запуск сбора.")
+    generation_stats_delay_sec: float = Field(3, description="Задержка перед первым запросом статистики генерации.")
+    generation_stats_max_attempts: int = Field(5)
+    generation_stats_max_pending: int = Field(10_000, description="Максимальный размер очереди сбора статистики.")
+    llm_retry_max_attempts: int = Field(4, description="Сколько всего попыток запроса к ллм при временных ошибках.")
+    llm_retry_base_delay_sec: float = Field(0.5)
+    llm_retry_max_delay_sec: float = Field(20)
+    llm_retry_deadline_sec: float = Field(90, description="Все попытки одного запроса к ллм должны уложиться в это время.")
+    llm_rate_limit: RateLimitConfig = Field(RateLimitConfig(), description="Лимит RPM/TPM на ключ LLM_API_KEY.")
+    llm_model_rate_limits: dict[str, RateLimitConfig] = Field({}, description="Лимиты RPM/TPM по id модели на ключ LLM_API_KEY.")
+    llm_rate_limit_max_wait_sec: float = Field(30, description="Сколько запрос может ждать в очереди лимита.")
+    circuit_failure_threshold: int = Field(5, description="Сколько ошибок подряд размыкают цепь провайдера/модели.")
+    circuit_recovery_sec: float = Field(30, description="Через сколько секунд после размыкания делать пробный запрос.")
+    llm_max_concurrent: int = Field(32, description="Сколько запросов к ллм выполняется одновременно, остальные ждут в справедливой очереди.")
+    llm_scheduler_chat_weights: dict[int, float] = Field({}, description="Веса чатов в очереди запросов к ллм, по умолчанию 1.")
+    update_command_lane_concurrent: int = Field(32, description="Сколько команд и нажатий кнопок обрабатывается одновременно, отдельно от сообщений.")
+    update_max_concurrent: int = Field(256, description="Сколько апдейтов обрабатывается одновременно во всех чатах.")
+    update_max_queue_per_topic: int = Field(20, description="Сколько апдейтов одного топика может ждать обработки.")
+    update_deadline_sec: float | None = Field(300, description="Сколько секунд есть на обработку одного апдейта, включая ожидание ллм.")
+    mongo_timeout_ms: int = Field(10_000, description="Таймаут одной операции MongoDB.")
+    telegram_timeout_sec: float = Field(30, description="Таймаут запросов к Telegram Bot API.")
+    telegram_chat_send_interval_sec: float = Field(1.0, description="Минимальный интервал между сообщениями бота в один чат.")
+    telegram_global_send_rate: float = Field(30, description="Сколько сообщений в секунду бот отправляет во все чаты вместе.")
+    telegram_send_max_retries: int = Field(3, description="Сколько раз повторять отправку сообщения после RetryAfter от Telegram.")
+    budget_enforcement: bool = Field(False, description="Списывать токены с баланса пользователей и запрещать запросы к ллм, если баланса не хватает.")
+    budget_usd_per_token: float | None = Field(0.000001, description="Цена одного токена баланса в USD. None - списывать токены без учёта цены модели.")
+    budget_output_estimate_tokens: int = Field(500, description="Оценка токенов ответа при проверке баланса перед запросом.")
+    budget_initial_tokens: int = Field(0, description="Баланс токенов нового пользователя.")
+    budget_flush_interval_sec: float = Field(30, description="Как часто записывать списания токенов в базу.")
     model_cache_ttl_sec: int = Field(5 * 60)
+    inline_search_cache_time_sec: int = Field(60, description="Сколько Telegram кэширует результаты инлайн поиска моделей.")
+    model_cache_persistent: bool = Field(True, description="Сохранять каталог моделей в MongoDB и загружать его при старте.")
+    model_cache_refresh_interval_sec: float = Field(60, description="Как часто проверять, не пора ли обновить каталог моделей.")
+    model_cache_retry_base_sec: float = Field(5, description="Пауза после первой ошибки обновления каталога, удваивается с каждой ошибкой.")
+    model_cache_retry_max_sec: float = Field(10 * 60, description="Максимальная пауза между попытками обновления каталога.")
     extra_headers: dict | None = Field(None)
     admin_chat_id: int | None = Field(None)
     wait_new_message_sec: int = Field(2, description="Время в сек, сколько ждать новых сообщений в тг перед отправкой.")
+    adaptive_message_wait: bool = Field(True, description="Ждать новые сообщения только после сообщений, похожих на часть разбитого телеграмом.")
+    split_message_min_chars: int = Field(3000, description="С какой длины сообщение считается частью разбитого (лимит телеграм 4096).")
+    split_wait_min_sec: float = Field(0.3, description="Минимальное ожидание следующей части сообщения.")
+    split_gap_factor: float = Field(2.0, description="Во сколько раз ждать дольше среднего интервала между частями у пользователя.")
+    response_cache_ttl_sec: int = Field(24 * 60 * 60)
+    response_cache_max_size: int = Field(1000, description="Сколько ответов держать в памяти (LRU).")
+    response_cache_persistent: bool = Field(False, description="Хранить кэш ответов ещё и в MongoDB.")
+    tokenizer_encodings: list[str] = Field(["o200k_base", "cl100k_base"], description="Кодировки tiktoken, загружаемые при старте.")
+    tokenizer_offload_min_chars: int = Field(20_000, description="С какой длины текста считать токены в пуле потоков.")
+    tokenizer_max_workers: int = Field(2)
     debug: bool = Field(False)
 
 settings = Settings()
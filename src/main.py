@@ -1,12 +1,20 @@
+import asyncio
+
+from src.app.tokenizer import tokenizer_service
 from src.bot import build_app
 from src.tools.check_ip import check_ip
-from src.config import settings
+from src.tools.webhook import run_webhook
+from src.config import settings, BotMode
 
 
 def main():
     check_ip()
+    tokenizer_service.preload()
     app = build_app(settings.bot_token)
-    app.run_polling()
+    if settings.bot_mode == BotMode.WEBHOOK:
+        asyncio.run(run_webhook(app))
+    else:
+        app.run_polling()
 
 
 if __name__ == '__main__':
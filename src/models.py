@@ -1,10 +1,11 @@
+import functools
 import hashlib
 from datetime import datetime, UTC
 from typing import Optional, Literal, Any, TypeAlias
 
 from anthropic.types import ModelParam
 from bson import ObjectId
-from pydantic import BaseModel, Field, ConfigDict, model_validator
+from pydantic import BaseModel, Field, ConfigDict
 from pydantic_ai.messages import ModelResponse
 from pydantic_ai.usage import Usage
 from telegram.constants import ParseMode
@@ -30,6 +31,8 @@ class Settings(BaseModel):
     temperature: float = Field(0.7)
     parse_pdf: Optional[bool] = Field(False)
     md_mode: ParseMode = Field(ParseMode.MARKDOWN)
+    cache_responses: bool = Field(False)
+    supersede: bool = Field(False)
 
 
 class TopicInfo(BaseMongoModel):
@@ -49,6 +52,8 @@ class UserInfo(BaseMongoModel):
     username: str | None
     full_name: str | None
     tokens_balance: int = Field(0)
+    total_cost: float = Field(0)
+    cache_discount: float = Field(0)
     spin_counter: int = Field(0)
     is_admin: bool = Field(False)
     dt_created: datetime = Field(datetime.now(UTC))
@@ -67,6 +72,12 @@ class MessageRecord(BaseMongoModel):
     tokens_from_prov: int
     user_id: int
     timestamp: datetime
+    cached: bool = Field(False)
+    generation_id: str | None = Field(None)
+    total_cost: float | None = Field(None)
+    cache_discount: float | None = Field(None)
+    latency_ms: int | None = Field(None)
+    generation_time_ms: int | None = Field(None)
 
 
 class PromptModel(BaseModel):
@@ -77,6 +88,38 @@ class PromptModel(BaseModel):
 class LlmProviderSendResponse(BaseModel):
     model_response: ModelResponse
     usage: Usage
+    cached: bool = Field(False)
+    generation_id: str | None = Field(None)
+
+
+class CompareAnswer(BaseModel):
+    """Ответ одной модели в режиме сравнения /compare."""
+    model: str
+    latency_sec: float
+    response: LlmProviderSendResponse | None = None
+    cost: float | None = None
+    error: str | None = None
+
+
+class Comparison(BaseModel):
+    """Результат /compare, ждёт выбора лучшего ответа."""
+    user_message: MessageModel
+    context_n: int
+    context_tokens: int
+    timestamp: datetime
+    """Время сообщения пользователя."""
+    answered_at: datetime
+    """Время, когда пришли ответы моделей, с ним сохраняется выбранный ответ."""
+    answers: list[CompareAnswer]
+
+
+class CachedResponse(BaseMongoModel):
+    key: str
+    content: str
+    model_name: str | None = None
+    request_tokens: int | None = None
+    response_tokens: int | None = None
+    created_at: datetime
 
 
 class AvailableModel(BaseModel):
@@ -126,6 +169,7 @@ class AvailableModel(BaseModel):
     id_hash: str = None
 
     @staticmethod
+    @functools.lru_cache(maxsize=4096)
     def get_hash(text):
         return hashlib.md5(text.encode()).hexdigest()[:8]
 
@@ -133,23 +177,6 @@ class AvailableModel(BaseModel):
         self.id_hash = self.get_hash(self.id)
 
 
-class ModelCache(BaseModel):
-    updated_at: datetime = datetime.now(UTC)
-    models: list[AvailableModel] = []
-
-    class Config:
-        validate_assignment = True
-
-    @model_validator(mode='after')
-    @classmethod
-    def update_updated_at(cls, obj: "ModelCache") -> "ModelCache":
-        """Обновить поле updated_at при изменении поля models."""
-        obj.model_config["validate_assignment"] = False
-        obj.updated_at = datetime.now(UTC)
-        obj.model_config["validate_assignment"] = True
-        return obj
-
-
 class GenerationInfo(BaseModel):
     id: str
     total_cost: float
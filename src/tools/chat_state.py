@@ -8,6 +8,9 @@ class ChatState(enum.Enum):
     TEMPERATURE = "temperature"
     """Изменение параметра температуры для чата, ожидание сообщения с числом."""
 
+    COMPARE = "compare"
+    """Сравнение моделей, ожидание сообщения, которое будет отправлено в несколько моделей."""
+
 
 def get_state_key(chat_id: int, topic_id: int) -> str:
     """
@@ -0,0 +1,94 @@
+import asyncio
+import functools
+import time
+from contextlib import asynccontextmanager, contextmanager
+
+import pymongo
+from pymongo.errors import PyMongoError
+
+from src.tools.metrics import metrics
+from src.tools.tracekit.request_context import deadline_var
+
+
+class DeadlineExceeded(TimeoutError):
+    """Время на обработку апдейта истекло."""
+
+    def __init__(self, stage: str):
+        super().__init__(f"deadline exceeded at {stage}")
+        self.stage = stage
+
+
+def set_deadline(seconds: float | None) -> None:
+    """
+    Установить дедлайн для текущего контекста (апдейта) через `seconds` секунд.
+
+    :param seconds: None - без дедлайна.
+    """
+    deadline_var.set(time.monotonic() + seconds if seconds is not None else None)
+
+
+def get_remaining() -> float | None:
+    """
+    :return: сколько секунд осталось до дедлайна, None - если дедлайна нет.
+    """
+    deadline = deadline_var.get()
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+
+def _check(stage: str) -> float | None:
+    remaining = get_remaining()
+    if remaining is not None and remaining <= 0:
+        metrics.inc("deadline_exceeded_total", stage=stage)
+        raise DeadlineExceeded(stage)
+    return remaining
+
+
+@asynccontextmanager
+async def deadline_scope(stage: str):
+    """
+    Ограничить блок кода оставшимся временем дедлайна.
+
+    :param stage: название этапа для метрик (`llm`, `telegram`, ...).
+    :raises DeadlineExceeded: если дедлайн истёк до или во время блока.
+    """
+    remaining = _check(stage)
+    timeout = asyncio.timeout(remaining)
+    try:
+        async with timeout:
+            yield
+    except TimeoutError as e:
+        if not timeout.expired():
+            raise
+        metrics.inc("deadline_exceeded_total", stage=stage)
+        raise DeadlineExceeded(stage) from e
+
+
+@contextmanager
+def mongo_deadline_scope():
+    """
+    Ограничить операции pymongo оставшимся временем дедлайна.
+
+    Вызовы pymongo синхронные, поэтому отменить их через asyncio нельзя, используется `pymongo.timeout`.
+    """
+    remaining = _check("db")
+    try:
+        with pymongo.timeout(remaining):
+            yield
+    except PyMongoError as e:
+        if remaining is not None and e.timeout:
+            metrics.inc("deadline_exceeded_total", stage="db")
+            raise DeadlineExceeded("db") from e
+        raise
+
+
+def with_mongo_deadline(func):
+    """Декоратор для async методов MongoManager, см. `mongo_deadline_scope`."""
+
+    @functools.wraps(func)
+    async def wrap(*args, **kwargs):
+        with mongo_deadline_scope():
+            return await func(*args, **kwargs)
+
+    return wrap
@@ -0,0 +1,113 @@
+import asyncio
+from typing import Generic, Hashable, TypeVar
+
+T = TypeVar("T")
+
+
+class _DebounceEntry(Generic[T]):
+    __slots__ = ("items", "deadline", "fire_at", "future", "handle")
+
+    def __init__(self, future: asyncio.Future, deadline: float):
+        self.items: list[T] = []
+        self.deadline: float = deadline
+        self.fire_at: float = deadline
+        """Когда сработает текущий таймер."""
+        self.future: asyncio.Future = future
+        self.handle: asyncio.TimerHandle | None = None
+
+
+class Debouncer(Generic[T]):
+    """
+    Собирает элементы по ключу, пока между ними проходит меньше `delay_sec` секунд.
+
+    На каждый ключ один таймер `loop.call_later`. Новый элемент только сдвигает дедлайн,
+    а сработавший раньше дедлайна таймер переставляется на остаток, поэтому частые сообщения
+    не создают и не отменяют таймеры. Ожидающий получает элементы ровно по окончании паузы.
+
+    Пачка, пауза которой закончилась, остаётся до вызова `wait`, даже если тот опоздал.
+    Если её так никто и не забрал за `collect_timeout_sec`, она удаляется.
+
+    :param delay_sec: пауза после последнего элемента.
+    :param collect_timeout_sec: сколько ждать `wait` после конца паузы.
+    """
+
+    def __init__(self, delay_sec: float, collect_timeout_sec: float = 120):
+        self._delay = delay_sec
+        self._collect_timeout = collect_timeout_sec
+        self._entries: dict[Hashable, _DebounceEntry[T]] = {}
+
+    def add(self, key: Hashable, item: T, delay: float | None = None) -> bool:
+        """
+        Добавить элемент и сдвинуть конец паузы для ключа.
+
+        :param delay: пауза после этого элемента, по умолчанию `delay_sec`. Может быть короче прежней.
+        :return: True, если элемент первый в пачке - тогда вызывающий должен ждать `wait(key)`.
+        """
+        loop = asyncio.get_running_loop()
+        delay = self._delay if delay is None else max(delay, 0)
+        deadline = loop.time() + delay
+        entry = self._entries.get(key)
+        first = entry is None
+        if first:
+            entry = _DebounceEntry(loop.create_future(), deadline)
+            self._entries[key] = entry
+            self._schedule(key, entry, loop)
+        elif not entry.future.done():
+            entry.deadline = deadline
+            if deadline < entry.fire_at:
+                entry.handle.cancel()
+                self._schedule(key, entry, loop)
+        entry.items.append(item)
+        return first
+
+    async def wait(self, key: Hashable) -> list[T]:
+        """
+        Дождаться конца паузы для ключа.
+
+        Пачка удаляется, когда ожидающий её забирает или отменяется. Элементы, пришедшие между
+        концом паузы и этим моментом, попадают в ту же пачку.
+
+        :return: элементы пачки в порядке добавления.
+        """
+        entry = self._entries[key]
+        try:
+            return await entry.future
+        finally:
+            self._remove(key, entry)
+
+    def discard(self, key: Hashable) -> None:
+        """Удалить пачку без результата, ожидающий `wait` получит CancelledError."""
+        entry = self._entries.get(key)
+        if entry is not None:
+            self._remove(key, entry)
+            entry.future.cancel()
+
+    def _schedule(self, key: Hashable, entry: _DebounceEntry[T], loop: asyncio.AbstractEventLoop) -> None:
+        entry.fire_at = entry.deadline
+        entry.handle = loop.call_at(entry.deadline, self._fire, key, entry)
+
+    def _fire(self, key: Hashable, entry: _DebounceEntry[T]) -> None:
+        loop = asyncio.get_running_loop()
+        if entry.deadline > loop.time():
+            self._schedule(key, entry, loop)
+            return
+        if entry.future.done():
+            # пачку не забрали за collect_timeout_sec
+            entry.handle = None
+            self._remove(key, entry)
+            return
+        entry.future.set_result(entry.items)
+        entry.handle = loop.call_later(self._collect_timeout, self._fire, key, entry)
+
+    def _remove(self, key: Hashable, entry: _DebounceEntry[T]) -> None:
+        if self._entries.get(key) is entry:
+            del self._entries[key]
+        if entry.handle is not None:
+            entry.handle.cancel()
+            entry.handle = None
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
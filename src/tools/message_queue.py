@@ -1,6 +1,5 @@
-import datetime
+import time
 import traceback
-from collections import defaultdict
 
 import telegramify_markdown
 from langchain_text_splitters import MarkdownTextSplitter
@@ -8,7 +7,12 @@ from telegram import Bot
 from telegram.constants import ParseMode
 from telegram.error import BadRequest
 
+from src.config import settings
+from src.tools.deadline import deadline_scope, DeadlineExceeded
+from src.tools.debounce import Debouncer
 from src.tools.log import get_logger, log_decorator
+from src.tools.metrics import metrics
+from src.tools.send_queue import telegram_send_queue
 
 logger = get_logger(__name__)
 
@@ -26,26 +30,125 @@ def get_queue_key(user_id: int, topic_id: int) -> str:
     return f"user_{user_id}+topic_{topic_id}"
 
 
-messages_queue: dict[str, list[tuple[str, datetime.datetime]]] = defaultdict(list)
-"""Очередь сообщений по пользователю и топику."""
+class MessageCoalescer:
+    """
+    Склеивает части длинного сообщения, которые клиент телеграм разбивает при отправке.
+
+    Короткое сообщение явно целое и отправляется сразу. После сообщения длиной около лимита телеграм
+    ждём следующую часть: столько, сколько обычно проходит между частями у этого пользователя
+    (`split_gap_factor` * среднее), но не дольше `wait_new_message_sec`.
+    """
+
+    GAP_EWMA_ALPHA = 0.3
+    PRUNE_SIZE = 10_000
+
+    def __init__(
+        self,
+        max_wait_sec: float = settings.wait_new_message_sec,
+        split_min_chars: int = settings.split_message_min_chars,
+        min_wait_sec: float = settings.split_wait_min_sec,
+        gap_factor: float = settings.split_gap_factor,
+        adaptive: bool = settings.adaptive_message_wait,
+    ):
+        self._max_wait = max_wait_sec
+        self._split_min_chars = split_min_chars
+        self._min_wait = min_wait_sec
+        self._gap_factor = gap_factor
+        self._adaptive = adaptive
+        self._debouncer: Debouncer[str] = Debouncer(max_wait_sec)
+        self._gaps: dict[int, float] = {}  # {user_id: среднее время между частями}, давно не писавшие вытесняются
+        self._last: dict[str, tuple[float, bool]] = {}  # {queue_key: (время последнего сообщения, похоже на часть)}
+
+    def _looks_split(self, text: str) -> bool:
+        return len(text) >= self._split_min_chars
+
+    def get_delay(self, user_id: int, text: str) -> float:
+        """
+        Сколько ждать следующую часть после сообщения.
+
+        :return: 0 для явно целого сообщения, иначе выученный интервал пользователя.
+        """
+        if not self._adaptive:
+            return self._max_wait
+        if not self._looks_split(text):
+            return 0
+        gap = self._gaps.get(user_id)
+        if gap is None:
+            return self._max_wait
+        return min(max(gap * self._gap_factor, self._min_wait), self._max_wait)
+
+    def add(self, queue_key: str, user_id: int, text: str) -> bool:
+        """
+        Добавить сообщение в очередь.
+
+        :return: True, если сообщение первое в пачке - тогда вызывающий должен ждать `wait(queue_key)`.
+        """
+        now = time.monotonic()
+        previous = self._last.get(queue_key)
+        if previous is not None and previous[1] and now - previous[0] <= self._max_wait:
+            self._learn_gap(user_id, now - previous[0])
+            if queue_key not in self._debouncer:
+                metrics.inc("message_split_missed_total")
+                logger.info(f"split message part arrived after the batch was sent: {queue_key=}")
+        if len(self._last) > self.PRUNE_SIZE:
+            self._prune(now)
+        self._last[queue_key] = (now, self._looks_split(text))
+        return self._debouncer.add(queue_key, text, self.get_delay(user_id, text))
+
+    def _learn_gap(self, user_id: int, gap: float) -> None:
+        average = self._gaps.pop(user_id, None)  # в конец словаря, см `_prune`
+        self._gaps[user_id] = gap if average is None else average + self.GAP_EWMA_ALPHA * (gap - average)
+        if len(self._gaps) > self.PRUNE_SIZE:
+            del self._gaps[next(iter(self._gaps))]
+
+    def _prune(self, now: float) -> None:
+        # через max_wait_sec последнее сообщение уже не влияет на следующее
+        self._last = {key: last for key, last in self._last.items() if now - last[0] <= self._max_wait}
+
+    async def wait(self, queue_key: str) -> list[str]:
+        """
+        Дождаться, пока сообщение придёт целиком.
+
+        :return: тексты частей в порядке получения.
+        """
+        messages = await self._debouncer.wait(queue_key)
+        last = self._last.get(queue_key)
+        if last is not None:
+            waited = time.monotonic() - last[0]
+            metrics.observe("message_wait_seconds", waited)
+            metrics.observe("message_wait_saved_seconds", max(self._max_wait - waited, 0))
+        metrics.inc("message_batches_total", parts=min(len(messages), 3))
+        return messages
+
+    def discard(self, queue_key: str) -> None:
+        self._debouncer.discard(queue_key)
+
 
+messages_queue = MessageCoalescer()
+"""Очередь сообщений по пользователю и топику, ключ `get_queue_key`. Части длинного сообщения собираются в одно."""
 
-# {f"user_{user_id}+topic_{topic_id}": [("message_text", datetime.now), ("continue_message_text", datetime.now)]}
 
 @log_decorator
 async def send_reply_as_md(update, llm_resp_text: str, parse_mode: ParseMode = ParseMode.MARKDOWN, msg_for_delete=None):
+    chat_id = update.effective_chat.id
     try:
         sections = MarkdownTextSplitter(chunk_overlap=0, keep_separator="end").split_text(llm_resp_text)
-        for i, section in enumerate(sections):
-            try:
-                if parse_mode == ParseMode.MARKDOWN_V2:
-                    section = telegramify_markdown.markdownify(section)
-                await update.message.reply_text(section, parse_mode=parse_mode)
-            except BadRequest:
-                logger.warning(f"can't send {i}/{len(sections)} message as md: {sections=}")
-                await update.message.reply_text(section)
+        async with telegram_send_queue.chat(chat_id) as send:
+            for i, section in enumerate(sections):
+                async with deadline_scope("telegram"):
+                    try:
+                        if parse_mode == ParseMode.MARKDOWN_V2:
+                            section = telegramify_markdown.markdownify(section)
+                        await send(lambda: update.message.reply_text(section, parse_mode=parse_mode))
+                    except BadRequest:
+                        logger.warning(f"can't send {i}/{len(sections)} message as md: {sections=}")
+                        await send(lambda: update.message.reply_text(section))
+    except DeadlineExceeded:
+        raise
     except Exception:
-        await update.message.reply_text("Произошла ошибка, попробуйте снова.", parse_mode=ParseMode.MARKDOWN)
+        await telegram_send_queue.send(
+            chat_id, lambda: update.message.reply_text("Произошла ошибка, попробуйте снова.", parse_mode=ParseMode.MARKDOWN)
+        )
         logger.error(traceback.format_exc())
     finally:
         if msg_for_delete:
@@ -55,14 +158,17 @@ async def send_reply_as_md(update, llm_resp_text: str, parse_mode: ParseMode = P
 async def send_msg_as_md(bot: Bot, chat_id: int, msg_text: str, parse_mode: ParseMode = ParseMode.MARKDOWN):
     try:
         sections = MarkdownTextSplitter(chunk_overlap=0, keep_separator="end").split_text(msg_text)
-        for i, section in enumerate(sections):
-            try:
-                if parse_mode == ParseMode.MARKDOWN_V2:
-                    section = telegramify_markdown.markdownify(section)
-                await bot.send_message(chat_id, section, parse_mode=parse_mode)
-            except BadRequest:
-                logger.warning(f"can't send {i}/{len(sections)} message as md: {sections=}")
-                await bot.send_message(chat_id, section)
+        async with telegram_send_queue.chat(chat_id) as send:
+            for i, section in enumerate(sections):
+                try:
+                    if parse_mode == ParseMode.MARKDOWN_V2:
+                        section = telegramify_markdown.markdownify(section)
+                    await send(lambda: bot.send_message(chat_id, section, parse_mode=parse_mode))
+                except BadRequest:
+                    logger.warning(f"can't send {i}/{len(sections)} message as md: {sections=}")
+                    await send(lambda: bot.send_message(chat_id, section))
     except Exception:
-        await bot.send_message(chat_id, "Произошла ошибка, попробуйте снова.", parse_mode=ParseMode.MARKDOWN)
+        await telegram_send_queue.send(
+            chat_id, lambda: bot.send_message(chat_id, "Произошла ошибка, попробуйте снова.", parse_mode=ParseMode.MARKDOWN)
+        )
         logger.error(traceback.format_exc())
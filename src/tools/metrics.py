@@ -0,0 +1,68 @@
+from collections import defaultdict
+
+
+class Metrics:
+    """
+    Метрики процесса в памяти: счётчики, значения и сводки (count/sum/max).
+
+    Метка задаётся именованными аргументами: `metrics.inc("llm_requests_total", path="primary")`.
+    """
+
+    def __init__(self):
+        self._counters: dict[tuple[str, tuple], float] = defaultdict(float)
+        self._gauges: dict[tuple[str, tuple], float] = {}
+        self._summaries: dict[tuple[str, tuple], list[float]] = {}
+
+    @staticmethod
+    def _key(name: str, labels: dict) -> tuple[str, tuple]:
+        return name, tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+    def inc(self, name: str, value: float = 1, **labels) -> None:
+        """Увеличить счётчик."""
+        self._counters[self._key(name, labels)] += value
+
+    def set(self, name: str, value: float, **labels) -> None:
+        """Установить текущее значение (gauge)."""
+        self._gauges[self._key(name, labels)] = value
+
+    def observe(self, name: str, value: float, **labels) -> None:
+        """Добавить наблюдение в сводку (например, задержку в секундах)."""
+        summary = self._summaries.setdefault(self._key(name, labels), [0, 0.0, 0.0])
+        summary[0] += 1
+        summary[1] += value
+        summary[2] = max(summary[2], value)
+
+    def get(self, name: str, **labels) -> float:
+        """Текущее значение счётчика или gauge."""
+        key = self._key(name, labels)
+        if key in self._gauges:
+            return self._gauges[key]
+        return self._counters.get(key, 0)
+
+    def render(self) -> str:
+        """
+        Все метрики в текстовом формате Prometheus.
+
+        :return: строки вида `name{label="value"} 1.0`
+        """
+        lines = []
+        for (name, labels), value in sorted(self._counters.items()):
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+        for (name, labels), value in sorted(self._gauges.items()):
+            lines.append(f"{name}{self._format_labels(labels)} {value}")
+        for (name, labels), (count, total, max_value) in sorted(self._summaries.items()):
+            label_str = self._format_labels(labels)
+            lines.append(f"{name}_count{label_str} {count}")
+            lines.append(f"{name}_sum{label_str} {total}")
+            lines.append(f"{name}_max{label_str} {max_value}")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _format_labels(labels: tuple) -> str:
+        if not labels:
+            return ""
+        return "{" + ",".join(f'{k}="{v}"' for k, v in labels) + "}"
+
+
+metrics = Metrics()
+"""Метрики процесса."""
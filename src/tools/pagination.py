@@ -1,5 +1,6 @@
 from dataclasses import dataclass
 from math import ceil
+from typing import Sequence, Callable, Hashable, Any
 
 from pydantic import BaseModel
 from telegram import InlineKeyboardMarkup, InlineKeyboardButton
@@ -19,11 +20,11 @@ class PageItem(BaseModel):
 @dataclass
 class ListPage:
     """
-    :var items: общий список из `PageItem`
+    :var items: общий список элементов
     :var page: запрошенная страница
     :var per_page: количество элементов на странице
     """
-    items: list[PageItem]
+    items: Sequence
     page: int
     per_page: int
 
@@ -43,29 +44,43 @@ class ListPage:
         return list(self.items[s:s + self.per_page])
 
 
+def clamp_page(page: int, items_count: int, per_page: int) -> int:
+    """
+    Привести номер страницы к существующей странице.
+
+    :return: номер страницы от 0 до `total_pages - 1`.
+    """
+    return min(max(page, 0), max(1, ceil(items_count / per_page)) - 1)
+
+
 def build_list_keyboard(
-    items: list[PageItem],
+    items: Sequence,
     page: int = 0,
     per_page: int = 8,
     item_cb_prefix: str = "item",
     page_cb_prefix: str = "page",
-    back_button_cb: str = None
+    back_button_cb: str = None,
+    to_page_item: Callable[[Any], PageItem] | None = None,
 ) -> InlineKeyboardMarkup:
     """
     Создаёт клавиатуру с пагинацией.
 
-    :param items: список src.tools.pagination.PageItem
+    :param items: список src.tools.pagination.PageItem или любых элементов вместе с `to_page_item`
     :param page: запрошенная страница
     :param per_page: кол-во элементов на странице
     :param item_cb_prefix: префикс callback строки для элемента = `f"{item_cb_prefix}+{item.cb_data}"`
     :param page_cb_prefix: префикс callback строки для пагинатора = `f"{page_cb_prefix}+{page + 1}"`
     :param back_button_cb: опционально: строка callback для кнопки Назад
+    :param to_page_item: опционально: преобразование элемента в PageItem, вызывается только для элементов страницы
     :return: клавиатура InlineKeyboardMarkup
     """
     lp = ListPage(items, page, per_page)
+    page_items = lp.slice()
+    if to_page_item is not None:
+        page_items = [to_page_item(item) for item in page_items]
 
     rows = [[InlineKeyboardButton(text=item.display_name, callback_data=f"{item_cb_prefix}+{item.cb_data}")]
-            for item in lp.slice()]
+            for item in page_items]
 
     nav = []
     if lp.page > 0:
@@ -79,3 +94,35 @@ def build_list_keyboard(
     if back_button_cb:
         rows.append([InlineKeyboardButton("Назад", callback_data=back_button_cb)])
     return InlineKeyboardMarkup(rows)
+
+
+class KeyboardCache:
+    """
+    Готовые клавиатуры страниц по ключу (вид, параметр, страница).
+
+    Кэш привязан к версии данных (например, снимку каталога моделей): при смене версии он очищается.
+    Клавиатуры telegram неизменяемы, поэтому одну и ту же можно отдавать в разные сообщения.
+    """
+
+    def __init__(self):
+        self._version: object = None
+        self._items: dict[Hashable, InlineKeyboardMarkup] = {}
+
+    def get_or_build(
+        self,
+        version: object,
+        key: Hashable,
+        build: Callable[[], InlineKeyboardMarkup],
+    ) -> InlineKeyboardMarkup:
+        """
+        :param version: версия данных, сравнивается по идентичности.
+        :param key: ключ страницы.
+        :param build: построение клавиатуры при промахе.
+        """
+        if version is not self._version:
+            self._items.clear()
+            self._version = version
+        keyboard = self._items.get(key)
+        if keyboard is None:
+            keyboard = self._items[key] = build()
+        return keyboard
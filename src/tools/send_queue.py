@@ -0,0 +1,125 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from datetime import timedelta
+from typing import AsyncIterator, Awaitable, Callable, TypeVar
+
+from telegram.error import RetryAfter
+
+from src.config import settings
+from src.tools.log import get_logger
+from src.tools.metrics import metrics
+
+logger = get_logger(__name__)
+
+T = TypeVar("T")
+
+
+class _ChatSendState:
+    __slots__ = ("lock", "next_at", "pending")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.next_at = 0.0
+        """`time.monotonic()`, раньше которого в чат не отправлять."""
+        self.pending = 0
+
+
+class TelegramSendQueue:
+    """
+    Исходящие сообщения в Telegram с учётом flood control.
+
+    В один чат сообщения уходят по одному, в порядке вызова и не чаще `chat_interval_sec`.
+    Разные чаты отправляют параллельно, но все вместе не чаще `global_rate_per_sec` в секунду.
+    На RetryAfter отправка повторяется через указанное Telegram время, чат на это время ставится на паузу.
+
+    :param chat_interval_sec: минимальный интервал между сообщениями в один чат.
+    :param global_rate_per_sec: сколько сообщений в секунду бот отправляет во все чаты.
+    :param max_retries: сколько раз повторять отправку после RetryAfter.
+    """
+
+    PRUNE_SIZE = 10_000
+
+    def __init__(
+        self,
+        chat_interval_sec: float = settings.telegram_chat_send_interval_sec,
+        global_rate_per_sec: float = settings.telegram_global_send_rate,
+        max_retries: int = settings.telegram_send_max_retries,
+    ):
+        self._chat_interval = chat_interval_sec
+        self._global_interval = 1 / global_rate_per_sec
+        self._max_retries = max_retries
+        self._global_next_at = 0.0
+        self._chats: dict[int, _ChatSendState] = {}
+
+    async def send(self, chat_id: int, send: Callable[[], Awaitable[T]]) -> T:
+        """
+        Отправить одно сообщение в очереди чата.
+
+        :param send: функция, выполняющая сам запрос к Telegram, вызывается заново при повторе.
+        :return: результат `send`.
+        :raises RetryAfter: если повторы закончились.
+        """
+        async with self.chat(chat_id) as chat_send:
+            return await chat_send(send)
+
+    @asynccontextmanager
+    async def chat(self, chat_id: int) -> AsyncIterator[Callable[[Callable[[], Awaitable[T]]], Awaitable[T]]]:
+        """
+        Занять очередь чата на время блока, чтобы части одного ответа не перемешались с другими сообщениями.
+
+        Внутри блока отправлять через полученную функцию, а не через `send` (иначе блок будет ждать сам себя).
+        """
+        state = self._chats.get(chat_id)
+        if state is None:
+            if len(self._chats) > self.PRUNE_SIZE:
+                self._prune()
+            state = self._chats[chat_id] = _ChatSendState()
+        state.pending += 1
+        try:
+            async with state.lock:
+                yield lambda send: self._send(chat_id, state, send)
+        finally:
+            state.pending -= 1
+
+    async def _send(self, chat_id: int, chat: _ChatSendState, send: Callable[[], Awaitable[T]]) -> T:
+        metrics.inc("telegram_sends_total")
+        ts = time.monotonic()
+        for attempt in range(self._max_retries + 1):
+            await self._wait_turn(chat)
+            if attempt == 0:
+                metrics.observe("telegram_send_wait_seconds", time.monotonic() - ts)
+            try:
+                return await send()
+            except RetryAfter as e:
+                delay = e.retry_after
+                if isinstance(delay, timedelta):
+                    delay = delay.total_seconds()
+                chat.next_at = max(chat.next_at, time.monotonic() + delay)
+                metrics.inc("telegram_send_retry_after_total")
+                logger.warning(f"telegram flood control: {chat_id=}, retry in {delay}s, {attempt=}")
+                if attempt == self._max_retries:
+                    raise
+
+    async def _wait_turn(self, chat: _ChatSendState) -> None:
+        # сначала пауза чата, и только потом место в общем потоке:
+        # чат на паузе после RetryAfter не должен занимать слот, которого ждут другие чаты
+        now = time.monotonic()
+        if chat.next_at > now:
+            await asyncio.sleep(chat.next_at - now)
+            now = time.monotonic()
+        at = max(now, self._global_next_at)
+        self._global_next_at = at + self._global_interval
+        chat.next_at = at + self._chat_interval
+        if at > now:
+            await asyncio.sleep(at - now)
+
+    def _prune(self) -> None:
+        now = time.monotonic()
+        self._chats = {
+            chat_id: chat for chat_id, chat in self._chats.items() if chat.pending or chat.next_at > now
+        }
+
+
+telegram_send_queue = TelegramSendQueue()
+"""Очередь исходящих сообщений бота."""
@@ -15,3 +15,4 @@ class TraceKitConfig:
     redact_patterns: re.Pattern = field(default_factory=lambda: re.compile(r"(token|password|secret|key|cookie|auth|session|bearer)", re.I))
     rate_limit_per_minute: int = 20      # простая защита от спама
     include_stack_text: bool = True      # добавлять обычный traceback
+    update_deadline_sec: float | None = None  # дедлайн на обработку апдейта, см. request_context.deadline_var
@@ -1,8 +1,9 @@
 from __future__ import annotations
+import time
 import uuid
 from telegram.ext import Application, ApplicationHandlerStop, TypeHandler
 from telegram import Update
-from .request_context import req_id_var
+from .request_context import req_id_var, deadline_var
 from .config import TraceKitConfig
 from .trace import format_exception_with_locals
 from .logger import get_logger, install_json_logging
@@ -14,6 +15,10 @@ async def _on_update(update: Update, context):
     # присваиваем req_id каждому апдейту
     rid = str(uuid.uuid4())
     req_id_var.set(rid)
+    # дедлайн апдейта, наследуется задачами хендлеров вместе с req_id
+    cfg: TraceKitConfig | None = context.application.bot_data.get("_tracekit_cfg")
+    if cfg is not None and cfg.update_deadline_sec:
+        deadline_var.set(time.monotonic() + cfg.update_deadline_sec)
     log.info("update received", extra={"req_id": rid})
 
 async def _on_error(update: object, context):
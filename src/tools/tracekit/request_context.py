@@ -2,3 +2,5 @@ from __future__ import annotations
 import contextvars
 
 req_id_var: contextvars.ContextVar[str] = contextvars.ContextVar("req_id", default="-")
+# дедлайн обработки апдейта, значение time.monotonic(); None - без дедлайна
+deadline_var: contextvars.ContextVar[float | None] = contextvars.ContextVar("deadline", default=None)
@@ -0,0 +1,218 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncIterator, Awaitable
+
+from telegram import Update, MessageEntity
+from telegram.ext import BaseUpdateProcessor
+
+from src.tools.log import get_logger
+from src.tools.metrics import metrics
+
+logger = get_logger(__name__)
+
+UNLIMITED = 2 ** 31 - 1
+
+TopicKey = tuple[int, int]
+"""(chat_id, topic_id)"""
+
+
+def get_topic_key(update: object) -> TopicKey | None:
+    """
+    Ключ чата/топика апдейта, топик определяется как в `get_update_info`.
+
+    :return: (chat_id, topic_id) или None, если у апдейта нет чата (например, инлайн запрос).
+    """
+    if not isinstance(update, Update) or update.effective_chat is None:
+        return None
+    message = update.effective_message
+    topic_id = message.message_thread_id if message and message.is_topic_message else 1
+    return update.effective_chat.id, topic_id
+
+
+def get_lane(update: object) -> str:
+    """
+    Очередь апдейта: `command` для команд и нажатий кнопок, `message` для остального.
+    """
+    if not isinstance(update, Update):
+        return "message"
+    if update.callback_query is not None:
+        return "command"
+    message = update.message
+    if message and message.entities:
+        entity = message.entities[0]
+        if entity.type == MessageEntity.BOT_COMMAND and entity.offset == 0:
+            return "command"
+    return "message"
+
+
+class _Lane:
+    __slots__ = ("name", "semaphore", "waiting")
+
+    def __init__(self, name: str, concurrency: int):
+        self.name = name
+        self.semaphore = asyncio.Semaphore(concurrency)
+        self.waiting = 0
+
+
+class _TopicQueue:
+    __slots__ = ("lock", "pending")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.pending = 0
+        """Апдейты топика в обработке и в очереди."""
+
+
+class TopicTurn:
+    """
+    Очередь топика и место в очереди апдейтов (`_Lane`), занятые обрабатываемым апдейтом.
+
+    Хэндлер может отдать их раньше, чем закончится, см `release_topic_turn` и `topic_turn_paused`.
+    """
+
+    def __init__(self, queue: _TopicQueue | None, lane: _Lane):
+        self._queue = queue
+        self._lane = lane
+        self.held = False
+
+    async def acquire(self) -> None:
+        # порядок как в TopicOrderedUpdateProcessor: сначала топик, потом место в очереди апдейтов
+        if self._queue is not None:
+            ts = time.monotonic()
+            await self._queue.lock.acquire()
+            metrics.observe("update_topic_wait_seconds", time.monotonic() - ts)
+        try:
+            await self._acquire_lane()
+        except BaseException:
+            if self._queue is not None:
+                self._queue.lock.release()
+            raise
+        self.held = True
+
+    async def _acquire_lane(self) -> None:
+        lane = self._lane
+        lane.waiting += 1
+        metrics.set("lane_queue_depth", lane.waiting, lane=lane.name)
+        ts = time.monotonic()
+        try:
+            await lane.semaphore.acquire()
+        finally:
+            lane.waiting -= 1
+            metrics.set("lane_queue_depth", lane.waiting, lane=lane.name)
+        metrics.observe("lane_wait_seconds", time.monotonic() - ts, lane=lane.name)
+
+    def release(self) -> None:
+        if not self.held:
+            return
+        self.held = False
+        self._lane.semaphore.release()
+        if self._queue is not None:
+            self._queue.lock.release()
+
+
+_current_turn: ContextVar[TopicTurn | None] = ContextVar("topic_turn", default=None)
+
+
+def release_topic_turn() -> None:
+    """
+    Отпустить очередь топика до конца обработки апдейта, например перед долгим запросом к ллм.
+
+    Следующие апдейты топика начнут обрабатываться, не дожидаясь ответа. Вне обработки апдейта ничего не делает.
+    """
+    turn = _current_turn.get()
+    if turn is not None:
+        turn.release()
+
+
+@asynccontextmanager
+async def topic_turn_paused() -> AsyncIterator[None]:
+    """
+    Отпустить очередь топика на время блока и снова встать в неё после.
+
+    Нужно, когда апдейт ждёт следующие апдейты этого же топика (части длинного сообщения).
+    """
+    turn = _current_turn.get()
+    if turn is None or not turn.held:
+        yield
+        return
+    turn.release()
+    try:
+        yield
+    finally:
+        await turn.acquire()
+
+
+class TopicOrderedUpdateProcessor(BaseUpdateProcessor):
+    """
+    Обработка апдейтов по порядку внутри чата/топика и параллельно между разными топиками.
+
+    Последовательность get_or_create/update настроек топика и переходы `state` одного топика
+    больше не пересекаются. Ответ ллм держит очередь топика до запроса к ллм и отпускает её
+    на время ожидания частей сообщения (`topic_turn_paused`) и самой генерации (`release_topic_turn`),
+    поэтому кнопка остановки и части длинного сообщения не ждут генерацию.
+
+    Команды и нажатия кнопок обрабатываются в своей очереди (`command`) с отдельным лимитом,
+    поэтому поток сообщений из занятых чатов их не задерживает.
+
+    :param max_concurrent_updates: сколько сообщений обрабатывается одновременно.
+    :param max_queue_per_topic: сколько апдейтов топика может ждать, лишние сообщения отбрасываются.
+    :param command_lane_concurrent: сколько команд и нажатий кнопок обрабатывается одновременно.
+    """
+
+    def __init__(self, max_concurrent_updates: int, max_queue_per_topic: int, command_lane_concurrent: int):
+        # общий семафор PTB не ограничивает: апдейт, ждущий в своей очереди, не должен занимать место команд
+        super().__init__(UNLIMITED)
+        self._max_queue_per_topic = max_queue_per_topic
+        self._queues: dict[TopicKey, _TopicQueue] = {}
+        self._lanes: dict[str, _Lane] = {
+            "message": _Lane("message", max_concurrent_updates),
+            "command": _Lane("command", command_lane_concurrent),
+        }
+
+    async def _run(self, update: object, queue: _TopicQueue | None, coroutine: Awaitable[Any]) -> None:
+        turn = TopicTurn(queue, self._lanes[get_lane(update)])
+        try:
+            await turn.acquire()
+        except BaseException:
+            coroutine.close()
+            raise
+        token = _current_turn.set(turn)
+        try:
+            await coroutine
+        finally:
+            _current_turn.reset(token)
+            turn.release()
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        key = get_topic_key(update)
+        if key is None:
+            await self._run(update, None, coroutine)
+            return
+
+        queue = self._queues.get(key)
+        if queue is None:
+            queue = self._queues[key] = _TopicQueue()
+        # команды и кнопки не отбрасываются: неотвеченная кнопка (например остановка генерации) так и крутится
+        if queue.pending >= self._max_queue_per_topic and get_lane(update) != "command":
+            coroutine.close()
+            metrics.inc("updates_dropped_total", reason="topic_queue_full")
+            logger.warning(f"topic queue full, update dropped: chat_id={key[0]}, topic_id={key[1]}")
+            return
+
+        queue.pending += 1
+        metrics.set("update_topics_active", len(self._queues))
+        try:
+            await self._run(update, queue, coroutine)
+        finally:
+            queue.pending -= 1
+            if queue.pending == 0 and self._queues.get(key) is queue:
+                del self._queues[key]
+            metrics.set("update_topics_active", len(self._queues))
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -0,0 +1,102 @@
+import asyncio
+import hmac
+import json
+import signal
+
+from aiohttp import web
+from telegram import Update
+from telegram.ext import Application
+
+from src.config import settings
+from src.tools.log import get_logger
+from src.tools.metrics import metrics
+
+logger = get_logger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def build_webhook_app(app: Application, secret_token: str) -> web.Application:
+    """
+    aiohttp приложение с эндпоинтом `settings.webhook_path` для апдейтов от Telegram.
+
+    Апдейт только проверяется и кладётся в `app.update_queue`, ответ 200 отправляется сразу,
+    обработка идёт в приложении бота как при polling.
+
+    Локально можно отправить записанный апдейт:
+    `curl -X POST localhost:8080/telegram -H "X-Telegram-Bot-Api-Secret-Token: <секрет>" -d @update.json`
+
+    :param app: приложение бота, уже запущенное (`initialize` + `start`).
+    :param secret_token: секрет, который Telegram присылает в заголовке `X-Telegram-Bot-Api-Secret-Token`.
+    """
+
+    secret = secret_token.encode()
+
+    async def handle_update(request: web.Request) -> web.Response:
+        # байты, а не str: compare_digest падает на не-ASCII строках, а заголовок присылает кто угодно
+        if not hmac.compare_digest(request.headers.get(SECRET_HEADER, "").encode(), secret):
+            metrics.inc("webhook_requests_total", status="forbidden")
+            return web.Response(status=403)
+        try:
+            data = await request.json()
+            if not isinstance(data, dict):
+                raise ValueError(f"update must be a json object, got {type(data).__name__}")
+            update = Update.de_json(data, app.bot)
+        except (json.JSONDecodeError, TypeError, KeyError, ValueError, AttributeError) as e:
+            metrics.inc("webhook_requests_total", status="bad_request")
+            logger.warning(f"webhook got malformed update: {e!r}")
+            return web.Response(status=400)
+        await app.update_queue.put(update)
+        metrics.inc("webhook_requests_total", status="ok")
+        return web.Response()
+
+    async def health(_request: web.Request) -> web.Response:
+        return web.Response(text="ok")
+
+    webhook_app = web.Application()
+    webhook_app.router.add_post(settings.webhook_path, handle_update)
+    webhook_app.router.add_get("/healthz", health)
+    return webhook_app
+
+
+async def run_webhook(app: Application) -> None:
+    """
+    Запуск бота в режиме webhook до SIGINT/SIGTERM.
+
+    Если задан `settings.webhook_url`, он регистрируется в Telegram, иначе сервер только слушает
+    (для локальной проверки записанными апдейтами).
+
+    :param app: приложение бота, собранное без updater, см `build_app`.
+    """
+    secret_token = settings.webhook_secret_token
+    if not secret_token:
+        raise ValueError("WEBHOOK_SECRET_TOKEN is required in webhook mode")
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+
+    async with app:
+        if app.post_init:
+            await app.post_init(app)
+        await app.start()
+        runner = web.AppRunner(build_webhook_app(app, secret_token))
+        await runner.setup()
+        site = web.TCPSite(runner, settings.webhook_listen, settings.webhook_port)
+        await site.start()
+        logger.info(f"webhook server started on {settings.webhook_listen}:{settings.webhook_port}{settings.webhook_path}")
+        try:
+            if settings.webhook_url:
+                await app.bot.set_webhook(
+                    url=settings.webhook_url,
+                    secret_token=secret_token,
+                    max_connections=settings.webhook_max_connections,
+                )
+                logger.info(f"webhook set: {settings.webhook_url}")
+            await stop.wait()
+        finally:
+            await runner.cleanup()
+            await app.stop()
+            if app.post_shutdown:
+                await app.post_shutdown(app)
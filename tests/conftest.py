@@ -0,0 +1,6 @@
+import os
+
+# src.config читает обязательные настройки из окружения при импорте
+os.environ.setdefault("BOT_TOKEN", "1:test")
+os.environ.setdefault("LLM_API_KEY", "test")
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017/")
@@ -0,0 +1,100 @@
+import asyncio
+
+import pytest
+
+from src.tools.debounce import Debouncer
+
+DELAY = 0.05
+
+
+def test_items_within_delay_form_one_batch():
+    async def main():
+        debouncer = Debouncer(DELAY)
+        loop = asyncio.get_running_loop()
+        assert debouncer.add("k", 1)
+        waiter = asyncio.create_task(debouncer.wait("k"))
+        await asyncio.sleep(DELAY / 2)
+        assert not debouncer.add("k", 2)
+        ts = loop.time()
+        assert await waiter == [1, 2]
+        # таймер переставлен на конец паузы после второго элемента
+        assert loop.time() - ts >= DELAY * 0.9
+        assert len(debouncer) == 0
+
+    asyncio.run(main())
+
+
+def test_late_wait_still_gets_batch_and_late_items_join_it():
+    async def main():
+        debouncer = Debouncer(DELAY)
+        debouncer.add("k", 1)
+        await asyncio.sleep(DELAY * 2)  # пауза закончилась до вызова wait
+        assert not debouncer.add("k", 2)
+        assert await debouncer.wait("k") == [1, 2]
+        assert "k" not in debouncer
+        assert debouncer.add("k", 3)  # следующая пачка
+
+    asyncio.run(main())
+
+
+def test_uncollected_batch_is_dropped():
+    async def main():
+        debouncer = Debouncer(DELAY, collect_timeout_sec=DELAY)
+        debouncer.add("k", 1)
+        await asyncio.sleep(DELAY * 3)
+        assert len(debouncer) == 0
+        assert debouncer.add("k", 2)
+
+    asyncio.run(main())
+
+
+def test_cancelled_waiter_drops_batch():
+    async def main():
+        debouncer = Debouncer(DELAY)
+        debouncer.add("k", 1)
+        waiter = asyncio.create_task(debouncer.wait("k"))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert len(debouncer) == 0
+        assert debouncer.add("k", 2)
+
+    asyncio.run(main())
+
+
+def test_discard_cancels_waiter():
+    async def main():
+        debouncer = Debouncer(DELAY)
+        debouncer.add("k", 1)
+        waiter = asyncio.create_task(debouncer.wait("k"))
+        await asyncio.sleep(0)
+        debouncer.discard("k")
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        assert len(debouncer) == 0
+
+    asyncio.run(main())
+
+
+def test_shorter_item_delay_fires_early():
+    async def main():
+        debouncer = Debouncer(10)
+        loop = asyncio.get_running_loop()
+        debouncer.add("k", 1)
+        debouncer.add("k", 2, delay=0)
+        ts = loop.time()
+        assert await debouncer.wait("k") == [1, 2]
+        assert loop.time() - ts < 1
+
+    asyncio.run(main())
+
+
+def test_zero_delay_does_not_race_waiter():
+    async def main():
+        debouncer = Debouncer(10)
+        debouncer.add("k", 1, delay=0)
+        await asyncio.sleep(0.01)  # таймер сработал до wait
+        assert await debouncer.wait("k") == [1]
+
+    asyncio.run(main())
@@ -0,0 +1,51 @@
+from src.app.model_search import ModelSearchIndex
+from src.models import AvailableModel
+
+
+def make_model(model_id: str, name: str) -> AvailableModel:
+    return AvailableModel.model_validate({
+        "id": model_id,
+        "canonical_slug": model_id,
+        "hugging_face_id": None,
+        "name": name,
+        "created": 0,
+        "description": "",
+        "context_length": 128_000,
+        "architecture": {
+            "modality": "text->text",
+            "input_modalities": ["text"],
+            "output_modalities": ["text"],
+            "tokenizer": "GPT",
+            "instruct_type": None,
+        },
+        "pricing": {"prompt": 0, "completion": 0},
+        "top_provider": {"context_length": 128_000, "max_completion_tokens": 4096, "is_moderated": False},
+        "per_request_limits": None,
+        "supported_parameters": [],
+    })
+
+
+INDEX = ModelSearchIndex([
+    make_model("openai/gpt-4o", "OpenAI: GPT-4o"),
+    make_model("openai/gpt-4.1-mini", "OpenAI: GPT-4.1 Mini"),
+    make_model("anthropic/claude-3.5-sonnet", "Anthropic: Claude 3.5 Sonnet"),
+])
+
+
+def search_ids(query: str) -> list[str]:
+    return [model.id for model in INDEX.search(query)]
+
+
+def test_exact_id_goes_first():
+    assert search_ids("openai/gpt-4.1-mini")[0] == "openai/gpt-4.1-mini"
+
+
+def test_query_without_separators_matches():
+    assert search_ids("gpt4")[:2] == ["openai/gpt-4o", "openai/gpt-4.1-mini"]
+    assert search_ids("gpt41")[0] == "openai/gpt-4.1-mini"
+    assert search_ids("claude35") == ["anthropic/claude-3.5-sonnet"]
+
+
+def test_all_words_must_match():
+    assert search_ids("gpt mini") == ["openai/gpt-4.1-mini"]
+    assert search_ids("claude mini") == []
@@ -0,0 +1,57 @@
+import asyncio
+
+from src.app.scheduler import FairScheduler
+
+
+def test_slot_is_free_after_cancel_then_release():
+    """Отменённое ожидание, ещё не вышедшее из `await`, не должно навсегда занимать очередь."""
+
+    async def main():
+        scheduler = FairScheduler(max_concurrent=1)
+        await scheduler._acquire(chat_id=1, user_id=1, cost=1)
+
+        waiter = asyncio.create_task(scheduler._acquire(chat_id=2, user_id=2, cost=1))
+        await asyncio.sleep(0)
+        assert scheduler.waiting == 1
+
+        # в одном шаге цикла: ожидание отменено, место освобождено, пришёл новый запрос
+        waiter.cancel()
+        scheduler._release()
+        arrival = scheduler._acquire(chat_id=3, user_id=3, cost=1)
+        try:
+            arrival.send(None)
+        except StopIteration:
+            pass
+        else:
+            arrival.close()
+            raise AssertionError("new request queued behind a cancelled waiter")
+        assert scheduler.running == 1
+
+        await asyncio.gather(waiter, return_exceptions=True)
+        assert scheduler.waiting == 0
+        scheduler._release()
+        assert scheduler.running == 0
+
+        async with asyncio.timeout(1), scheduler.slot(chat_id=4, user_id=4):
+            pass
+
+    asyncio.run(main())
+
+
+def test_quiet_chat_goes_before_busy_chat_backlog():
+    async def main():
+        scheduler = FairScheduler(max_concurrent=1)
+        order = []
+
+        async def request(chat_id: int, user_id: int):
+            async with scheduler.slot(chat_id, user_id):
+                order.append(chat_id)
+                await asyncio.sleep(0)
+
+        busy = [asyncio.create_task(request(chat_id=1, user_id=i)) for i in range(1, 5)]
+        await asyncio.sleep(0)
+        quiet = asyncio.create_task(request(chat_id=2, user_id=10))
+        await asyncio.gather(*busy, quiet)
+        assert order.index(2) <= 2
+
+    asyncio.run(main())
@@ -0,0 +1,216 @@
+import asyncio
+
+from telegram import Update
+
+from src.tools.update_processor import TopicOrderedUpdateProcessor, release_topic_turn, topic_turn_paused
+
+
+def message_update(update_id: int, chat_id: int = 1, text: str = "hi") -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": 0,
+            "chat": {"id": chat_id, "type": "private"},
+            "text": text,
+        },
+    }, None)
+
+
+def callback_update(update_id: int, chat_id: int = 1) -> Update:
+    return Update.de_json({
+        "update_id": update_id,
+        "callback_query": {
+            "id": str(update_id),
+            "from": {"id": 1, "is_bot": False, "first_name": "user"},
+            "chat_instance": "1",
+            "data": "stop_generation+1",
+            "message": {"message_id": 1, "date": 0, "chat": {"id": chat_id, "type": "private"}, "text": "Пишет..."},
+        },
+    }, None)
+
+
+def test_full_topic_drops_messages_but_not_callbacks():
+    async def main():
+        processor = TopicOrderedUpdateProcessor(8, max_queue_per_topic=2, command_lane_concurrent=8)
+        release = asyncio.Event()
+        done = []
+
+        async def handler(name: str):
+            await release.wait()
+            done.append(name)
+
+        tasks = [
+            asyncio.create_task(processor.process_update(message_update(i), handler(f"message{i}")))
+            for i in range(3)
+        ]
+        await asyncio.sleep(0)
+        tasks.append(asyncio.create_task(processor.process_update(callback_update(10), handler("callback"))))
+        await asyncio.sleep(0)
+        release.set()
+        await asyncio.gather(*tasks)
+        assert done == ["message0", "message1", "callback"]
+
+    asyncio.run(main())
+
+
+def test_updates_of_one_topic_run_in_order():
+    async def main():
+        processor = TopicOrderedUpdateProcessor(8, 20, 8)
+        log = []
+
+        async def handler(i: int):
+            log.append(("start", i))
+            await asyncio.sleep(0.01 * (5 - i))  # первые дольше последних
+            log.append(("end", i))
+
+        await asyncio.gather(*(processor.process_update(message_update(i), handler(i)) for i in range(5)))
+        assert log == [(event, i) for i in range(5) for event in ("start", "end")]
+        assert processor._queues == {}
+
+    asyncio.run(main())
+
+
+def test_different_topics_run_in_parallel():
+    async def main():
+        processor = TopicOrderedUpdateProcessor(8, 20, 8)
+        started = [asyncio.Event(), asyncio.Event()]
+
+        async def handler(i: int):
+            started[i].set()
+            await started[1 - i].wait()  # дождётся, только если второй топик идёт одновременно
+
+        async with asyncio.timeout(1):
+            await asyncio.gather(
+                processor.process_update(message_update(1, chat_id=1), handler(0)),
+                processor.process_update(message_update(2, chat_id=2), handler(1)),
+            )
+
+    asyncio.run(main())
+
+
+def test_paused_turn_lets_next_update_run_and_is_taken_back():
+    async def main():
+        processor = TopicOrderedUpdateProcessor(1, 20, 1)
+        log = []
+        second_done = asyncio.Event()
+
+        async def first():
+            log.append("first before pause")
+            async with topic_turn_paused():
+                await second_done.wait()  # второй апдейт топика проходит, пока первый ждёт
+            log.append("first after pause")
+
+        async def second():
+            log.append("second")
+            await asyncio.sleep(0.01)
+            second_done.set()
+
+        async def third():
+            log.append("third")
+
+        async with asyncio.timeout(1):
+            task = asyncio.create_task(processor.process_update(message_update(1), first()))
+            await asyncio.sleep(0)
+            await asyncio.gather(
+                task,
+                processor.process_update(message_update(2), second()),
+                processor.process_update(message_update(3), third()),
+            )
+        # после паузы первый снова встаёт в очередь топика, за уже ждущими апдейтами
+        assert log == ["first before pause", "second", "third", "first after pause"]
+
+    asyncio.run(main())
+
+
+def test_released_turn_is_not_held_until_handler_ends():
+    async def main():
+        processor = TopicOrderedUpdateProcessor(1, 20, 1)
+        generated = asyncio.Event()
+        log = []
+
+        async def first():
+            release_topic_turn()
+            await generated.wait()  # "генерация" ждёт, пока второй апдейт обработается
+            log.append("first")
+
+        async def second():
+            log.append("second")
+            generated.set()
+
+        async with asyncio.timeout(1):
+            task = asyncio.create_task(processor.process_update(message_update(1), first()))
+            await asyncio.sleep(0)
+            await asyncio.gather(task, processor.process_update(message_update(2), second()))
+        assert log == ["second", "first"]
+        assert processor._lanes["message"].semaphore._value == 1
+
+    asyncio.run(main())
+
+
+def test_cancelled_acquire_does_not_leak_lock_or_lane_slot():
+    async def main():
+        processor = TopicOrderedUpdateProcessor(1, 20, 1)
+        lane = processor._lanes["message"]
+        release = asyncio.Event()
+        resumed = asyncio.Event()
+        log = []
+
+        async def holder():
+            await release.wait()
+
+        blocker_started = asyncio.Event()
+
+        async def paused():
+            async with topic_turn_paused():
+                resumed.set()
+                await blocker_started.wait()
+            log.append("paused resumed")  # не дойдёт: отменён, пока ждал очередь топика
+
+        async def blocker():
+            blocker_started.set()
+            await release.wait()
+
+        async def handler(name: str):
+            log.append(name)
+
+        # ждёт место в очереди апдейтов (занято другим топиком) и отменяется
+        holding = asyncio.create_task(processor.process_update(message_update(1, chat_id=1), holder()))
+        await asyncio.sleep(0)
+        waiting_lane = asyncio.create_task(processor.process_update(message_update(2, chat_id=2), handler("lane")))
+        # ждёт очередь топика и отменяется
+        waiting_topic = asyncio.create_task(processor.process_update(message_update(3, chat_id=1), handler("topic")))
+        await asyncio.sleep(0)
+        # стоит в очереди топика за отменённым: если тот не отпустит очередь, этот зависнет
+        behind = asyncio.create_task(processor.process_update(message_update(6, chat_id=2), handler("behind")))
+        await asyncio.sleep(0)
+        waiting_lane.cancel()
+        waiting_topic.cancel()
+        release.set()
+        async with asyncio.timeout(1):
+            await asyncio.gather(holding, waiting_lane, waiting_topic, behind, return_exceptions=True)
+        assert log == ["behind"]
+        release.clear()
+
+        # отменяется, снова вставая в очередь топика после паузы
+        pausing = asyncio.create_task(processor.process_update(message_update(4, chat_id=3), paused()))
+        await resumed.wait()
+        blocking = asyncio.create_task(processor.process_update(message_update(5, chat_id=3), blocker()))
+        for _ in range(5):
+            await asyncio.sleep(0)
+        pausing.cancel()
+        await asyncio.gather(pausing, return_exceptions=True)
+        release.set()
+        await blocking
+
+        async with asyncio.timeout(1):
+            await asyncio.gather(*(
+                processor.process_update(message_update(10 + chat_id, chat_id=chat_id), handler(f"after{chat_id}"))
+                for chat_id in (1, 2, 3)
+            ))
+        assert log == ["behind", "after1", "after2", "after3"]
+        assert lane.semaphore._value == 1
+        assert lane.waiting == 0
+        assert processor._queues == {}
+
+    asyncio.run(main())
@@ -0,0 +1,53 @@
+import asyncio
+from types import SimpleNamespace
+
+from aiohttp.test_utils import TestClient, TestServer
+
+from src.config import settings
+from src.tools.webhook import build_webhook_app, SECRET_HEADER
+
+SECRET = "secret"
+
+
+def post_all(requests: list[tuple[dict, bytes]]) -> tuple[list[int], asyncio.Queue]:
+    """Отправить запросы в webhook и вернуть статусы ответов и очередь апдейтов."""
+
+    async def main():
+        app = SimpleNamespace(bot=None, update_queue=asyncio.Queue())
+        client = TestClient(TestServer(build_webhook_app(app, SECRET)))
+        await client.start_server()
+        try:
+            statuses = []
+            for headers, body in requests:
+                response = await client.post(settings.webhook_path, data=body, headers=headers)
+                statuses.append(response.status)
+            return statuses, app.update_queue
+        finally:
+            await client.close()
+
+    return asyncio.run(main())
+
+
+def test_valid_update_is_queued():
+    statuses, queue = post_all([({SECRET_HEADER: SECRET}, b'{"update_id": 1}')])
+    assert statuses == [200]
+    assert queue.get_nowait().update_id == 1
+
+
+def test_wrong_secret_is_forbidden():
+    statuses, queue = post_all([
+        ({}, b'{"update_id": 1}'),
+        ({SECRET_HEADER: "wrong"}, b'{"update_id": 1}'),
+        ({SECRET_HEADER: "секрет".encode().decode("latin-1")}, b'{"update_id": 1}'),
+    ])
+    assert statuses == [403, 403, 403]
+    assert queue.empty()
+
+
+def test_malformed_body_is_bad_request():
+    statuses, queue = post_all([
+        ({SECRET_HEADER: SECRET}, body)
+        for body in (b"{bad", b"null", b"[1]", b'"text"', b"{}")
+    ])
+    assert statuses == [400] * 5
+    assert queue.empty()